@@ -9,14 +9,51 @@
 #
 # Wymagania:
 #   pip install streamlit pandas
+#
+# Zapytania i agregaty (P&L, wiekowanie, zmiany, terminy) – vetfinance_data.py obok;
+# snapshot Parquet i tryb analityczny raportów – vetfinance_snapshot.py.
+# Kilka filii: VetFinanceClinics.json obok, np. {"Poznań": "poznan.db", "Gniezno": "gniezno.db"}.
 # =============================================================================
 
+import atexit
+import contextvars
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import tempfile
 import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import date, timedelta
 from calendar import monthrange
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+import vetfinance_data as vd
+import vetfinance_snapshot as vs
+
+try:  # opcjonalnie – eksport do Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:  # opcjonalnie – import z XLSX
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
 # ------------------ KONTA ------------------
 USERS = {
     "admin":     {"password": "Grubybob",      "role": "admin",     "full_name": "Administrator"},
@@ -25,199 +62,2440 @@ USERS = {
 
 DB = "VetFinanceDB1.db"
 
-# ------------------ DB ---------------------
+# ------------------ FILIE -----------------------
+# Każda filia (gabinet) ma własny plik bazy – shard z osobną pulą połączeń, kolejką zapisów,
+# cache i snapshotem, więc nowa filia nie spowalnia pozostałych. Sesja wybiera filię w panelu
+# bocznym; plik bieżącej filii niesie ContextVar (do wątków load_parallel() i kolejki zapisów).
+# Lista filii: CLINICS_FILE = {"Nazwa": "plik.db", ...}; bez pliku – jedna filia w DB.
+CLINICS_FILE = "VetFinanceClinics.json"
+DEFAULT_CLINIC = "Gabinet"
+CLINIC_FANOUT_WORKERS = 8  # ile filii odpytujemy naraz w zestawieniach zbiorczych
+
+def clinics() -> dict:
+    try:
+        with open(CLINICS_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {DEFAULT_CLINIC: DB}
+
+@st.cache_resource
+def clinic_context() -> contextvars.ContextVar:
+    # przy zasobie, nie w module (jak kontekst profilera) – ta sama zmienna we wszystkich przebiegach
+    return contextvars.ContextVar("clinic_db", default=DB)
+
+def clinic_db() -> str:
+    """Plik bazy filii bieżącej sesji (poza sesją – DB)."""
+    return clinic_context().get()
+
+# ------------------ INSTRUMENTACJA --------------
+# Każde zapytanie (SQL, parametry, wiersze, czas) i każdy odcinek przebiegu (strona, widok,
+# init_db) trafia do ograniczonych buforów profilera; dla wolnych SELECT-ów dopisujemy
+# skrót EXPLAIN QUERY PLAN. Kontekst (strona, nr przebiegu) niesie ContextVar – także do
+# wątków load_parallel().
+PROFILE_MAX_QUERIES = 5000
+PROFILE_MAX_SPANS = 2000
+SLOW_QUERY_MS = 50.0
+
+class Profiler:
+    """Bufory zdarzeń zapytań i spanów, bezpieczne wątkowo (wspólne dla wszystkich sesji)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = deque(maxlen=PROFILE_MAX_QUERIES)
+        self._spans = deque(maxlen=PROFILE_MAX_SPANS)
+        self._reruns = 0
+        # przy instancji, nie w module: Streamlit wykonuje skrypt od nowa przy każdym przebiegu
+        self.context = contextvars.ContextVar("profile_ctx", default=("—", 0))  # (strona, nr przebiegu)
+
+    def next_rerun(self) -> int:
+        with self._lock:
+            self._reruns += 1
+            return self._reruns
+
+    def record_query(self, sql: str, params, rows, ms: float, cached: bool = False, plan: str = ""):
+        page, rerun = self.context.get()
+        event = {"ts": time.time(), "strona": page, "przebieg": rerun, "sql": " ".join(sql.split()),
+                 "parametry": repr(_params_key(params))[:200], "wiersze": rows, "ms": round(ms, 3),
+                 "cache": cached, "plan": plan}
+        with self._lock:
+            self._queries.append(event)
+
+    def record_span(self, name: str, ms: float):
+        page, rerun = self.context.get()
+        with self._lock:
+            self._spans.append({"ts": time.time(), "strona": page, "przebieg": rerun,
+                                "span": name, "ms": round(ms, 3)})
+
+    def queries_df(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame(list(self._queries))
+
+    def spans_df(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame(list(self._spans))
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+            self._spans.clear()
+
+    def to_json(self) -> str:
+        with self._lock:
+            data = {"queries": list(self._queries), "spans": list(self._spans)}
+        return json.dumps(data, ensure_ascii=False, default=str, indent=1)
+
+@st.cache_resource
+def get_profiler() -> Profiler:
+    return Profiler()
+
+@contextmanager
+def span(name: str):
+    # `with span("widok: Trend"):` – czas odcinka przebiegu w profilerze
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_profiler().record_span(name, (time.perf_counter() - t0) * 1000)
+
+@contextmanager
+def profiled_rerun(page: str):
+    prof = get_profiler()
+    token = prof.context.set((page, prof.next_rerun()))
+    try:
+        with span("przebieg"):
+            yield
+    finally:
+        prof.context.reset(token)
+
+def _plan_summary(conn, sql: str, params) -> str:
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return ""
+    try:
+        return " | ".join(query_plan(conn, sql, params or ()))
+    except sqlite3.Error:
+        return ""
+
+class ProfiledConnection(sqlite3.Connection):
+    # conn.execute / conn.executemany z pomiarem; EXPLAIN-y (z _plan_summary) pomijamy
+    def execute(self, sql, params=(), /):
+        t0 = time.perf_counter()
+        cur = super().execute(sql, params)
+        ms = (time.perf_counter() - t0) * 1000
+        if not sql.lstrip().upper().startswith("EXPLAIN"):
+            plan = _plan_summary(self, sql, params) if ms >= SLOW_QUERY_MS else ""
+            get_profiler().record_query(sql, params, cur.rowcount if cur.rowcount >= 0 else None, ms, plan=plan)
+        return cur
+
+    def executemany(self, sql, seq_of_params, /):
+        t0 = time.perf_counter()
+        cur = super().executemany(sql, seq_of_params)
+        get_profiler().record_query(sql, ("executemany",), cur.rowcount, (time.perf_counter() - t0) * 1000)
+        return cur
+
+# ------------------ DB: PULA POŁĄCZEŃ ------------
+# Ustawienia każdego połączenia z puli (WAL pozwala czytać w trakcie zapisu).
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA foreign_keys=ON;",
+    "PRAGMA mmap_size=268435456;",   # 256 MB
+    "PRAGMA cache_size=-16000;",     # ~16 MB na połączenie
+    "PRAGMA temp_store=MEMORY;",
+)
+# Połączenia tylko do odczytu (SELECT-y, równoległe ładowanie) – w WAL nie blokują zapisu.
+DB_PRAGMAS_READONLY = (
+    "PRAGMA query_only=ON;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA cache_size=-16000;",
+    "PRAGMA temp_store=MEMORY;",
+)
+POOL_MAX_IDLE = 8  # ile bezczynnych połączeń trzymamy; nadmiarowe są zamykane przy zwrocie
+DB_BUSY_TIMEOUT_S = 10.0  # tyle zapis czeka na zwolnienie blokady, zanim zgłosi „database is locked”
+
+def open_connection(path: str, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT_S,
+                               check_same_thread=False, factory=ProfiledConnection)
+    else:
+        conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_S, check_same_thread=False,
+                               factory=ProfiledConnection)
+    for pragma in DB_PRAGMAS_READONLY if readonly else DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Pula długożyjących połączeń do jednego pliku bazy, współdzielona przez wszystkie sesje.
+
+    Połączenie jest wypożyczane na czas bloku `with` i wraca do puli po commit/rollback.
+    """
+
+    def __init__(self, path: str, max_idle: int = POOL_MAX_IDLE, readonly: bool = False):
+        self.path = path
+        self.max_idle = max_idle
+        self.readonly = readonly
+        self.closed = False
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "closed": 0, "in_use": 0, "peak_in_use": 0, "discarded": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_connection(self.path, readonly=self.readonly)
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Pula połączeń została zamknięta.")
+            conn = self._idle.pop() if self._idle else None
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+            if conn is not None:
+                self._stats["reused"] += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats["in_use"] -= 1
+                raise
+            with self._lock:
+                self._stats["created"] += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        if not broken and conn.in_transaction:
+            # nie oddajemy do puli połączenia z otwartą transakcją
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        with self._lock:
+            self._stats["in_use"] -= 1
+            keep = not broken and not self.closed and len(self._idle) < self.max_idle
+            if keep:
+                self._idle.append(conn)
+            else:
+                self._stats["closed"] += 1
+                if broken:
+                    self._stats["discarded"] += 1
+        if not keep:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._stats["closed"] += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"path": self.path, "readonly": self.readonly, "idle": len(self._idle),
+                    "max_idle": self.max_idle, **self._stats}
+
+@st.cache_resource(validate=lambda pool: not pool.closed)
+def get_pool(path: str = DB, readonly: bool = False) -> ConnectionPool:
+    pool = ConnectionPool(path, readonly=readonly)
+    atexit.register(pool.close_all)
+    return pool
+
 def cnx():
-    return sqlite3.connect(DB, check_same_thread=False)
+    # `with cnx() as conn:` – commit przy wyjściu, rollback przy wyjątku, połączenie wraca do puli filii
+    return get_pool(clinic_db()).connection()
+
+def ro_cnx():
+    # osobne połączenie tylko do odczytu – bezpieczne z wielu wątków naraz
+    return get_pool(clinic_db(), readonly=True).connection()
+
+def db_pool_stats() -> dict:
+    return {"zapis": get_pool(clinic_db()).stats(), "odczyt": get_pool(clinic_db(), readonly=True).stats()}
+
+# ------------------ DB: KOLEJKA ZAPISÓW ----------
+# Zapisy z formularzy wszystkich sesji idą przez jeden wątek piszący: bierze wszystko, co czeka
+# w kolejce (do WRITE_BATCH_MAX), wykonuje każde żądanie we własnym SAVEPOINT (gdy jest ich
+# więcej niż jedno) i zatwierdza partię jednym COMMIT. Sesja czeka na potwierdzenie swojego
+# żądania. Klucz idempotencji trafia do write_log w tej samej transakcji – ponowne wysłanie
+# formularza zwraca wynik pierwszego zapisu zamiast dopisywać duplikat.
+WRITE_BATCH_MAX = 256
+WRITE_ACK_TIMEOUT_S = 30.0
+WRITE_LOG_KEEP_DAYS = 7
+WRITE_LOG_PRUNE_EVERY = 500  # co tyle partii czyścimy stare klucze
+
+class WriteQueue:
+    """Kolejka żądań zapisu `fn(conn) -> wynik` z jednym wątkiem piszącym i grupowym commitem.
+
+    `fn` nie może sam robić commit/rollback; wynik musi dać się zapisać w JSON (np. id wiersza).
+    """
+
+    def __init__(self, path: str, batch_max: int = WRITE_BATCH_MAX):
+        self.path = path
+        self.batch_max = batch_max
+        self.closed = False
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "duplicates": 0, "errors": 0, "max_batch": 0,
+                       "commit_ms": 0.0}
+        self._thread = threading.Thread(target=self._run, name="vetfinance-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, key: str = None) -> Future:
+        if self.closed:
+            raise RuntimeError("Kolejka zapisów została zamknięta.")
+        fut = Future()
+        # kontekst sesji (strona w profilerze) idzie razem z żądaniem do wątku piszącego
+        self._queue.put((fn, key, contextvars.copy_context(), fut))
+        return fut
+
+    def write(self, fn, key: str = None, timeout: float = WRITE_ACK_TIMEOUT_S) -> dict:
+        """Zapis z potwierdzeniem: {"result", "duplicate", "batch", "ms"}; błąd SQL żądania jest zgłaszany tutaj."""
+        try:
+            return self.submit(fn, key).result(timeout=timeout)
+        except FutureTimeout:
+            raise sqlite3.OperationalError(f"Brak potwierdzenia zapisu w {timeout:.0f} s.") from None
+
+    def _run(self):
+        conn = open_connection(self.path)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < self.batch_max:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._queue.put(None)  # dokończ partię, zakończ w następnym obiegu
+                        break
+                    batch.append(item)
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch: list):
+        t0 = time.perf_counter()
+        outcomes = []
+        # pojedyncze żądanie nie potrzebuje SAVEPOINT (jego błąd i tak wycofuje całą transakcję),
+        # a SAVEPOINT przy dużych paczkach z triggerami (import) wyraźnie spowalnia INSERT-y
+        nested = len(batch) > 1
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, key, ctx, fut in batch:
+                row = conn.execute("SELECT result FROM write_log WHERE idem_key=?", (key,)).fetchone() if key else None
+                if row is not None:
+                    outcomes.append((fut, {"result": json.loads(row[0]), "duplicate": True}))
+                    continue
+                if nested:
+                    conn.execute("SAVEPOINT write_request")
+                try:
+                    result = ctx.run(fn, conn)
+                    if key:
+                        conn.execute("INSERT INTO write_log (idem_key, result) VALUES (?, ?)",
+                                     (key, json.dumps(result, default=str)))
+                    if nested:
+                        conn.execute("RELEASE write_request")
+                    outcomes.append((fut, {"result": result, "duplicate": False}))
+                except Exception as e:
+                    if not nested:
+                        raise
+                    conn.execute("ROLLBACK TO write_request")
+                    conn.execute("RELEASE write_request")
+                    outcomes.append((fut, e))
+            with self._lock:
+                batches = self._stats["batches"]
+            if batches % WRITE_LOG_PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM write_log WHERE created_at < datetime('now', ?)",
+                             (f"-{WRITE_LOG_KEEP_DAYS} days",))
+            conn.commit()
+        except Exception as e:
+            # nieudany BEGIN/COMMIT (albo jedyne żądanie partii) – cała partia wycofana, każde żądanie dostaje błąd
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            outcomes = [(fut, e) for _fn, _key, _ctx, fut in batch]
+        ms = (time.perf_counter() - t0) * 1000
+        errors = sum(isinstance(o, Exception) for _f, o in outcomes)
+        duplicates = sum(not isinstance(o, Exception) and o["duplicate"] for _f, o in outcomes)
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["errors"] += errors
+            self._stats["duplicates"] += duplicates
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            self._stats["commit_ms"] += ms
+        for fut, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                fut.set_exception(outcome)
+            else:
+                fut.set_result({**outcome, "batch": len(batch), "ms": round(ms, 3)})
+
+    def close(self, timeout: float = 5.0):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["commit_ms"] = round(stats["commit_ms"], 1)
+        return {"path": self.path, "pending": self._queue.qsize(), **stats}
+
+@st.cache_resource(validate=lambda wq: not wq.closed)
+def get_write_queue(path: str = DB) -> WriteQueue:
+    wq = WriteQueue(path)
+    atexit.register(wq.close)
+    return wq
+
+def write(fn, key: str = None) -> dict:
+    # `write(lambda conn: conn.execute(...).lastrowid)` – zapis przez kolejkę filii, czeka na potwierdzenie
+    return get_write_queue(clinic_db()).write(fn, key)
+
+def form_write_key(form: str, nonce: str) -> str:
+    return f"{form}:{nonce}"
+
+def form_nonce(form: str) -> str:
+    # klucz idempotencji narysowanego formularza – losowany przy rysowaniu, nowy dopiero po zapisie
+    return st.session_state.setdefault(f"_form_nonce_{form}", uuid.uuid4().hex)
+
+def entry_form(form: str, **kwargs):
+    # `with entry_form("..."):` zamiast `with st.form("..."):` dla formularzy zapisujących przez submit_form_write
+    form_nonce(form)
+    return st.form(form, **kwargs)
+
+def submit_form_write(form: str, fn, message: str) -> dict:
+    ack = write(fn, key=form_write_key(form, form_nonce(form)))
+    if ack["duplicate"]:
+        st.info("Ten formularz został już zapisany – pominięto ponowne wysłanie.")
+    else:
+        st.success(message)
+    # Nowy klucz dopiero po wyświetleniu komunikatu: drugie kliknięcie, które przerwało ten przebieg,
+    # trafia jeszcze w stary klucz (duplikat), a kolejny wpis – nawet z tymi samymi wartościami – w nowy.
+    st.session_state[f"_form_nonce_{form}"] = uuid.uuid4().hex
+    return ack
+
+# ------------------ DB: CACHE ZAPYTAŃ ------------
+# Wyniki SELECT-ów trzymamy w pamięci pod kluczem (filia, SQL, parametry) razem z wersjami
+# tabel, z których czytają (table_versions). Każdy zapis podbija wersję tabeli
+# triggerem, więc wpis z inną wersją jest nieaktualny i liczony od nowa.
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+QUERY_CACHE_MAX_ENTRIES = 256
+
+VERSIONED_TABLES = (
+    "daily_reports", "daily_report_techs", "ap_invoices", "ar_invoices", "leasings",
+    "employees", "shop_sales", "shop_expenses", "farm_reports", "bank_transactions", "salary_history",
+)
+# tabele pochodne -> tabele źródłowe, których wersje o nich decydują
+DERIVED_TABLES = {
+    "rollup_daily": ("daily_reports", "ar_invoices", "ap_invoices", "shop_sales", "shop_expenses", "farm_reports"),
+    "rollup_monthly": ("daily_reports", "ar_invoices", "ap_invoices", "shop_sales", "shop_expenses", "farm_reports"),
+    "staff_shifts_monthly": ("daily_reports", "daily_report_techs", "employees"),
+}
+
+class QueryCache:
+    """Cache LRU ramek danych z limitem liczby wpisów i zajętej pamięci."""
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES, max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()  # klucz -> (wersje, df, bajty)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] != versions:
+                self._drop(key)
+                self._stats["stale"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, versions, df: pd.DataFrame):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (versions, df, size)
+            self._bytes += size
+            while self._data and (self._bytes > self.max_bytes or len(self._data) > self.max_entries):
+                self._drop(next(iter(self._data)))
+                self._stats["evictions"] += 1
+
+    def _drop(self, key):
+        _versions, _df, size = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes, **self._stats}
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    return QueryCache()
+
+@lru_cache(maxsize=1024)
+def tables_in_sql(sql: str) -> tuple:
+    found = set()
+    for table in (*VERSIONED_TABLES, *DERIVED_TABLES):
+        if re.search(rf"\b{table}\b", sql):
+            found.update(DERIVED_TABLES.get(table, (table,)))
+    return tuple(sorted(found))
+
+def _params_key(params):
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+def _timed_read(conn, sql: str, params, types: dict = None) -> pd.DataFrame:
+    t0 = time.perf_counter()
+    if types:
+        # przez kursor (nie ProfiledConnection.execute) – czas zapisujemy niżej, raz
+        df = vd.query(conn.cursor(), sql, params or (), types)
+    else:
+        df = pd.read_sql_query(sql, conn, params=params)
+    ms = (time.perf_counter() - t0) * 1000
+    plan = _plan_summary(conn, sql, params) if ms >= SLOW_QUERY_MS else ""
+    get_profiler().record_query(sql, params, len(df), ms, plan=plan)
+    return df
+
+def _table_versions(conn, tables: tuple) -> tuple:
+    marks = ",".join("?" * len(tables))
+    return tuple(conn.execute(
+        f"SELECT tbl, version FROM table_versions WHERE tbl IN ({marks}) ORDER BY tbl", tables
+    ).fetchall())
+
+def read_df(sql: str, params=None, cache: bool = True, types: dict = None) -> pd.DataFrame:
+    """Wynik zapytania (cache per wersje tabel); `types` – jawne typy kolumn, np. vd.schema("ap_invoices")."""
+    tables = tables_in_sql(sql) if cache else ()
+    with ro_cnx() as conn:
+        if not tables:
+            return _timed_read(conn, sql, params, types)
+        versions = _table_versions(conn, tables)
+        key = (clinic_db(), sql, _params_key(params), tuple(sorted(types.items())) if types else ())
+        qcache = get_query_cache()
+        df = qcache.get(key, versions)
+        if df is None:
+            df = _timed_read(conn, sql, params, types)
+            qcache.put(key, versions, df)
+        else:
+            get_profiler().record_query(sql, params, len(df), 0.0, cached=True)
+    # kopia – strony dopisują kolumny do otrzymanych ramek
+    return df.copy()
+
+# ------------------ ŁADOWANIE RÓWNOLEGŁE --------
+LOADER_WORKERS = 4
+
+@st.cache_resource
+def get_loader() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=LOADER_WORKERS, thread_name_prefix="vetfinance-load")
+
+def load_parallel(tasks: dict) -> dict:
+    # niezależne odczyty naraz; każdy wątek bierze własne połączenie z puli tylko do odczytu
+    # kopia kontekstu per zadanie – zapytania z wątków trafiają do profilera z bieżącą stroną
+    futures = {name: get_loader().submit(contextvars.copy_context().run, fn) for name, fn in tasks.items()}
+    return {name: fut.result() for name, fut in futures.items()}
+
+@st.cache_resource
+def get_fanout() -> ThreadPoolExecutor:
+    # osobna pula: zadanie filii samo może wołać load_parallel() i nie może zająć jej wątków
+    return ThreadPoolExecutor(max_workers=CLINIC_FANOUT_WORKERS, thread_name_prefix="vetfinance-clinic")
+
+def _in_clinic(path: str, fn):
+    init_db(path)
+    return fn()
+
+def for_each_clinic(fn) -> dict:
+    """`fn()` naraz w każdej filii (jej pliku bazy, pulach i wpisach cache); wynik: filia -> wynik."""
+    futures = {}
+    for name, path in clinics().items():
+        ctx = contextvars.copy_context()
+        ctx.run(clinic_context().set, path)
+        futures[name] = get_fanout().submit(ctx.run, _in_clinic, path, fn)
+    return {name: fut.result() for name, fut in futures.items()}
+
+# ------------------ WARSTWA DANYCH ---------------
+# Funkcje z vetfinance_data biorą jawne połączenie; tu dostają połączenie z puli,
+# a ich wynik ląduje w tym samym cache co read_df – per wersje tabel z `fn.reads`.
+def service_call(fn, *args):
+    args = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+    tables = tables_in_sql(" ".join(fn.reads))
+    key = (clinic_db(), fn.__name__, args)
+    with ro_cnx() as conn:
+        versions = _table_versions(conn, tables)
+        qcache = get_query_cache()
+        result = qcache.get(key, versions)
+        if result is None:
+            result = fn(conn, *args)
+            qcache.put(key, versions, result)
+        else:
+            get_profiler().record_query(f"vd.{fn.__name__}", args, len(result), 0.0, cached=True)
+    return result.copy()
+
+# ------------------ SNAPSHOT I TRYB ANALITYCZNY --
+# Wątek w tle co SNAPSHOT_INTERVAL_S dopisuje zmienione partycje do snapshotu Parquet.
+# W trybie analitycznym (przełącznik admina) agregaty podsumowań i statystyk pracowników
+# liczymy ze snapshotu – wieloletnie skany nie czytają pliku bazy, do którego piszą
+# formularze. Dane są wtedy tak świeże jak ostatnie odświeżenie.
+SNAPSHOT_INTERVAL_S = 300
+
+def snapshot_dir(path: str) -> str:
+    # katalog snapshotu obok pliku bazy filii: VetFinanceDB1.db -> VetFinanceDB1.snapshot
+    return os.path.splitext(path)[0] + ".snapshot"
+
+def refresh_snapshot(pool: ConnectionPool, wq: WriteQueue, out_dir: str) -> dict:
+    # odczyt z połączenia tylko do odczytu, skasowanie obsłużonych znaczników przez kolejkę zapisów
+    with pool.connection() as conn:
+        stats = vs.refresh(conn, out_dir)
+    done = stats.pop("done")
+    if done:
+        wq.write(lambda conn: vs.clear_dirty(conn, done))
+    return stats
+
+class SnapshotWorker:
+    """Wątek odświeżający snapshot: od razu po starcie, potem co `interval` s albo na żądanie."""
+
+    def __init__(self, pool: ConnectionPool, wq: WriteQueue, out_dir: str,
+                 interval: float = SNAPSHOT_INTERVAL_S):
+        self.pool = pool
+        self.wq = wq
+        self.out_dir = out_dir
+        self.interval = interval
+        self.closed = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "errors": 0, "last": None, "last_error": None}
+        self._thread = threading.Thread(target=self._run, name="vetfinance-snapshot", daemon=True)
+        self._thread.start()
+
+    def refresh(self) -> dict:
+        try:
+            stats = refresh_snapshot(self.pool, self.wq, self.out_dir)
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = repr(e)
+            raise
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last"] = stats
+        return stats
+
+    def _run(self):
+        while not self.closed:
+            try:
+                self.refresh()
+            except Exception:
+                pass  # zapisane w stats(); następna próba w kolejnym obiegu
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def close(self, timeout: float = 5.0):
+        if self.closed:
+            return
+        self.closed = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"dir": self.out_dir, "interval_s": self.interval, **self._stats}
+
+@st.cache_resource(validate=lambda worker: worker is None or not worker.closed)
+def get_snapshot_worker(path: str = DB):
+    if pq is None:  # bez pyarrow nie ma snapshotu ani trybu analitycznego
+        return None
+    worker = SnapshotWorker(get_pool(path, readonly=True), get_write_queue(path), snapshot_dir(path))
+    atexit.register(worker.close)
+    return worker
+
+@st.cache_resource
+def analytic_mode() -> contextvars.ContextVar:
+    # przy zasobie, nie w module (jak kontekst profilera); load_parallel() kopiuje ją do wątków
+    return contextvars.ContextVar("analytic_mode", default=False)
+
+def snapshot_call(fn, *args):
+    # jak service_call, ale na snapshocie; wpis w cache ważny do następnej generacji snapshotu
+    args = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+    snap = vs.open_snapshot(snapshot_dir(clinic_db()))
+    key = ("snapshot", snap.dir, fn.__name__, args)
+    versions = (("snapshot", snap.generation),)
+    qcache = get_query_cache()
+    result = qcache.get(key, versions)
+    if result is None:
+        t0 = time.perf_counter()
+        result = fn(snap, *args)
+        get_profiler().record_query(f"vs.{fn.__name__}", args, len(result), (time.perf_counter() - t0) * 1000)
+        qcache.put(key, versions, result)
+    else:
+        get_profiler().record_query(f"vs.{fn.__name__}", args, len(result), 0.0, cached=True)
+    return result.copy()
+
+def analytics(fn, *args):
+    # `fn` z vetfinance_data; w trybie analitycznym jej odpowiednik ze snapshotu (gdy snapshot gotowy)
+    if analytic_mode().get() and pq is not None:
+        try:
+            if vs.open_snapshot(snapshot_dir(clinic_db())).ready:
+                return snapshot_call(getattr(vs, fn.__name__), *args)
+        except (OSError, ValueError, KeyError):
+            pass  # uszkodzony / podmieniany snapshot – liczymy z bazy
+    return service_call(fn, *args)
+
+# ------------------ DB ---------------------
 
 def ym_bounds(y:int, m:int):
     first = date(y, m, 1)
     last = date(y, m, monthrange(y, m)[1])
     return first, last
 
-def init_db():
-    with cnx() as conn:
-        conn.execute("PRAGMA foreign_keys = ON;")
-
-        # Recepcja: raport dzienny
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                report_date TEXT NOT NULL,
-                shift TEXT CHECK(shift IN ('poranna','popołudniowa')) NOT NULL,
-                kasa REAL DEFAULT 0,
-                terminal REAL DEFAULT 0,
-                uwagi TEXT,
-                staff_vet TEXT,
-                staff_tech TEXT
-            );
-        """)
+# ------------------ DB: MIGRACJE ---------------
+# Każdy krok jest numerowany i idempotentny; numer ostatniego wykonanego kroku
+# trzymamy w PRAGMA user_version, więc kolejne uruchomienia nic nie robią.
+def _m001_base_schema(conn):
+    # Recepcja: raport dzienny
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_date TEXT NOT NULL,
+            shift TEXT CHECK(shift IN ('poranna','popołudniowa')) NOT NULL,
+            kasa REAL DEFAULT 0,
+            terminal REAL DEFAULT 0,
+            uwagi TEXT,
+            staff_vet TEXT,
+            staff_tech TEXT
+        );
+    """)
+
+    # Wielu techników do jednego raportu
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_report_techs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            daily_report_id INTEGER NOT NULL,
+            tech_name TEXT NOT NULL,
+            FOREIGN KEY(daily_report_id) REFERENCES daily_reports(id) ON DELETE CASCADE
+        );
+    """)
+
+    # Faktury kosztowe (AP)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ap_invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_date TEXT NOT NULL,
+            due_date     TEXT NOT NULL,
+            supplier     TEXT NOT NULL,
+            number       TEXT,
+            category     TEXT,
+            amount       REAL NOT NULL,
+            notes        TEXT,
+            paid         INTEGER DEFAULT 0,
+            paid_date    TEXT
+        );
+    """)
+
+    # NOWE: Faktury przychodowe (AR) – pełen obieg
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ar_invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            issue_date  TEXT NOT NULL,  -- data wystawienia
+            due_date    TEXT NOT NULL,  -- termin zapłaty
+            company     TEXT NOT NULL,
+            number      TEXT,
+            category    TEXT,
+            amount      REAL NOT NULL,
+            notes       TEXT,
+            paid        INTEGER DEFAULT 0,
+            paid_date   TEXT           -- uzupełniane po opłaceniu
+        );
+    """)
+
+    # Leasingi
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leasings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name           TEXT NOT NULL,
+            monthly_amount REAL NOT NULL,
+            start_date     TEXT NOT NULL,
+            end_date       TEXT NOT NULL,
+            notes          TEXT
+        );
+    """)
+
+    # Pracownicy
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            role TEXT CHECK(role IN ('lekarz','technik')) NOT NULL,
+            monthly_salary REAL DEFAULT 0,
+            active INTEGER DEFAULT 1
+        );
+    """)
+
+    # Sklep
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_date TEXT NOT NULL,
+            kasa REAL DEFAULT 0,
+            terminal REAL DEFAULT 0
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expense_date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            invoice_number TEXT,
+            supplier TEXT,
+            paid INTEGER DEFAULT 0
+        );
+    """)
+
+    # Zwierzęta hodowlane
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS farm_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_date TEXT NOT NULL,
+            typ TEXT CHECK(typ IN ('magazyn','teren')) NOT NULL,
+            kwota REAL DEFAULT 0,
+            uwagi TEXT
+        );
+    """)
+
+    # Seed przykładowych pracowników (jeśli pusto)
+    existing = {r[0] for r in conn.execute("SELECT name FROM employees").fetchall()}
+    seed_vets = []
+    seed_techs = []
+    for n in seed_vets:
+        if n not in existing:
+            conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'lekarz', 1)", (n,))
+    for n in seed_techs:
+        if n not in existing:
+            conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'technik', 1)", (n,))
+
+def _m002_daily_report_techs_backfill(conn):
+    # Migracja starego pola staff_tech (jeśli było)
+    conn.execute("""
+        INSERT INTO daily_report_techs (daily_report_id, tech_name)
+        SELECT r.id, r.staff_tech
+        FROM daily_reports r
+        WHERE r.staff_tech IS NOT NULL AND r.staff_tech <> ''
+          AND NOT EXISTS (SELECT 1 FROM daily_report_techs t WHERE t.daily_report_id = r.id)
+    """)
+
+def _m003_ar_paid_invoices(conn):
+    # MIGRACJA ze starej ar_paid_invoices (jeśli była)
+    try:
+        has_old = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='ar_paid_invoices'"
+        ).fetchone()
+        if has_old:
+            # skopiuj tylko jeśli ar_invoices jest pusta
+            cnt_new = conn.execute("SELECT COUNT(*) FROM ar_invoices").fetchone()[0]
+            if cnt_new == 0:
+                conn.execute("""
+                    INSERT INTO ar_invoices (issue_date, paid_date, company, number, category, amount, notes, paid, due_date)
+                    SELECT COALESCE(issue_date, paid_date), paid_date, company, number, category, amount, notes, 1,
+                           COALESCE(paid_date, date(paid_date))
+                    FROM ar_paid_invoices
+                """)
+    except Exception:
+        pass
+
+# Kolumny z datami – przechowujemy je jako ISO 'YYYY-MM-DD', dzięki czemu
+# filtry `kolumna BETWEEN ? AND ?` działają bez date()/strftime() i trafiają w indeksy.
+DATE_COLUMNS = {
+    "daily_reports": ("report_date",),
+    "ap_invoices": ("invoice_date", "due_date", "paid_date"),
+    "ar_invoices": ("issue_date", "due_date", "paid_date"),
+    "leasings": ("start_date", "end_date"),
+    "shop_sales": ("sale_date",),
+    "shop_expenses": ("expense_date",),
+    "farm_reports": ("report_date",),
+}
 
-        # Wielu techników do jednego raportu
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS daily_report_techs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                daily_report_id INTEGER NOT NULL,
-                tech_name TEXT NOT NULL,
-                FOREIGN KEY(daily_report_id) REFERENCES daily_reports(id) ON DELETE CASCADE
-            );
-        """)
-        # Migracja starego pola staff_tech (jeśli było)
-        conn.execute("""
-            INSERT INTO daily_report_techs (daily_report_id, tech_name)
-            SELECT r.id, r.staff_tech
-            FROM daily_reports r
-            WHERE r.staff_tech IS NOT NULL AND r.staff_tech <> ''
-              AND NOT EXISTS (SELECT 1 FROM daily_report_techs t WHERE t.daily_report_id = r.id)
-        """)
+def _m004_iso_dates_and_indexes(conn):
+    for table, cols in DATE_COLUMNS.items():
+        for col in cols:
+            # tylko wartości rozpoznawalne jako data (np. z godziną) – resztę zostawiamy
+            conn.execute(f"UPDATE {table} SET {col}=date({col}) WHERE date({col}) IS NOT NULL AND {col}<>date({col})")
+
+    # indeksy złożone / pokrywające pod filtry po dacie
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS idx_daily_reports_date ON daily_reports(report_date, kasa, terminal)",
+        "CREATE INDEX IF NOT EXISTS idx_daily_report_techs_report ON daily_report_techs(daily_report_id, tech_name)",
+        "CREATE INDEX IF NOT EXISTS idx_ap_paid_date ON ap_invoices(paid, paid_date, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_ap_paid_due ON ap_invoices(paid, due_date)",
+        "CREATE INDEX IF NOT EXISTS idx_ar_paid_date ON ar_invoices(paid, paid_date, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_ar_paid_due ON ar_invoices(paid, due_date)",
+        "CREATE INDEX IF NOT EXISTS idx_ar_issue_date ON ar_invoices(issue_date)",
+        "CREATE INDEX IF NOT EXISTS idx_leasings_range ON leasings(start_date, end_date, monthly_amount)",
+        "CREATE INDEX IF NOT EXISTS idx_shop_sales_date ON shop_sales(sale_date, kasa, terminal)",
+        "CREATE INDEX IF NOT EXISTS idx_shop_expenses_date ON shop_expenses(expense_date)",
+        "CREATE INDEX IF NOT EXISTS idx_shop_expenses_paid_date ON shop_expenses(paid, expense_date, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_farm_reports_date ON farm_reports(report_date, typ, kwota)",
+        "CREATE INDEX IF NOT EXISTS idx_farm_reports_typ_date ON farm_reports(typ, report_date)",
+    ):
+        conn.execute(ddl)
+
+# ------------------ DB: AGREGATY (rollup) -------
+# Sumy dzienne i miesięczne per źródło, utrzymywane triggerami przy każdym
+# INSERT/UPDATE/DELETE (także „Cofnij płatność” i usuwanie raportów).
+# źródło -> (tabela, kolumna daty, kwota, warunek); {r} = NEW / OLD / alias tabeli
+ROLLUP_SOURCES = {
+    "clinic":       ("daily_reports", "report_date",  "IFNULL({r}.kasa,0)+IFNULL({r}.terminal,0)", "1"),
+    "ar_paid":      ("ar_invoices",   "paid_date",    "{r}.amount", "{r}.paid=1"),
+    "ap_paid":      ("ap_invoices",   "paid_date",    "{r}.amount", "{r}.paid=1"),
+    "shop_sales":   ("shop_sales",    "sale_date",    "IFNULL({r}.kasa,0)+IFNULL({r}.terminal,0)", "1"),
+    "shop_paid":    ("shop_expenses", "expense_date", "{r}.amount", "{r}.paid=1"),
+    "farm_magazyn": ("farm_reports",  "report_date",  "IFNULL({r}.kwota,0)", "{r}.typ='magazyn'"),
+    "farm_teren":   ("farm_reports",  "report_date",  "IFNULL({r}.kwota,0)", "{r}.typ='teren'"),
+}
 
-        # Faktury kosztowe (AP)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS ap_invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                invoice_date TEXT NOT NULL,
-                due_date     TEXT NOT NULL,
-                supplier     TEXT NOT NULL,
-                number       TEXT,
-                category     TEXT,
-                amount       REAL NOT NULL,
-                notes        TEXT,
-                paid         INTEGER DEFAULT 0,
-                paid_date    TEXT
-            );
+def _rollup_upsert(source: str, r: str, sign: str) -> str:
+    table, date_col, amount, cond = ROLLUP_SOURCES[source]
+    day = f"{r}.{date_col}"
+    amount = amount.format(r=r)
+    where = f"{cond.format(r=r)} AND {day} IS NOT NULL"
+    return f"""
+        INSERT INTO rollup_daily (day, source, amount, cnt)
+        SELECT {day}, '{source}', {sign}({amount}), {sign}1 WHERE {where}
+        ON CONFLICT(day, source) DO UPDATE SET amount=amount+excluded.amount, cnt=cnt+excluded.cnt;
+        INSERT INTO rollup_monthly (ym, source, amount, cnt)
+        SELECT substr({day}, 1, 7), '{source}', {sign}({amount}), {sign}1 WHERE {where}
+        ON CONFLICT(ym, source) DO UPDATE SET amount=amount+excluded.amount, cnt=cnt+excluded.cnt;"""
+
+def create_rollup_triggers(conn):
+    for source, (table, *_rest) in ROLLUP_SOURCES.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{source}_ins")
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{source}_del")
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{source}_upd")
+        conn.execute(f"CREATE TRIGGER trg_rollup_{source}_ins AFTER INSERT ON {table} BEGIN"
+                     f"{_rollup_upsert(source, 'NEW', '')} END")
+        conn.execute(f"CREATE TRIGGER trg_rollup_{source}_del AFTER DELETE ON {table} BEGIN"
+                     f"{_rollup_upsert(source, 'OLD', '-')} END")
+        conn.execute(f"CREATE TRIGGER trg_rollup_{source}_upd AFTER UPDATE ON {table} BEGIN"
+                     f"{_rollup_upsert(source, 'OLD', '-')}{_rollup_upsert(source, 'NEW', '')} END")
+
+def _rollup_from_base_sql() -> str:
+    # sumy dzienne policzone wprost z tabel źródłowych
+    parts = []
+    for source, (table, date_col, amount, cond) in ROLLUP_SOURCES.items():
+        parts.append(
+            f"SELECT t.{date_col} AS day, '{source}' AS source, SUM({amount.format(r='t')}) AS amount, COUNT(*) AS cnt "
+            f"FROM {table} t WHERE {cond.format(r='t')} AND t.{date_col} IS NOT NULL GROUP BY t.{date_col}"
+        )
+    return " UNION ALL ".join(parts)
+
+def rebuild_rollups(conn):
+    conn.execute("DELETE FROM rollup_daily")
+    conn.execute("DELETE FROM rollup_monthly")
+    conn.execute(f"INSERT INTO rollup_daily (day, source, amount, cnt) {_rollup_from_base_sql()}")
+    conn.execute("""
+        INSERT INTO rollup_monthly (ym, source, amount, cnt)
+        SELECT substr(day, 1, 7), source, SUM(amount), SUM(cnt) FROM rollup_daily GROUP BY 1, 2
+    """)
+
+def check_rollups(conn, tolerance: int = 0) -> pd.DataFrame:
+    # różnice między rollup_daily a tabelami źródłowymi (pusta ramka = spójne)
+    base = pd.read_sql_query(_rollup_from_base_sql(), conn)
+    roll = pd.read_sql_query("SELECT day, source, amount, cnt FROM rollup_daily WHERE cnt<>0 OR ABS(amount)>?",
+                             conn, params=(tolerance,))
+    cmp = base.merge(roll, on=["day", "source"], how="outer", suffixes=("_base", "_rollup")).fillna(0)
+    bad = ((cmp["amount_base"] - cmp["amount_rollup"]).abs() > tolerance) | (cmp["cnt_base"] != cmp["cnt_rollup"])
+    return cmp[bad].reset_index(drop=True)
+
+def _m005_rollups(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_daily (
+            day    TEXT NOT NULL,
+            source TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            cnt    INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, source)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_monthly (
+            ym     TEXT NOT NULL,
+            source TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            cnt    INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (ym, source)
+        ) WITHOUT ROWID;
+    """)
+    create_rollup_triggers(conn)
+    rebuild_rollups(conn)
+
+# ------------------ DB: WERSJE TABEL ------------
+# Licznik zmian per tabela (podbijany triggerami) – klucz unieważniania cache.
+def create_version_triggers(conn, tables):
+    for table in tables:
+        conn.execute("INSERT OR IGNORE INTO table_versions (tbl, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_version_{table}_{event.lower()}")
+            conn.execute(f"""
+                CREATE TRIGGER trg_version_{table}_{event.lower()} AFTER {event} ON {table}
+                FOR EACH ROW BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE tbl = '{table}';
+                END
+            """)
+
+def _m006_table_versions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            tbl     TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    create_version_triggers(conn, ("leasings",))
+
+def _m007_all_table_versions(conn):
+    # tabele dodane w późniejszych migracjach dostają triggery razem ze swoim schematem
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    create_version_triggers(conn, [t for t in VERSIONED_TABLES if t in existing])
+
+def _m008_search_indexes(conn):
+    # LIKE 'prefiks%' (domyślnie bez rozróżniania wielkości liter) korzysta tylko z indeksu NOCASE
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS idx_ap_supplier_nocase ON ap_invoices(supplier COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_ap_number_nocase ON ap_invoices(number COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_ar_company_nocase ON ar_invoices(company COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_ar_number_nocase ON ar_invoices(number COLLATE NOCASE)",
+    ):
+        conn.execute(ddl)
+
+# ------------------ DB: WYSZUKIWANIE (FTS5) -----
+# Indeksy FTS5 z zewnętrzną treścią (content=tabela) utrzymywane triggerami.
+# unicode61 usuwa ogonki poza „ł”, dlatego ł→l składamy sami (indeks i zapytanie).
+# tabela -> (moduł, kolumny indeksowane, kolumna daty, opis, kwota)
+SEARCH_SOURCES = {
+    "ap_invoices": ("Faktury kosztowe", ("supplier", "number", "category", "notes"),
+                    "invoice_date", "t.supplier || IFNULL(' | ' || t.number, '')", "t.amount"),
+    "ar_invoices": ("Faktury AR", ("company", "number", "category", "notes"),
+                    "issue_date", "t.company || IFNULL(' | ' || t.number, '')", "t.amount"),
+    "daily_reports": ("Recepcja", ("staff_vet", "staff_tech", "uwagi"),
+                      "report_date", "t.shift || IFNULL(' | ' || t.staff_vet, '')", "t.kasa + t.terminal"),
+    "shop_expenses": ("Sklep – wydatki", ("supplier", "invoice_number"),
+                      "expense_date", "IFNULL(t.supplier, '') || IFNULL(' | ' || t.invoice_number, '')", "t.amount"),
+    "farm_reports": ("Zwierzęta", ("typ", "uwagi"),
+                     "report_date", "t.typ", "t.kwota"),
+}
+SEARCH_LIMIT = 50
+
+def _fts_fold_sql(expr: str) -> str:
+    return f"replace(replace({expr}, 'ł', 'l'), 'Ł', 'L')"
+
+def _fts_fold(text: str) -> str:
+    return text.replace("ł", "l").replace("Ł", "L")
+
+def create_search_triggers(conn, table, cols):
+    fts = f"fts_{table}"
+    names = ", ".join(cols)
+    new = ", ".join(_fts_fold_sql(f"new.{c}") for c in cols)
+    old = ", ".join(_fts_fold_sql(f"old.{c}") for c in cols)
+    insert = f"INSERT INTO {fts} (rowid, {names}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    for event, body in (("INSERT", insert), ("DELETE", delete), ("UPDATE", delete + "\n" + insert)):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_fts_{table}_{event.lower()}")
+        conn.execute(f"""
+            CREATE TRIGGER trg_fts_{table}_{event.lower()} AFTER {event} ON {table}
+            FOR EACH ROW BEGIN
+                {body}
+            END
         """)
 
-        # NOWE: Faktury przychodowe (AR) – pełen obieg
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS ar_invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                issue_date  TEXT NOT NULL,  -- data wystawienia
-                due_date    TEXT NOT NULL,  -- termin zapłaty
-                company     TEXT NOT NULL,
-                number      TEXT,
-                category    TEXT,
-                amount      REAL NOT NULL,
-                notes       TEXT,
-                paid        INTEGER DEFAULT 0,
-                paid_date   TEXT           -- uzupełniane po opłaceniu
-            );
+def fill_search_index(conn, table, min_id: int = 0):
+    # indeksuje wiersze o id > min_id jednym INSERT ... SELECT (szybciej niż trigger per wiersz)
+    cols = SEARCH_SOURCES[table][1]
+    folded = ", ".join(_fts_fold_sql(c) for c in cols)
+    conn.execute(f"INSERT INTO fts_{table} (rowid, {', '.join(cols)}) SELECT id, {folded} FROM {table} WHERE id > ?",
+                 (min_id,))
+
+def rebuild_search_index(conn):
+    # FTS5 'rebuild' czytałby tabelę bez składania „ł”, więc wypełniamy ręcznie
+    for table in SEARCH_SOURCES:
+        fts = f"fts_{table}"
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('delete-all')")
+        fill_search_index(conn, table)
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+
+def _m009_fulltext_search(conn):
+    try:
+        for table, (_, cols, *_) in SEARCH_SOURCES.items():
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS fts_{table} USING fts5(
+                    {", ".join(cols)},
+                    content='{table}', content_rowid='id',
+                    tokenize="unicode61 remove_diacritics 2", prefix='2 3'
+                )
+            """)
+    except sqlite3.OperationalError as e:
+        # SQLite bez FTS5 – wyszukiwarka po prostu pozostaje wyłączona
+        if "fts5" not in str(e):
+            raise
+        return
+    for table, (_, cols, *_) in SEARCH_SOURCES.items():
+        create_search_triggers(conn, table, cols)
+    rebuild_search_index(conn)
+
+# ------------------ DB: WYCIĄGI BANKOWE ---------
+def _m010_bank_transactions(conn):
+    # kwota ze znakiem: + wpływ na konto, − obciążenie
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bank_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tx_date      TEXT NOT NULL,
+            amount       REAL NOT NULL,
+            counterparty TEXT,
+            title        TEXT,
+            account      TEXT,
+            ref          TEXT
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bank_tx_date ON bank_transactions(tx_date, amount)")
+    create_version_triggers(conn, ("bank_transactions",))
+
+def _m011_bank_reconciliation(conn):
+    conn.execute("ALTER TABLE bank_transactions ADD COLUMN matched_table TEXT")
+    conn.execute("ALTER TABLE bank_transactions ADD COLUMN matched_id INTEGER")
+    # tylko nieuzgodnione transakcje – indeks nie rośnie z historią
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_bank_unmatched ON bank_transactions(tx_date, amount)
+                    WHERE matched_id IS NULL""")
+
+# ------------------ DB: HISTORIA WYNAGRODZEŃ -----
+# Okresy zatrudnienia z pensją [valid_from, valid_to] (valid_to NULL = nadal obowiązuje).
+# Triggery na employees dopisują zmianę od dziś; zmianę od innej daty zapisuje
+# set_employee_terms() – wtedy historia jest już zgodna i triggery nic nie robią.
+def create_salary_triggers(conn):
+    today = "date('now', 'localtime')"
+    close = f"""
+        UPDATE salary_history SET valid_to = date({today}, '-1 day')
+        WHERE employee_id = new.id AND valid_to IS NULL;
+        DELETE FROM salary_history WHERE employee_id = new.id AND valid_to < valid_from;"""
+    open_row = f"""
+        INSERT INTO salary_history (employee_id, monthly_salary, valid_from)
+        SELECT new.id, IFNULL(new.monthly_salary, 0), {today} WHERE new.active = 1;"""
+    has_same = """EXISTS (SELECT 1 FROM salary_history WHERE employee_id = new.id AND valid_to IS NULL
+                                 AND monthly_salary = IFNULL(new.monthly_salary, 0))"""
+    has_open = "EXISTS (SELECT 1 FROM salary_history WHERE employee_id = new.id AND valid_to IS NULL)"
+    for name, event, when, body in (
+        ("insert", "INSERT", f"new.active = 1 AND NOT {has_open}", open_row),
+        ("update", "UPDATE OF monthly_salary, active",
+         f"(new.active = 1 AND NOT {has_same}) OR (new.active = 0 AND {has_open})", close + open_row),
+        ("delete", "DELETE", "1", close.replace("new.", "old.")),
+    ):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_salary_{name}")
+        conn.execute(f"""
+            CREATE TRIGGER trg_salary_{name} AFTER {event} ON employees
+            FOR EACH ROW WHEN {when} BEGIN
+                {body}
+            END
         """)
 
-        # MIGRACJA ze starej ar_paid_invoices (jeśli była)
+def _m012_salary_history(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS salary_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id    INTEGER NOT NULL,  -- bez FK: historia zostaje po usunięciu pracownika
+            monthly_salary REAL NOT NULL DEFAULT 0,
+            valid_from     TEXT NOT NULL,
+            valid_to       TEXT              -- włącznie; NULL = bez końca
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_salary_history_emp ON salary_history(employee_id, valid_to)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_salary_history_range ON salary_history(valid_from, valid_to, monthly_salary)")
+    # stan początkowy: obecni aktywni pracownicy od pierwszego raportu w bazie (wcześniejszej historii nie znamy)
+    conn.execute("""
+        INSERT INTO salary_history (employee_id, monthly_salary, valid_from)
+        SELECT id, IFNULL(monthly_salary, 0),
+               COALESCE((SELECT MIN(report_date) FROM daily_reports), date('now', 'localtime'))
+        FROM employees
+        WHERE active = 1 AND NOT EXISTS (SELECT 1 FROM salary_history)
+    """)
+    create_salary_triggers(conn)
+    create_version_triggers(conn, ("salary_history",))
+
+# ------------------ DB: ZMIANY PERSONELU (fakty) -
+# staff_shifts_monthly: (pracownik, miesiąc) -> liczba zmian i utarg tych zmian (lekarz i każdy
+# technik dostają pełny utarg raportu). Osoby z raportów dopasowujemy po nazwie do employees.id
+# w chwili zapisu; dodanie pracownika lub zmiana nazwy przelicza jego wiersze od nowa.
+STAFF_REVENUE = "IFNULL({r}.kasa,0)+IFNULL({r}.terminal,0)"
+
+def _staff_upsert(select: str, sign: str) -> str:
+    # select: FROM ... zwracające kolumny emp, day, rev
+    return f"""
+        INSERT INTO staff_shifts_monthly (employee_id, ym, shifts, revenue)
+        SELECT emp, substr(day, 1, 7), {sign}1, {sign}(rev) FROM ({select}) WHERE day IS NOT NULL
+        ON CONFLICT(employee_id, ym) DO UPDATE SET shifts=shifts+excluded.shifts, revenue=revenue+excluded.revenue;"""
+
+def _staff_vet_sql(r: str) -> str:
+    return (f"SELECT e.id AS emp, {r}.report_date AS day, {STAFF_REVENUE.format(r=r)} AS rev "
+            f"FROM employees e WHERE e.name = {r}.staff_vet")
+
+def _staff_techs_sql(r: str) -> str:
+    # technicy raportu {r} (NEW/OLD z daily_reports)
+    return (f"SELECT e.id AS emp, {r}.report_date AS day, {STAFF_REVENUE.format(r=r)} AS rev "
+            f"FROM daily_report_techs t JOIN employees e ON e.name = t.tech_name WHERE t.daily_report_id = {r}.id")
+
+def _staff_tech_sql(t: str) -> str:
+    # jeden technik {t} (NEW/OLD z daily_report_techs); raport już usunięty = brak wierszy
+    return (f"SELECT e.id AS emp, r.report_date AS day, {STAFF_REVENUE.format(r='r')} AS rev "
+            f"FROM daily_reports r JOIN employees e ON e.name = {t}.tech_name WHERE r.id = {t}.daily_report_id")
+
+def _staff_from_base_sql(where: str = "1") -> str:
+    return f"""
+        SELECT e.id AS employee_id, substr(s.day, 1, 7) AS ym, COUNT(*) AS shifts, SUM(s.rev) AS revenue
+        FROM (
+            SELECT staff_vet AS name, report_date AS day, {STAFF_REVENUE.format(r='r')} AS rev FROM daily_reports r
+            UNION ALL
+            SELECT t.tech_name, r.report_date, {STAFF_REVENUE.format(r='r')}
+            FROM daily_report_techs t JOIN daily_reports r ON r.id = t.daily_report_id
+        ) s JOIN employees e ON e.name = s.name
+        WHERE s.day IS NOT NULL AND {where}
+        GROUP BY e.id, substr(s.day, 1, 7)"""
+
+def create_staff_shift_triggers(conn):
+    # usunięcie raportu: BEFORE, bo kaskada kasuje techników już po usunięciu wiersza raportu
+    triggers = {
+        "report_ins": ("AFTER INSERT ON daily_reports", _staff_upsert(_staff_vet_sql("NEW"), "")),
+        "report_del": ("BEFORE DELETE ON daily_reports",
+                       _staff_upsert(_staff_vet_sql("OLD"), "-") + _staff_upsert(_staff_techs_sql("OLD"), "-")),
+        "report_upd": ("AFTER UPDATE OF report_date, kasa, terminal, staff_vet ON daily_reports",
+                       _staff_upsert(_staff_vet_sql("OLD"), "-") + _staff_upsert(_staff_techs_sql("OLD"), "-")
+                       + _staff_upsert(_staff_vet_sql("NEW"), "") + _staff_upsert(_staff_techs_sql("NEW"), "")),
+        "tech_ins": ("AFTER INSERT ON daily_report_techs", _staff_upsert(_staff_tech_sql("NEW"), "")),
+        "tech_del": ("AFTER DELETE ON daily_report_techs", _staff_upsert(_staff_tech_sql("OLD"), "-")),
+        "tech_upd": ("AFTER UPDATE ON daily_report_techs",
+                     _staff_upsert(_staff_tech_sql("OLD"), "-") + _staff_upsert(_staff_tech_sql("NEW"), "")),
+        "emp_ins": ("AFTER INSERT ON employees",
+                    f"INSERT INTO staff_shifts_monthly {_staff_from_base_sql('e.id = NEW.id')};"),
+        "emp_rename": ("AFTER UPDATE OF name ON employees",
+                       "DELETE FROM staff_shifts_monthly WHERE employee_id = OLD.id;"
+                       f"INSERT INTO staff_shifts_monthly {_staff_from_base_sql('e.id = NEW.id')};"),
+        "emp_del": ("AFTER DELETE ON employees", "DELETE FROM staff_shifts_monthly WHERE employee_id = OLD.id;"),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_staff_{name}")
+        conn.execute(f"CREATE TRIGGER trg_staff_{name} {event} BEGIN {body} END")
+
+def rebuild_staff_shifts(conn):
+    conn.execute("DELETE FROM staff_shifts_monthly")
+    conn.execute(f"INSERT INTO staff_shifts_monthly (employee_id, ym, shifts, revenue) {_staff_from_base_sql()}")
+
+def check_staff_shifts(conn, tolerance: int = 0) -> pd.DataFrame:
+    # różnice między staff_shifts_monthly a raportami (pusta ramka = spójne)
+    base = pd.read_sql_query(_staff_from_base_sql(), conn)
+    facts = pd.read_sql_query("SELECT employee_id, ym, shifts, revenue FROM staff_shifts_monthly WHERE shifts<>0", conn)
+    cmp = base.merge(facts, on=["employee_id", "ym"], how="outer", suffixes=("_base", "_facts")).fillna(0)
+    bad = ((cmp["revenue_base"] - cmp["revenue_facts"]).abs() > tolerance) | (cmp["shifts_base"] != cmp["shifts_facts"])
+    return cmp[bad].reset_index(drop=True)
+
+def _m013_staff_shift_facts(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS staff_shifts_monthly (
+            employee_id INTEGER NOT NULL,
+            ym          TEXT NOT NULL,
+            shifts      INTEGER NOT NULL DEFAULT 0,
+            revenue     REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee_id, ym)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_staff_shifts_ym ON staff_shifts_monthly(ym, employee_id, shifts, revenue)")
+    # przeliczenie wierszy pracownika po nazwie (dodanie / zmiana nazwy)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_reports_vet ON daily_reports(staff_vet)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_report_techs_name ON daily_report_techs(tech_name)")
+    create_staff_shift_triggers(conn)
+    rebuild_staff_shifts(conn)
+
+# ------------------ DB: DZIENNIK ZAPISÓW ---------
+def _m014_write_log(conn):
+    # klucze idempotencji kolejki zapisów (WriteQueue) z wynikiem pierwszego zapisu
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS write_log (
+            idem_key   TEXT PRIMARY KEY,
+            result     TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_write_log_created ON write_log(created_at)")
+
+# ------------------ DB: KWOTY W GROSZACH ---------
+# Wszystkie kwoty jako INTEGER w groszach: sumy w SQL i w int64 są dokładne, a na złote
+# zamieniamy dopiero przy wyświetlaniu (fmt_zl / zl_frame). Zmiana typu kolumny w SQLite =
+# przebudowa tabeli (nowa tabela, kopia, DROP, RENAME), więc krok idzie bez kluczy obcych.
+MONEY_COLUMNS = {
+    "daily_reports": ("kasa", "terminal"),
+    "ap_invoices": ("amount",),
+    "ar_invoices": ("amount",),
+    "leasings": ("monthly_amount",),
+    "employees": ("monthly_salary",),
+    "salary_history": ("monthly_salary",),
+    "shop_sales": ("kasa", "terminal"),
+    "shop_expenses": ("amount",),
+    "farm_reports": ("kwota",),
+    "bank_transactions": ("amount",),
+    "rollup_daily": ("amount",),
+    "rollup_monthly": ("amount",),
+    "staff_shifts_monthly": ("revenue",),
+}
+to_grosze = vd.to_grosze
+fmt_zl = vd.fmt_zl
+zl_frame = vd.zl_frame
+
+def table_ddl(conn, table: str) -> str:
+    return conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+
+def _rebuild_table(conn, table: str, ddl: str, exprs: dict = None):
+    # nowa tabela wg `ddl` (CREATE TABLE <table> ...), kopia wierszy (kolumna -> wyrażenie z `exprs`),
+    # DROP starej i RENAME; indeksy i licznik AUTOINCREMENT wracają. Wołać w _triggers_dropped().
+    exprs = exprs or {}
+    ddl = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"`\[]?{table}[\"`\]]?", f"CREATE TABLE {table}__new", ddl)
+    indexes = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (table,))]
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    names = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    select = ", ".join(exprs.get(c, c) for c in names)
+    conn.execute(ddl)
+    conn.execute(f"INSERT INTO {table}__new ({', '.join(names)}) SELECT {select} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+    for index_ddl in indexes:
+        conn.execute(index_ddl)
+    if seq:  # AUTOINCREMENT nie wraca do id usuniętych wierszy
+        conn.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", (seq[0], table))
+
+@contextmanager
+def _triggers_dropped(conn):
+    # triggery (agregaty, wersje, FTS, płace, fakty zmian, snapshot) odtwarzamy z zapisanych definicji –
+    # RENAME przy triggerach odwołujących się do usuniętej tabeli kończy się błędem
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger'").fetchall()
+    for name, _sql in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    yield
+    for _name, sql in triggers:
+        conn.execute(sql)
+
+def _money_to_grosze(conn, table: str, cols: tuple):
+    ddl = table_ddl(conn, table)
+    for col in cols:
+        ddl = re.sub(rf"(\b{col}\s+)REAL\b", r"\1INTEGER", ddl)
+    # najpierw do 6 miejsc jak vd.round_grosze: 1.005 * 100 = 100.49999999999999 -> 101, nie 100
+    _rebuild_table(conn, table, ddl, {c: f"CAST(ROUND(ROUND({c} * 100, 6)) AS INTEGER)" for c in cols})
+
+def _m015_money_in_grosze(conn):
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    with _triggers_dropped(conn):
+        for table, cols in MONEY_COLUMNS.items():
+            if table in existing:
+                _money_to_grosze(conn, table, cols)
+    rebuild_rollups(conn)
+    rebuild_staff_shifts(conn)
+    conn.execute("UPDATE table_versions SET version = version + 1")
+
+# ------------------ DB: SNAPSHOT (Parquet) -------
+# Triggery znaczą w snapshot_dirty partycję (tabela, 'YYYY-MM') zmienioną od ostatniego
+# odświeżenia snapshotu (vetfinance_snapshot.py). INSERT zostawia rewrite=0 – nowe wiersze
+# wystarczy dopisać; UPDATE/DELETE ustawiają rewrite=1 (partycja do przepisania). `seq`
+# rośnie przy każdej zmianie, więc odświeżenie kasuje tylko znaczniki, które faktycznie objęło.
+def _snapshot_mark(table: str, r: str, rewrite: int) -> str:
+    ym = vs.partition_ym(table).format(r=r)
+    return f"""
+        INSERT INTO snapshot_dirty (tbl, ym, rewrite, seq) VALUES ('{table}', {ym}, {rewrite}, 1)
+        ON CONFLICT(tbl, ym) DO UPDATE SET seq=seq+1, rewrite=max(rewrite, excluded.rewrite);"""
+
+def create_snapshot_triggers(conn, tables):
+    for table in tables:
+        for event, body in (("INSERT", _snapshot_mark(table, "NEW", 0)),
+                            ("DELETE", _snapshot_mark(table, "OLD", 1)),
+                            ("UPDATE", _snapshot_mark(table, "OLD", 1) + _snapshot_mark(table, "NEW", 1))):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_snapshot_{table}_{event.lower()}")
+            conn.execute(f"""
+                CREATE TRIGGER trg_snapshot_{table}_{event.lower()} AFTER {event} ON {table}
+                FOR EACH ROW BEGIN {body}
+                END
+            """)
+
+def _m016_snapshot_dirty(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_dirty (
+            tbl     TEXT NOT NULL,
+            ym      TEXT NOT NULL,  -- '' = tabela bez partycji po dacie
+            rewrite INTEGER NOT NULL DEFAULT 0,
+            seq     INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (tbl, ym)
+        ) WITHOUT ROWID;
+    """)
+    # stan początkowy niepotrzebny: tabela bez wpisu w manifeście snapshotu jest eksportowana w całości
+    create_snapshot_triggers(conn, vs.SNAPSHOT_TABLES)
+
+# ------------------ DB: FILIE --------------------
+# Starsze bazy mają w daily_reports CHECK z nazwiskami personelu jednego gabinetu. Każda filia
+# ma własny zespół w employees (formularze i import i tak wybierają z tej listy), więc
+# ograniczenie znika – przebudowa tabeli jak przy kwotach w groszach.
+STAFF_CHECK_RE = re.compile(r"\s*CHECK\s*\(\s*(staff_vet|staff_tech)\s+IN\s*\([^)]*\)\s*\)", re.IGNORECASE)
+
+def _m017_staff_without_check(conn):
+    ddl = table_ddl(conn, "daily_reports")
+    if not STAFF_CHECK_RE.search(ddl):
+        return
+    with _triggers_dropped(conn):
+        _rebuild_table(conn, "daily_reports", STAFF_CHECK_RE.sub("", ddl))
+
+MIGRATIONS = [
+    (1, "schemat bazowy", _m001_base_schema),
+    (2, "daily_report_techs z pola staff_tech", _m002_daily_report_techs_backfill),
+    (3, "ar_invoices ze starej ar_paid_invoices", _m003_ar_paid_invoices),
+    (4, "daty ISO + indeksy po datach", _m004_iso_dates_and_indexes),
+    (5, "agregaty dzienne/miesięczne + triggery", _m005_rollups),
+    (6, "liczniki wersji tabel", _m006_table_versions),
+    (7, "liczniki wersji dla wszystkich tabel", _m007_all_table_versions),
+    (8, "indeksy wyszukiwania (NOCASE)", _m008_search_indexes),
+    (9, "wyszukiwanie pełnotekstowe (FTS5)", _m009_fulltext_search),
+    (10, "transakcje z wyciągów bankowych", _m010_bank_transactions),
+    (11, "uzgadnianie transakcji z fakturami", _m011_bank_reconciliation),
+    (12, "historia wynagrodzeń (valid_from/valid_to)", _m012_salary_history),
+    (13, "fakty zmian personelu (pracownik x miesiąc)", _m013_staff_shift_facts),
+    (14, "dziennik zapisów (klucze idempotencji)", _m014_write_log),
+    (15, "kwoty w groszach (INTEGER)", _m015_money_in_grosze),
+    (16, "znaczniki zmian dla snapshotu Parquet", _m016_snapshot_dirty),
+    (17, "personel raportu bez CHECK z nazwiskami", _m017_staff_without_check),
+]
+# kroki przebudowujące tabele: DROP TABLE przy włączonych kluczach obcych skasowałby kaskadowo
+# wiersze zależne (np. techników raportu), a PRAGMA foreign_keys nie działa wewnątrz transakcji
+MIGRATIONS_WITHOUT_FK = {15, 17}
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn) -> int:
+    for version, _name, step in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        no_fk = version in MIGRATIONS_WITHOUT_FK
+        if no_fk:
+            conn.execute("PRAGMA foreign_keys=OFF")
+        # BEGIN IMMEDIATE: inny proces nie wykona tego samego kroku równolegle
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            has_old = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='ar_paid_invoices'"
-            ).fetchone()
-            if has_old:
-                # skopiuj tylko jeśli ar_invoices jest pusta
-                cnt_new = conn.execute("SELECT COUNT(*) FROM ar_invoices").fetchone()[0]
-                if cnt_new == 0:
-                    conn.execute("""
-                        INSERT INTO ar_invoices (issue_date, paid_date, company, number, category, amount, notes, paid, due_date)
-                        SELECT COALESCE(issue_date, paid_date), paid_date, company, number, category, amount, notes, 1,
-                               COALESCE(paid_date, date(paid_date))
-                        FROM ar_paid_invoices
-                    """)
+            if version > schema_version(conn):
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
         except Exception:
-            pass
-
-        # Leasingi
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS leasings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name           TEXT NOT NULL,
-                monthly_amount REAL NOT NULL,
-                start_date     TEXT NOT NULL,
-                end_date       TEXT NOT NULL,
-                notes          TEXT
-            );
-        """)
-
-        # Pracownicy
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS employees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                role TEXT CHECK(role IN ('lekarz','technik')) NOT NULL,
-                monthly_salary REAL DEFAULT 0,
-                active INTEGER DEFAULT 1
-            );
-        """)
-
-        # Sklep
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS shop_sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sale_date TEXT NOT NULL,
-                kasa REAL DEFAULT 0,
-                terminal REAL DEFAULT 0
-            );
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS shop_expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                expense_date TEXT NOT NULL,
-                amount REAL NOT NULL,
-                invoice_number TEXT,
-                supplier TEXT,
-                paid INTEGER DEFAULT 0
-            );
-        """)
-
-        # Zwierzęta hodowlane
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS farm_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                report_date TEXT NOT NULL,
-                typ TEXT CHECK(typ IN ('magazyn','teren')) NOT NULL,
-                kwota REAL DEFAULT 0,
-                uwagi TEXT
-            );
-        """)
-
-        # Seed przykładowych pracowników (jeśli pusto)
-        existing = {r[0] for r in conn.execute("SELECT name FROM employees").fetchall()}
-        seed_vets = []
-        seed_techs = []
-        for n in seed_vets:
-            if n not in existing:
-                conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'lekarz', 1)", (n,))
-        for n in seed_techs:
-            if n not in existing:
-                conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'technik', 1)", (n,))
+            conn.rollback()
+            raise
+        finally:
+            if no_fk:
+                conn.execute("PRAGMA foreign_keys=ON")
+    return schema_version(conn)
+
+@st.cache_resource
+def init_db(path: str = DB) -> int:
+    # raz na proces (i plik bazy), nie przy każdym rerunie
+    with get_pool(path).connection() as conn:
+        return migrate(conn)
+
+# ------------------ DB: PLANY ZAPYTAŃ ----------
+# Reprezentatywne zapytania z filtrem zakresowym po dacie i indeks, którego powinny użyć.
+PLAN_CHECKS = [
+    ("Recepcja – utarg dzienny",
+     "SELECT report_date, SUM(kasa+terminal) FROM daily_reports WHERE report_date BETWEEN ? AND ? GROUP BY report_date",
+     "idx_daily_reports_date"),
+    ("Pracownicy – zmiany w okresie",
+     "SELECT employee_id, SUM(shifts), SUM(revenue) FROM staff_shifts_monthly WHERE ym BETWEEN ? AND ? GROUP BY employee_id",
+     "idx_staff_shifts_ym"),
+    ("AP – zapłacone w okresie",
+     "SELECT paid_date, SUM(amount) FROM ap_invoices WHERE paid=1 AND paid_date BETWEEN ? AND ? GROUP BY paid_date",
+     "idx_ap_paid_date"),
+    ("AP – do zapłaty",
+     "SELECT id, supplier, number, amount, due_date FROM ap_invoices WHERE paid=0 AND due_date BETWEEN ? AND ? ORDER BY due_date",
+     "idx_ap_paid_due"),
+    ("AR – opłacone w okresie",
+     "SELECT paid_date, SUM(amount) FROM ar_invoices WHERE paid=1 AND paid_date BETWEEN ? AND ? GROUP BY paid_date",
+     "idx_ar_paid_date"),
+    ("AR – wystawione w okresie",
+     "SELECT id, company, amount FROM ar_invoices WHERE issue_date BETWEEN ? AND ?",
+     "idx_ar_issue_date"),
+    ("Sklep – utarg",
+     "SELECT sale_date, SUM(kasa+terminal) FROM shop_sales WHERE sale_date BETWEEN ? AND ? GROUP BY sale_date",
+     "idx_shop_sales_date"),
+    ("Sklep – zapłacone wydatki",
+     "SELECT expense_date, SUM(amount) FROM shop_expenses WHERE paid=1 AND expense_date BETWEEN ? AND ? GROUP BY expense_date",
+     "idx_shop_expenses_paid_date"),
+    ("AP – wyszukiwanie po prefiksie",
+     "SELECT id FROM ap_invoices WHERE +paid=0 AND (supplier LIKE ? OR number LIKE ?)",
+     "idx_ap_supplier_nocase"),
+    ("AR – wyszukiwanie po prefiksie",
+     "SELECT id FROM ar_invoices WHERE (company LIKE ? OR number LIKE ?)",
+     "idx_ar_company_nocase"),
+    ("Bank – nieuzgodnione transakcje",
+     "SELECT id, tx_date, amount FROM bank_transactions WHERE matched_id IS NULL AND tx_date BETWEEN ? AND ?",
+     "idx_bank_unmatched"),
+    ("AR – otwarte do uzgodnienia",
+     "SELECT id, amount FROM ar_invoices WHERE paid=0 AND due_date >= ? AND issue_date <= ?",
+     "idx_ar_paid_due"),
+    ("Zwierzęta – suma miesiąca",
+     "SELECT typ, SUM(kwota) FROM farm_reports WHERE report_date BETWEEN ? AND ? GROUP BY typ",
+     "idx_farm_reports_date"),
+]
+
+def query_plan(conn, sql: str, params=()) -> list[str]:
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def check_query_plans() -> pd.DataFrame:
+    # EXPLAIN QUERY PLAN dla PLAN_CHECKS: czy zapytanie faktycznie idzie po oczekiwanym indeksie
+    rows = []
+    with ro_cnx() as conn:
+        for name, sql, index in PLAN_CHECKS:
+            plan = query_plan(conn, sql, ("2000-01-01", "2000-12-31"))
+            rows.append({
+                "zapytanie": name,
+                "indeks": index,
+                "ok": any(index in step for step in plan),
+                "plan": " | ".join(plan),
+            })
+    return pd.DataFrame(rows)
 
 # ------------------ HELPERY -----------------
 def get_employee_names_by_role(role: str):
-    with cnx() as conn:
-        rows = conn.execute("SELECT name FROM employees WHERE active=1 AND role=? ORDER BY name", (role,)).fetchall()
-    return [r[0] for r in rows]
+    df = read_df("SELECT name FROM employees WHERE active=1 AND role=? ORDER BY name", params=(role,))
+    return df["name"].tolist()
 
 def get_employees_df():
-    return pd.read_sql_query(
-        "SELECT id, name, role, monthly_salary, active FROM employees ORDER BY role, name", cnx()
+    return read_df("SELECT id, name, role, monthly_salary, active FROM employees ORDER BY role, name")
+
+def employee_shift_stats(ym_from: str, ym_to: str, compare_years: int = 0) -> pd.DataFrame:
+    # z tabeli faktów staff_shifts_monthly; compare_years > 0 dokłada ten sam okres sprzed lat
+    if compare_years:
+        return analytics(vd.staff_shift_yoy, ym_from, ym_to, compare_years)
+    return analytics(vd.staff_shift_stats, ym_from, ym_to)
+
+def table_version(table: str) -> tuple:
+    # (plik filii, licznik) – klucz st.cache_data: ta sama wersja w innej filii to inne dane
+    with ro_cnx() as conn:
+        row = conn.execute("SELECT version FROM table_versions WHERE tbl=?", (table,)).fetchone()
+    return clinic_db(), int(row[0]) if row else 0
+
+# ------------------ LEASINGI: HARMONOGRAM --------
+month_overlap = vd.month_overlap
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _leasing_contracts(version: tuple) -> pd.DataFrame:
+    # `version` = table_version("leasings"); nowa wersja => ponowny odczyt
+    with ro_cnx() as conn:
+        return vd.leasing_contracts(conn)
+
+def leasing_schedule(months: list, prorate: bool = False) -> pd.DataFrame:
+    return vd.leasing_schedule(_leasing_contracts(table_version("leasings")), months, prorate=prorate)
+
+def leasing_costs(months: list, prorate: bool = False) -> pd.Series:
+    sched = leasing_schedule(months, prorate=prorate)
+    return sched.sum(axis=1).reindex(sched.index, fill_value=0)
+
+def sum_leasing_for_month(y:int, m:int) -> int:
+    return int(leasing_costs([f"{y}-{m:02}"]).iloc[0])
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _salary_periods(version: tuple) -> pd.DataFrame:
+    # `version` = table_version("salary_history")
+    with ro_cnx() as conn:
+        return vd.salary_periods(conn)
+
+def salary_costs(months: list, prorate: bool = True) -> pd.Series:
+    return vd.salary_costs(_salary_periods(table_version("salary_history")), months, prorate=prorate)
+
+def sum_salaries_for_month(y: int, m: int) -> int:
+    return int(salary_costs([f"{y}-{m:02}"]).iloc[0])
+
+def set_employee_terms(conn, employee_id: int, salary: int, active: bool, valid_from: date):
+    """Pensja (w groszach) / zatrudnienie od podanego dnia (także wstecz lub z wyprzedzeniem) – nadpisuje historię od tej daty."""
+    start = valid_from.isoformat()
+    conn.execute("DELETE FROM salary_history WHERE employee_id=? AND valid_from >= ?", (employee_id, start))
+    conn.execute(
+        """UPDATE salary_history SET valid_to = date(?, '-1 day')
+           WHERE employee_id=? AND (valid_to IS NULL OR valid_to >= ?)""",
+        (start, employee_id, start),
     )
+    if active:
+        conn.execute("INSERT INTO salary_history (employee_id, monthly_salary, valid_from) VALUES (?,?,?)",
+                     (employee_id, salary, start))
+    conn.execute("UPDATE employees SET monthly_salary=?, active=? WHERE id=?", (salary, int(active), employee_id))
 
-def sum_leasing_for_month(y:int, m:int) -> float:
-    first, last = ym_bounds(y, m)
-    with cnx() as conn:
+def sum_ar_paid_for_month(y:int, m:int) -> int:
+    with ro_cnx() as conn:
         row = conn.execute(
-            "SELECT SUM(monthly_amount) FROM leasings WHERE start_date<=? AND end_date>=?",
-            (last.isoformat(), first.isoformat()),
+            "SELECT SUM(amount) FROM rollup_monthly WHERE ym=? AND source='ar_paid'", (f"{y}-{m:02}",)
         ).fetchone()
-    return float(row[0] or 0)
+    return int(row[0] or 0)
+
+def rollup_by_day(first: date, last: date, sources: list) -> pd.DataFrame:
+    return analytics(vd.rollup_by_day, first, last, sources)
+
+def rollup_by_month(months: list, sources: list) -> pd.DataFrame:
+    return analytics(vd.rollup_by_month, months, sources)
+
+def monthly_pnl(months: list) -> pd.DataFrame:
+    return analytics(vd.monthly_pnl, months)
+
+def farm_month_summary(y: int, m: int) -> pd.DataFrame:
+    return analytics(vd.farm_month_summary, y, m)
+
+def _pnl_inputs(months: list) -> tuple:
+    return (analytics(vd.rollup_month_rows, months, vd.PNL_SOURCES), analytics(vd.leasing_contracts),
+            analytics(vd.salary_periods))
+
+def consolidated_pnl(months: list) -> pd.DataFrame:
+    """monthly_pnl wszystkich filii; indeks (filia, ym).
+
+    Z każdej filii równolegle tylko małe wejścia (sumy miesięczne, umowy, okresy pensji – z cache
+    per filia), P&L całej grupy liczony jednym przebiegiem – koszt rośnie z liczbą filii wolno.
+    """
+    return vd.group_pnl_frame(for_each_clinic(lambda: _pnl_inputs(months)), months)
+
+# ------------------ PROGNOZA PRZEPŁYWÓW ----------
+# Oś dzienna od `start` na N miesięcy: otwarte AR/AP wg terminu płatności, raty leasingów
+# i wynagrodzenia w stałe dni miesiąca oraz sezonowa baza utargu gabinetu (średnia
+# z historii daily_reports per miesiąc roku x dzień tygodnia). Składniki są cache'owane
+# per wersje tabel, a scenariusz (mnożniki, opóźnienie wpłat) to już tylko działania na wektorach.
+CASHFLOW_TABLES = ("ar_invoices", "ap_invoices", "leasings", "salary_history", "daily_reports")
+CASHFLOW_HISTORY_DAYS = 730  # historia do profilu sezonowego
+SALARY_PAY_DAY = 10
+LEASING_PAY_DAY = 15
+
+def _due_by_day(table: str, days: pd.DatetimeIndex) -> pd.DataFrame:
+    # otwarte faktury zsumowane po terminie; zaległe (termin przed startem) osobno, na dzień startu
+    df = read_df(f"SELECT due_date, SUM(amount) AS amount FROM {table} WHERE paid=0 GROUP BY due_date",
+                 types=vd.schema(table))
+    due = df["due_date"]
+    amount = df["amount"].fillna(0).to_numpy(dtype=np.int64)
+    overdue = int(amount[(due < days[0]).to_numpy()].sum())
+    in_range = ((due >= days[0]) & (due <= days[-1])).to_numpy()
+    by_day = pd.Series(amount[in_range], index=due[in_range], dtype=np.int64).groupby(level=0).sum()
+    out = pd.DataFrame({"due": by_day.reindex(days, fill_value=0), "overdue": 0}, index=days)
+    out.iloc[0, 1] = overdue
+    return out
+
+def _monthly_on_day(days: pd.DatetimeIndex, per_month: pd.Series, day: int) -> pd.Series:
+    # kwota miesięczna ('YYYY-MM' -> kwota) płatna w danym dniu miesiąca
+    pay = pd.Series(0, index=days, dtype=np.int64)
+    on_day = days[days.day == day]
+    pay[on_day] = per_month.reindex(on_day.strftime("%Y-%m"), fill_value=0).to_numpy()
+    return pay
+
+def _seasonal_baseline(days: pd.DatetimeIndex) -> pd.Series:
+    first = (days[0] - pd.Timedelta(days=CASHFLOW_HISTORY_DAYS)).date()
+    last = (days[0] - pd.Timedelta(days=1)).date()
+    # wprost z bazy: składniki prognozy są cache'owane per wersje tabel, nie per snapshot
+    hist = service_call(vd.rollup_by_day, first, last, ["clinic"])["clinic"]
+    hist.index = pd.to_datetime(hist.index)
+    # profil zaczyna się od pierwszego dnia z utargiem (krótsza historia nie zaniża średnich)
+    active = hist[hist.gt(0).cummax()]
+    if active.empty:
+        return pd.Series(0, index=days, dtype=np.int64)
+    profile = active.groupby([active.index.month, active.index.dayofweek]).mean()
+    by_dow = active.groupby(active.index.dayofweek).mean()
+    keys = pd.MultiIndex.from_arrays([days.month, days.dayofweek])
+    base = profile.reindex(keys).to_numpy()
+    fallback = by_dow.reindex(days.dayofweek).fillna(active.mean()).to_numpy()
+    # średnie zaokrąglone do pełnych groszy – dalej już tylko arytmetyka całkowita
+    return pd.Series(vd.round_grosze(np.where(np.isnan(base), fallback, base)), index=days)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _cashflow_components(start: str, months: int, versions: tuple) -> pd.DataFrame:
+    # `versions` = wersje CASHFLOW_TABLES; zmiana danych => przeliczenie
+    first = pd.Timestamp(start)
+    days = pd.date_range(first, first + pd.DateOffset(months=months) - pd.Timedelta(days=1), freq="D")
+    month_keys = list(pd.period_range(days[0], days[-1], freq="M").strftime("%Y-%m"))
+    ar = _due_by_day("ar_invoices", days)
+    ap = _due_by_day("ap_invoices", days)
+    return pd.DataFrame({
+        "ar_due": ar["due"], "ar_overdue": ar["overdue"],
+        "ap_due": ap["due"], "ap_overdue": ap["overdue"],
+        "leasing": _monthly_on_day(days, leasing_costs(month_keys), LEASING_PAY_DAY),
+        "salaries": _monthly_on_day(days, salary_costs(month_keys), SALARY_PAY_DAY),
+        "baseline": _seasonal_baseline(days),
+    }, index=days.rename("dzień"))
+
+def forecast_cashflow(start: date, months: int = 12, opening_balance: int = 0,
+                      revenue_factor: float = 1.0, cost_factor: float = 1.0,
+                      ar_delay_days: int = 0, collect_overdue: bool = True) -> pd.DataFrame:
+    """Dzienna prognoza wpływów, wydatków i salda narastającego w groszach (scenariusz na skeszowanych składnikach)."""
+    versions = tuple(table_version(t) for t in CASHFLOW_TABLES)
+    comp = _cashflow_components(start.isoformat(), int(months), versions)
+    ar = comp["ar_due"] + (comp["ar_overdue"] if collect_overdue else 0)
+    ar = ar.shift(int(ar_delay_days), fill_value=0)
+    scaled = lambda s, factor: pd.Series(vd.round_grosze(s * factor), index=s.index)
+    out = pd.DataFrame({
+        "wpływy_AR": ar,
+        "utarg_prognoza": scaled(comp["baseline"], revenue_factor),
+        "wydatki_AP": -scaled(comp["ap_due"] + comp["ap_overdue"], cost_factor),
+        "leasingi": -comp["leasing"],
+        "wynagrodzenia": -scaled(comp["salaries"], cost_factor),
+    }, index=comp.index)
+    out["saldo_dnia"] = out.sum(axis=1)
+    out["saldo"] = opening_balance + out["saldo_dnia"].cumsum()
+    return out
+
+# ------------------ EKSPORT (strumieniowo) -------
+# Wiersze idą z kursora SQLite paczkami po EXPORT_CHUNK_ROWS prosto do pliku
+# tymczasowego (CSV / CSV gzip / Parquet) – bez pełnej ramki i pełnego stringa CSV w pamięci.
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = {  # nazwa -> (rozszerzenie, MIME)
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
 
-def sum_salaries_active() -> float:
-    with cnx() as conn:
-        row = conn.execute("SELECT SUM(monthly_salary) FROM employees WHERE active=1").fetchone()
-    return float(row[0] or 0)
+def export_formats() -> list:
+    return [f for f in EXPORT_FORMATS if f != "Parquet" or pq is not None]
+
+def iter_query_chunks(sql: str, params=None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    # generator (kolumny, paczka wierszy) z kursora po stronie bazy
+    with ro_cnx() as conn:
+        cur = conn.execute(sql, params or ())
+        cols = [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield cols, rows
+
+def _export_csv(chunks, raw, compress: bool):
+    stream = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    header_done = False
+    for cols, rows in chunks:
+        if not header_done:
+            writer.writerow(cols)
+            header_done = True
+        writer.writerows(rows)
+    text.flush()
+    text.detach()
+    if compress:
+        stream.close()
+
+def _export_parquet(chunks, raw):
+    writer = None
+    for cols, rows in chunks:
+        table = pa.Table.from_pandas(pd.DataFrame.from_records(rows, columns=cols), preserve_index=False)
+        if writer is None:
+            # kolumny puste w pierwszej paczce zapisujemy jako tekst
+            schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+            writer = pq.ParquetWriter(raw, schema)
+        writer.write_table(table.cast(schema))
+    if writer is not None:
+        writer.close()
+
+def export_query(sql: str, params=None, fmt: str = "CSV"):
+    """Zapisuje wynik zapytania do pliku tymczasowego w wybranym formacie; zwraca plik ustawiony na początek."""
+    raw = tempfile.TemporaryFile()
+    chunks = iter_query_chunks(sql, params)
+    if fmt == "Parquet":
+        _export_parquet(chunks, raw)
+    else:
+        _export_csv(chunks, raw, compress=(fmt == "CSV (gzip)"))
+    raw.seek(0)
+    return raw
+
+def export_box(key: str, sql: str, params=None, filename: str = "eksport"):
+    # wybór formatu + przygotowanie pliku dopiero na żądanie (nie przy każdym rerunie)
+    c1, c2, c3 = st.columns([2, 2, 3])
+    fmt = c1.selectbox("Format eksportu", export_formats(), key=f"{key}_fmt", label_visibility="collapsed")
+    sig = (key, sql, _params_key(params), fmt)
+    # poprzedni plik zwalniamy w callbacku – przed przebiegiem skryptu, więc wcześniejsze listy go już nie pokażą
+    if c2.button("⬇️ Przygotuj eksport", key=f"{key}_prep", on_click=st.session_state.pop, args=("_export", None)):
+        with st.spinner("Eksport..."):
+            with export_query(sql, params, fmt) as f:
+                # jeden przygotowany plik na sesję – nowy eksport (z dowolnej listy) zastępuje poprzedni
+                st.session_state["_export"] = (sig, f.read())
+    prepared = st.session_state.get("_export")
+    if prepared and prepared[0][0] == key:
+        if prepared[0] != sig:  # zmienione filtry/format – plik nieaktualny
+            st.session_state.pop("_export", None)
+            return
+        ext, mime = EXPORT_FORMATS[fmt]
+        c3.download_button(f"Pobierz {filename}.{ext}", prepared[1], f"{filename}.{ext}", mime, key=f"{key}_dl")
+
+# ------------------ IMPORT MASOWY ----------------
+# Plik CSV/XLSX czytany paczkami po IMPORT_CHUNK_ROWS; każda paczka jest walidowana
+# wektorowo (daty, kwoty, CHECK ... IN z definicji tabeli), odsiewana z duplikatów po
+# kluczu naturalnym i zapisywana jednym executemany w osobnej, krótkiej transakcji.
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_MAX_REJECTS = 10000  # tyle odrzuconych wierszy trzymamy w raporcie (liczymy wszystkie)
+# tabela -> (etykieta, kolumny z typem, kolumny wymagane, klucz naturalny do deduplikacji)
+IMPORT_TARGETS = {
+    "daily_reports": ("Recepcja – raporty dzienne",
+                      {"report_date": "date", "shift": "text", "kasa": "num", "terminal": "num",
+                       "staff_vet": "text", "staff_tech": "text", "uwagi": "text"},
+                      ("report_date", "shift"), ("report_date", "shift")),
+    "ap_invoices": ("Faktury kosztowe (AP)",
+                    {"invoice_date": "date", "due_date": "date", "supplier": "text", "number": "text",
+                     "category": "text", "amount": "num", "notes": "text", "paid": "bool", "paid_date": "date"},
+                    ("invoice_date", "due_date", "supplier", "amount"), ("supplier", "number")),
+    "ar_invoices": ("Faktury przychodowe (AR)",
+                    {"issue_date": "date", "due_date": "date", "company": "text", "number": "text",
+                     "category": "text", "amount": "num", "notes": "text", "paid": "bool", "paid_date": "date"},
+                    ("issue_date", "due_date", "company", "amount"), ("company", "number")),
+    "shop_sales": ("Sklep – sprzedaż (kasa/terminal)",
+                   {"sale_date": "date", "kasa": "num", "terminal": "num"},
+                   ("sale_date",), ("sale_date", "kasa", "terminal")),
+    "shop_expenses": ("Sklep – wydatki",
+                      {"expense_date": "date", "amount": "num", "invoice_number": "text", "supplier": "text", "paid": "bool"},
+                      ("expense_date", "amount"), ("supplier", "invoice_number")),
+    "farm_reports": ("Zwierzęta – raporty",
+                     {"report_date": "date", "typ": "text", "kwota": "num", "uwagi": "text"},
+                     ("report_date", "typ"), ("report_date", "typ", "kwota")),
+    "employees": ("Pracownicy",
+                  {"name": "text", "role": "text", "monthly_salary": "num", "active": "bool"},
+                  ("name", "role"), ("name",)),
+    "bank_transactions": ("Wyciąg bankowy",
+                          {"tx_date": "date", "amount": "num", "counterparty": "text", "title": "text",
+                           "account": "text", "ref": "text"},
+                          ("tx_date", "amount"), ("tx_date", "amount", "counterparty", "title")),
+}
+# Tabele bez unikalnego klucza: formularze dopuszczają kilka takich samych wpisów dziennie,
+# więc duplikaty szukamy tylko w obrębie importowanego pliku, nie wśród wierszy w bazie.
+IMPORT_FILE_KEYS_ONLY = {"shop_sales", "farm_reports"}
+BOOL_TRUE = {"1", "tak", "t", "true", "yes", "y", "x", "opłacona", "oplacona"}
+BOOL_FALSE = {"", "0", "nie", "n", "false", "no", "nieopłacona", "nieoplacona"}
+
+def import_types() -> list:
+    return ["csv", "txt"] + (["xlsx"] if openpyxl is not None else [])
+
+def table_checks(conn, table: str) -> dict:
+    """Dozwolone wartości z ograniczeń `CHECK(kolumna IN (...))` w definicji tabeli."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    checks = {}
+    for col, values in re.findall(r"CHECK\s*\(\s*(\w+)\s+IN\s*\(([^)]*)\)\s*\)", row[0] if row else ""):
+        checks[col] = set(re.findall(r"'([^']*)'", values))
+    return checks
+
+def table_not_null(conn, table: str) -> set:
+    """Kolumny `NOT NULL` bez wartości domyślnej (w starych bazach np. staff_vet/staff_tech)."""
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[3] and row[4] is None}
+
+def _sniff_csv(head: bytes):
+    try:
+        text, encoding = head.decode("utf-8-sig"), "utf-8-sig"
+    except UnicodeDecodeError:
+        text, encoding = head.decode("cp1250", errors="replace"), "cp1250"
+    try:
+        sep = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=";,\t|").delimiter
+    except csv.Error:
+        sep = ";"
+    return sep, encoding
+
+def read_import_chunks(file, name: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Generator ramek (wszystkie kolumny jako tekst) z pliku CSV lub XLSX."""
+    file.seek(0)
+    if name.lower().endswith(".xlsx"):
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(c).strip() if c is not None else f"kolumna_{i + 1}" for i, c in enumerate(next(rows, ()))]
+            while True:
+                batch = [r[:len(header)] for _, r in zip(range(chunk_rows), rows)]
+                if not batch:
+                    break
+                df = pd.DataFrame.from_records(batch, columns=header)
+                # daty z Excela jako ISO, reszta jako tekst – jak z CSV
+                for col in df.columns:
+                    df[col] = df[col].map(lambda v: "" if v is None else v.date().isoformat()
+                                          if hasattr(v, "date") and callable(v.date) else str(v))
+                yield df
+        finally:
+            wb.close()
+        return
+    sep, encoding = _sniff_csv(file.read(64 * 1024))
+    file.seek(0)
+    yield from pd.read_csv(file, sep=sep, encoding=encoding, dtype=str, keep_default_na=False,
+                           skipinitialspace=True, chunksize=chunk_rows)
+
+def _parse_num(s: pd.Series) -> pd.Series:
+    s = s.astype(str).str.replace(r"[\s ]|zł|PLN", "", regex=True)
+    both = s.str.contains(",", regex=False) & s.str.contains(".", regex=False)
+    s = s.mask(both, s.str.replace(".", "", regex=False)).str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce")
+
+IMPORT_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y", "%Y.%m.%d", "%Y/%m/%d")
+
+def _parse_date(s: pd.Series) -> pd.Series:
+    # formaty jawne są wektorowe; "mixed" (wolny, wiersz po wierszu) tylko dla resztek
+    s = s.astype(str).str.strip().str.slice(0, 10)
+    d = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    for fmt in IMPORT_DATE_FORMATS:
+        todo = d.isna() & s.ne("")
+        if not todo.any():
+            break
+        d[todo] = pd.to_datetime(s[todo], errors="coerce", format=fmt)
+    todo = d.isna() & s.ne("")
+    if todo.any():
+        d[todo] = pd.to_datetime(s[todo], errors="coerce", dayfirst=True, format="mixed")
+    return d.dt.strftime("%Y-%m-%d").where(d.notna(), None)
+
+def _key_series(df: pd.DataFrame, cols) -> pd.Series:
+    # klucz naturalny jako jeden string; pusty element klucza => brak deduplikacji (None)
+    # kwoty są już w groszach (Int64), więc porównujemy je jako liczby całkowite
+    parts = [df[c].astype(object).map(lambda v: "" if v is None or pd.isna(v) else str(v).strip().lower())
+             for c in cols]
+    key = parts[0].str.cat(parts[1:], sep="\x1f") if len(parts) > 1 else parts[0]
+    empty = pd.concat([p.eq("") for p in parts], axis=1).any(axis=1)
+    return key.mask(empty, None)
+
+def _validate_chunk(raw: pd.DataFrame, table: str, mapping: dict, checks: dict, not_null: set = frozenset()):
+    """Zwraca (ramka gotowa do zapisu, maska odrzuceń, powody odrzuceń)."""
+    _, types, required, _ = IMPORT_TARGETS[table]
+    out = pd.DataFrame(index=raw.index)
+    reasons = pd.Series("", index=raw.index)
+
+    def reject(mask, why):
+        nonlocal reasons
+        reasons = reasons.mask(mask & reasons.eq(""), why)
+
+    for col, kind in types.items():
+        src = mapping.get(col)
+        text = raw[src].astype(str).str.strip() if src else pd.Series("", index=raw.index)
+        present = text.ne("")
+        if col in required or (col in not_null and kind == "date"):
+            reject(~present, f"brak wartości: {col}")
+        if kind == "date":
+            out[col] = _parse_date(text)
+            reject(present & out[col].isna(), f"niepoprawna data: {col}")
+        elif kind == "num":
+            out[col] = vd.grosze_series(_parse_num(text))
+            reject(present & out[col].isna(), f"niepoprawna kwota: {col}")
+            if col not in required:
+                out[col] = out[col].fillna(0)
+        elif kind == "bool":
+            low = text.str.lower()
+            out[col] = low.isin(BOOL_TRUE).astype(int)
+            reject(~low.isin(BOOL_TRUE | BOOL_FALSE), f"niepoprawna wartość tak/nie: {col}")
+            if col == "active" and not src:
+                out[col] = 1
+        else:
+            # tekst NOT NULL bez wartości zapisujemy jako '' – jak formularz recepcji
+            out[col] = text if col in not_null else text.where(present, None)
+            if col in checks:
+                # bez względu na wielkość liter, ale zapisujemy pisownię z CHECK (np. imiona w starych bazach)
+                allowed = out[col].str.lower().map({v.lower(): v for v in checks[col]})
+                reject(present & allowed.isna(), f"{col} spoza dozwolonych: {', '.join(sorted(checks[col]))}")
+                out[col] = allowed.where(allowed.notna(), out[col])
+    return out, reasons.ne(""), reasons
+
+def _existing_keys(conn, table: str) -> set:
+    _, types, _, key_cols = IMPORT_TARGETS[table]
+    df = pd.read_sql_query(f"SELECT {', '.join(key_cols)} FROM {table}", conn)
+    for c in key_cols:
+        if types[c] == "num":
+            df[c] = df[c].astype("Int64")
+    return set(_key_series(df, key_cols).dropna()) if not df.empty else set()
+
+def _insert_batch(conn, table: str, df: pd.DataFrame) -> int:
+    # paczka importu jako jedno żądanie kolejki zapisów (transakcję otwiera wątek piszący)
+    cols = list(df.columns)
+    rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    last_id = conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+    # trigger FTS na czas paczki zastępuje jeden INSERT ... SELECT (DDL jest w tej samej transakcji)
+    fts = table in SEARCH_SOURCES and conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?", (f"trg_fts_{table}_insert",)
+    ).fetchone() is not None
+    if fts:
+        conn.execute(f"DROP TRIGGER trg_fts_{table}_insert")
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", rows
+    )
+    if fts:
+        fill_search_index(conn, table, last_id)
+        create_search_triggers(conn, table, SEARCH_SOURCES[table][1])
+    if table == "daily_reports":
+        # techników z pola staff_tech ("A, B") rozpisujemy jak formularz recepcji
+        new = conn.execute(
+            "SELECT id, staff_tech FROM daily_reports WHERE id > ? AND IFNULL(staff_tech, '') <> ''", (last_id,)
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?,?)",
+            [(rid, t.strip()) for rid, techs in new for t in techs.split(",") if t.strip()],
+        )
+    return len(rows)
+
+def import_file(file, name: str, table: str, mapping: dict, dry_run: bool = False,
+                chunk_rows: int = IMPORT_CHUNK_ROWS, progress=None):
+    """Import pliku do tabeli; zwraca (statystyki, raport odrzuconych wierszy)."""
+    _, _, _, key_cols = IMPORT_TARGETS[table]
+    with ro_cnx() as conn:
+        checks = table_checks(conn, table)
+        not_null = table_not_null(conn, table)
+        seen = set() if table in IMPORT_FILE_KEYS_ONLY else _existing_keys(conn, table)
+    stats = {"wczytane": 0, "dodane": 0, "duplikaty": 0, "odrzucone": 0}
+    rejects = []
+    t0 = time.perf_counter()
+    row_no = 2  # numer wiersza w pliku (1 = nagłówek)
+    for raw in read_import_chunks(file, name, chunk_rows):
+        raw.index = pd.RangeIndex(row_no, row_no + len(raw), name="wiersz")
+        row_no += len(raw)
+        stats["wczytane"] += len(raw)
+        df, bad, reasons = _validate_chunk(raw, table, mapping, checks, not_null)
+
+        keys = _key_series(df, key_cols)
+        known = pd.Series([k in seen for k in keys], index=keys.index)  # isin() kopiowałby cały zbiór
+        dup = ~bad & keys.notna() & (known | keys.where(~bad).duplicated())
+        reasons = reasons.mask(dup, ("duplikat w pliku (" if table in IMPORT_FILE_KEYS_ONLY else "duplikat (")
+                               + ", ".join(key_cols) + ")")
+        seen.update(keys[~bad & ~dup].dropna())
+
+        stats["odrzucone"] += int(bad.sum())
+        stats["duplikaty"] += int(dup.sum())
+        rejected = bad | dup
+        if rejected.any() and sum(map(len, rejects)) < IMPORT_MAX_REJECTS:
+            rejects.append(raw[rejected].assign(**{"powód": reasons[rejected]}))
+
+        good = df[~rejected]
+        if not good.empty and not dry_run:
+            write(lambda conn: _insert_batch(conn, table, good))
+        stats["dodane"] += len(good)
+        if progress:
+            progress(stats)
+    stats["czas_s"] = round(time.perf_counter() - t0, 2)
+    report = pd.concat(rejects).head(IMPORT_MAX_REJECTS).reset_index() if rejects else pd.DataFrame()
+    if not report.empty:
+        report = report[["wiersz", "powód"] + [c for c in report.columns if c not in ("wiersz", "powód")]]
+    return stats, report
+
+# nagłówki spotykane w eksportach banków / programów księgowych (po normalizacji)
+IMPORT_ALIASES = {
+    "report_date": ("data",), "invoice_date": ("data", "datawystawienia"), "issue_date": ("data", "datawystawienia"),
+    "sale_date": ("data", "datasprzedazy"), "expense_date": ("data",), "tx_date": ("data", "dataoperacji", "dataksiegowania"),
+    "due_date": ("termin", "terminplatnosci"), "paid_date": ("datazaplaty",),
+    "supplier": ("dostawca", "kontrahent"), "company": ("firma", "kontrahent", "nabywca"),
+    "number": ("numer", "nrfaktury", "numerfaktury"), "invoice_number": ("numer", "nrfaktury", "numerfaktury"),
+    "amount": ("kwota", "brutto", "kwotabrutto"), "kwota": ("amount",), "notes": ("uwagi", "opis"), "uwagi": ("opis",),
+    "paid": ("oplacona", "zaplacona"), "shift": ("zmiana",), "staff_vet": ("lekarz",), "staff_tech": ("technik", "technicy"),
+    "counterparty": ("kontrahent", "nadawcaodbiorca", "nadawca", "odbiorca"), "title": ("tytul", "tytuloperacji", "opis"),
+    "account": ("rachunek", "nrrachunku"), "ref": ("referencja", "idtransakcji"),
+    "name": ("imieinazwisko", "pracownik"), "role": ("rola",), "monthly_salary": ("pensja", "wynagrodzenie"), "active": ("aktywny",),
+}
 
-def sum_ar_paid_for_month(y:int, m:int) -> float:
-    first, last = ym_bounds(y, m)
-    with cnx() as conn:
-        row = conn.execute(
-            "SELECT SUM(amount) FROM ar_invoices WHERE paid=1 AND date(paid_date) BETWEEN ? AND ?",
-            (first.isoformat(), last.isoformat())
-        ).fetchone()
-    return float(row[0] or 0)
+def _norm_name(s) -> str:
+    s = unicodedata.normalize("NFKD", _fts_fold(str(s))).encode("ascii", "ignore").decode()
+    return re.sub(r"[\W_]+", "", s.lower())
+
+def guess_mapping(table: str, columns) -> dict:
+    by_name = {_norm_name(c): c for c in columns}
+    mapping = {}
+    for col in IMPORT_TARGETS[table][1]:
+        for candidate in (col, *IMPORT_ALIASES.get(col, ())):
+            if _norm_name(candidate) in by_name:
+                mapping[col] = by_name[_norm_name(candidate)]
+                break
+    return mapping
+
+# ------------------ UZGADNIANIE Z BANKIEM --------
+# Transakcje z wyciągu łączone z otwartymi fakturami złączeniami haszującymi (pandas merge):
+# po kwocie w groszach i po tokenach numeru faktury z tytułu przelewu; okno dat i nazwa
+# kontrahenta zawężają/punktują kandydatów, a każda strona dostaje najwyżej jedno dopasowanie.
+RECON_EARLY_DAYS = 7     # przelew najwcześniej tyle dni przed wystawieniem faktury
+RECON_WINDOW_DAYS = 45   # ... i najpóźniej tyle dni po terminie płatności
+# tabela -> (znak kwoty na wyciągu, kolumna daty wystawienia, kolumna kontrahenta)
+RECON_SIDES = {
+    "ar_invoices": (1, "issue_date", "company"),
+    "ap_invoices": (-1, "invoice_date", "supplier"),
+}
+RECON_LEVELS = {5: "pewne", 3: "prawdopodobne", 0: "do sprawdzenia"}  # próg wyniku -> poziom
+
+def _compact(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str).map(_fts_fold).str.upper().str.replace(r"[\W_]+", "", regex=True)
+
+def _number_keys(ids: pd.Series, numbers: pd.Series) -> pd.DataFrame:
+    # pełny numer bez separatorów + same cyfry (przelewy często gubią prefiks "FV")
+    full = _compact(numbers)
+    digits = full.str.replace(r"\D+", "", regex=True)
+    keys = pd.concat([pd.DataFrame({"id": ids, "key": full}),
+                      pd.DataFrame({"id": ids, "key": digits.where(digits.str.len() >= 4, "")})])
+    return keys[keys["key"].ne("")].drop_duplicates()
+
+def _title_tokens(ids: pd.Series, titles: pd.Series) -> pd.DataFrame:
+    # ciągi typu FV/12/2025, 2025-01-15, 12345 z tytułu przelewu
+    tokens = titles.fillna("").astype(str).str.findall(r"\w+(?:\s?[/\-.]\s?\w+)*")
+    df = pd.DataFrame({"id": ids, "tok": tokens}).explode("tok").dropna()
+    df = df[df["tok"].str.contains(r"\d")]
+    return _number_keys(df["id"], df["tok"])
+
+def _name_words(text) -> set:
+    return {w for w in re.findall(r"\w{3,}", _fts_fold(str(text or "")).lower()) if not w.isdigit()}
+
+def reconcile(date_from: date, date_to: date, window_days: int = RECON_WINDOW_DAYS) -> pd.DataFrame:
+    """Propozycje dopasowań nieuzgodnionych transakcji z okresu do otwartych faktur AR/AP."""
+    tx = read_df(
+        """SELECT id, tx_date, amount, counterparty, title FROM bank_transactions
+           WHERE matched_id IS NULL AND tx_date BETWEEN ? AND ?""",
+        params=(date_from.isoformat(), date_to.isoformat()), types=vd.schema("bank_transactions"),
+    )
+    out = []
+    for table, (sign, issue_col, party_col) in RECON_SIDES.items():
+        side = tx[np.sign(tx["amount"]) == sign]
+        if side.empty:
+            continue
+        inv = read_df(
+            f"""SELECT id, {issue_col} AS issue_date, due_date, {party_col} AS party, number, amount
+                FROM {table} WHERE paid=0 AND due_date >= ? AND {issue_col} <= ?""",
+            params=((date_from - timedelta(days=window_days)).isoformat(),
+                    (date_to + timedelta(days=RECON_EARLY_DAYS)).isoformat()),
+            types=vd.schema(table, issue_date=issue_col, party=party_col),
+        )
+        if inv.empty:
+            continue
+        # kwoty w groszach – złączenie po równości liczb całkowitych, bez zaokrąglania floatów
+        side = side.assign(cents=side["amount"].abs())
+        inv = inv.assign(cents=inv["amount"])
+
+        by_amount = side[["id", "cents"]].merge(inv[["id", "cents"]], on="cents", suffixes=("_tx", "_inv"))
+        by_number = _title_tokens(side["id"], side["title"]).merge(
+            _number_keys(inv["id"], inv["number"]), on="key", suffixes=("_tx", "_inv"))
+        pairs = pd.concat([
+            by_amount[["id_tx", "id_inv"]].assign(amount_hit=True),
+            by_number[["id_tx", "id_inv"]].assign(number_hit=True),
+        ]).groupby(["id_tx", "id_inv"], as_index=False).agg(amount_hit=("amount_hit", "any"),
+                                                            number_hit=("number_hit", "any"))
+        if pairs.empty:
+            continue
+        pairs = (pairs.merge(side.add_suffix("_tx"), on="id_tx")
+                      .merge(inv.add_suffix("_inv"), on="id_inv"))
+        tx_day = pairs["tx_date_tx"]
+        in_window = (
+            (tx_day >= pairs["issue_date_inv"] - pd.Timedelta(days=RECON_EARLY_DAYS))
+            & (tx_day <= pairs["due_date_inv"] + pd.Timedelta(days=window_days))
+        )
+        pairs = pairs[in_window].copy()
+        if pairs.empty:
+            continue
+        pairs["name_hit"] = [
+            bool(_name_words(party) & (_name_words(cp) | _name_words(title)))
+            for party, cp, title in zip(pairs["party_inv"], pairs["counterparty_tx"], pairs["title_tx"])
+        ]
+        pairs["amount_hit"] = pairs["amount_hit"].fillna(False).astype(bool)
+        pairs["number_hit"] = pairs["number_hit"].fillna(False).astype(bool)
+        pairs["score"] = 3 * pairs["number_hit"] + 2 * pairs["amount_hit"] + pairs["name_hit"]
+        pairs["days"] = (tx_day[pairs.index] - pairs["due_date_inv"]).dt.days.abs()
+        pairs["table"] = table
+        out.append(pairs)
+
+    cols = ["tx_id", "tx_date", "kwota_bank", "kontrahent_bank", "tytuł", "tabela", "faktura_id",
+            "numer", "kontrahent", "kwota_faktury", "termin", "pewność", "zatwierdź"]
+    if not out:
+        return pd.DataFrame(columns=cols)
+    cand = pd.concat(out, ignore_index=True).sort_values(["score", "days"], ascending=[False, True])
+    # zachłannie: najlepszy wynik wygrywa, każda transakcja i faktura najwyżej raz
+    used_tx, used_inv, keep = set(), set(), []
+    for i, tx_id, table, inv_id in zip(cand.index, cand["id_tx"], cand["table"], cand["id_inv"]):
+        if tx_id in used_tx or (table, inv_id) in used_inv:
+            continue
+        used_tx.add(tx_id)
+        used_inv.add((table, inv_id))
+        keep.append(i)
+    best = cand.loc[keep]
+    level = best["score"].map(lambda s: next(v for t, v in RECON_LEVELS.items() if s >= t))
+    return pd.DataFrame({
+        "tx_id": best["id_tx"], "tx_date": best["tx_date_tx"], "kwota_bank": best["amount_tx"],
+        "kontrahent_bank": best["counterparty_tx"], "tytuł": best["title_tx"], "tabela": best["table"],
+        "faktura_id": best["id_inv"], "numer": best["number_inv"], "kontrahent": best["party_inv"],
+        "kwota_faktury": best["amount_inv"], "termin": best["due_date_inv"], "pewność": level,
+        # bez zgodnej kwoty nie zatwierdzamy automatycznie (częściowa wpłata, prowizja)
+        "zatwierdź": best["amount_hit"] & (best["score"] >= 3),
+    }, columns=cols).reset_index(drop=True)
+
+def apply_reconciliation(matches: pd.DataFrame) -> dict:
+    """Wiąże transakcje i oznacza faktury jako opłacone (paid_date = data przelewu) – jedna transakcja DB."""
+    pairs = list(zip(matches["tabela"], matches["faktura_id"].astype(int).tolist(), matches["tx_id"].astype(int).tolist(),
+                     pd.to_datetime(matches["tx_date"]).dt.strftime("%Y-%m-%d")))
+
+    def apply(conn):
+        done = dict.fromkeys(RECON_SIDES, 0)
+        for table, invoice_id, tx_id, paid_on in pairs:
+            # faktura tylko wtedy, gdy transakcja nie została w międzyczasie uzgodniona z czymś innym
+            linked = conn.execute(
+                "UPDATE bank_transactions SET matched_table=?, matched_id=? WHERE id=? AND matched_id IS NULL",
+                (table, invoice_id, tx_id),
+            ).rowcount
+            if linked:
+                done[table] += conn.execute(f"UPDATE {table} SET paid=1, paid_date=? WHERE id=? AND paid=0",
+                                            (paid_on, invoice_id)).rowcount
+        return done
+
+    return write(apply)["result"]
+
+# ------------------ WIEKOWANIE (aging) -----------
+# Stan „otwartych” faktur na dowolny dzień: wystawione do as_of i nieopłacone albo opłacone
+# później (paid_date > as_of). Kubełki z pd.cut po konfigurowalnych granicach dni po terminie.
+AGING_BOUNDS = vd.AGING_BOUNDS
+AGING_NOT_DUE = vd.AGING_NOT_DUE
+AGING_SIDES = vd.AGING_SIDES
+aging_labels = vd.aging_labels
+
+def parse_bounds(text: str) -> tuple:
+    bounds = sorted({int(x) for x in re.findall(r"\d+", text or "") if int(x) > 0})
+    return tuple(bounds) or AGING_BOUNDS
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _aging_detail(side: str, as_of: str, bounds: tuple, version: tuple) -> pd.DataFrame:
+    with ro_cnx() as conn:
+        return vd.aging_detail(conn, side, date.fromisoformat(as_of), bounds)
+
+def aging_detail(side: str, as_of: date, bounds=AGING_BOUNDS) -> pd.DataFrame:
+    """Otwarte faktury AR/AP na dzień `as_of` z liczbą dni po terminie i kubełkiem."""
+    return _aging_detail(side, as_of.isoformat(), tuple(bounds), table_version(AGING_SIDES[side][0])).copy()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _aging_matrix(side: str, as_of: str, bounds: tuple, version: tuple) -> pd.DataFrame:
+    return vd.aging_matrix(_aging_detail(side, as_of, bounds, version), bounds)
+
+def aging_matrix(side: str, as_of: date, bounds=AGING_BOUNDS) -> pd.DataFrame:
+    """Macierz kontrahent x kubełek (suma kwot), malejąco po saldzie – cache per wersja tabeli."""
+    return _aging_matrix(side, as_of.isoformat(), tuple(bounds), table_version(AGING_SIDES[side][0])).copy()
+
+def aging_box(side: str, key: str):
+    c1, c2 = st.columns(2)
+    as_of = c1.date_input("Stan na dzień", value=date.today(), key=f"{key}_asof")
+    bounds = parse_bounds(c2.text_input("Granice kubełków (dni po terminie)",
+                                        value=", ".join(map(str, AGING_BOUNDS)), key=f"{key}_bounds"))
+    st.caption(f"Faktury otwarte na {as_of.isoformat()} (wystawione do tego dnia, nieopłacone "
+               "albo opłacone później) wg **terminu płatności**.")
+    df = aging_detail(side, as_of, bounds)
+    if df.empty:
+        st.success("Brak otwartych faktur na ten dzień.")
+        return
+    totals = df.groupby("kubełek", observed=False)["amount"].sum().rename("kwota")
+    overdue = totals.drop(AGING_NOT_DUE).sum()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Otwarte razem", fmt_zl(totals.sum()))
+    m2.metric("W tym po terminie", fmt_zl(overdue))
+    m3.metric("Liczba faktur", len(df))
+
+    st.subheader("Suma wg kubełków")
+    st.dataframe(zl_frame(totals).reset_index(), use_container_width=True, hide_index=True)
+    st.bar_chart(zl_frame(totals))
+
+    st.subheader("Kontrahenci × kubełki")
+    st.dataframe(zl_frame(aging_matrix(side, as_of, bounds)), use_container_width=True)
+
+    with st.expander("Lista otwartych faktur (szczegóły)"):
+        st.dataframe(zl_frame(df, ["amount"]), use_container_width=True, hide_index=True)
+
+# ------------------ LISTY STRONICOWANE ----------
+# Stronicowanie po kluczu (sort_key, id): kolejna strona to `(sort, id) < (ostatni wiersz)`,
+# więc koszt strony nie rośnie z numerem strony (w przeciwieństwie do OFFSET).
+PAGE_SIZES = (25, 50, 100, 200)
+
+def _pager_state(key: str, sig) -> dict:
+    state = st.session_state.get(f"pager_{key}")
+    if state is None or state["sig"] != sig:
+        # zmiana filtrów / sortowania => od pierwszej strony
+        state = {"sig": sig, "stack": [None]}
+        st.session_state[f"pager_{key}"] = state
+    return state
+
+def _pager_next(key: str, cursor):
+    st.session_state[f"pager_{key}"]["stack"].append(cursor)
+
+def _pager_prev(key: str):
+    stack = st.session_state[f"pager_{key}"]["stack"]
+    if len(stack) > 1:
+        stack.pop()
+
+def _py(value):
+    return value.item() if hasattr(value, "item") else value
+
+def keyset_fetch(select: str, from_: str, where=(), params=(), sort: str = "id", id_col: str = "id",
+                 desc: bool = True, cursor=None, size: int = PAGE_SIZES[0]):
+    """Strona wierszy za kursorem (sort, id) + czy jest następna + liczba wszystkich wierszy."""
+    where, params = list(where), list(params)
+    page_where = list(where)
+    page_params = list(params)
+    if cursor is not None:
+        page_where.append(f"({sort}, {id_col}) {'<' if desc else '>'} (?, ?)")
+        page_params.extend(cursor)
+    where_sql = ("WHERE " + " AND ".join(page_where)) if page_where else ""
+    direction = "DESC" if desc else "ASC"
+    df = read_df(
+        f"""SELECT {select}, {sort} AS _sort_key, {id_col} AS _row_id FROM {from_} {where_sql}
+            ORDER BY {sort} {direction}, {id_col} {direction} LIMIT ?""",
+        params=(*page_params, size + 1),
+    )
+    has_next = len(df) > size
+    count_where = ("WHERE " + " AND ".join(where)) if where else ""
+    total = int(read_df(f"SELECT COUNT(*) AS n FROM {from_} {count_where}", params=params)["n"].iloc[0])
+    return df.iloc[:size], has_next, total
+
+def keyset_page(key: str, select: str, from_: str, where=(), params=(), sort: str = "id",
+                id_col: str = "id", desc: bool = True) -> pd.DataFrame:
+    """Jedna strona listy + nawigacja (rozmiar strony, poprzednia/następna, licznik wierszy)."""
+    size = st.selectbox("Wierszy na stronę", PAGE_SIZES, key=f"{key}_size")
+    where, params = list(where), list(params)
+    state = _pager_state(key, (select, from_, tuple(where), _params_key(params), sort, desc, size))
+    cursor = state["stack"][-1]
+
+    df, has_next, total = keyset_fetch(select, from_, where, params, sort, id_col, desc, cursor, size)
+    page_no = len(state["stack"])
+    start = (page_no - 1) * size
+
+    c1, c2, c3 = st.columns([1, 1, 4])
+    c1.button("◀ Poprzednia", key=f"{key}_prev", disabled=page_no == 1, on_click=_pager_prev, args=(key,))
+    next_cursor = (_py(df["_sort_key"].iloc[-1]), _py(df["_row_id"].iloc[-1])) if has_next else None
+    c2.button("Następna ▶", key=f"{key}_next", disabled=not has_next, on_click=_pager_next, args=(key, next_cursor))
+    shown = f"{start + 1}–{start + len(df)}" if len(df) else "0"
+    c3.caption(f"Strona {page_no} · wiersze {shown} z {total}")
+    return df.drop(columns=["_sort_key", "_row_id"])
+
+# ------------------ WYBÓR REKORDU (wyszukiwarka) -
+# Zamiast słownika etykiet dla całej tabeli: baza zwraca najwyżej PICKER_LIMIT
+# rekordów pasujących do #id albo do początku numeru / kontrahenta (LIKE 'abc%'
+# po indeksie COLLATE NOCASE), a gotowe etykiety są cache'owane per wersja tabeli.
+PICKER_LIMIT = 50
+
+def _dash(value):
+    # pusta wartość (None / NaN z pandas / "") jako „—”
+    return "—" if value is None or value == "" or (isinstance(value, float) and pd.isna(value)) else value
+
+PICKERS = {
+    "ap_unpaid": {
+        "table": "ap_invoices", "cols": "id, supplier, number, amount, due_date",
+        "where": "paid=0", "order": "due_date ASC, id ASC", "search": ("supplier", "number"),
+        "label": lambda r: f"#{r.id} | {r.supplier} | {_dash(r.number)} | {fmt_zl(r.amount)} | termin: {r.due_date}",
+    },
+    "ap_all": {
+        "table": "ap_invoices", "cols": "id, supplier, number, amount, due_date, paid",
+        "where": "", "order": "id DESC", "search": ("supplier", "number"),
+        "label": lambda r: (f"#{r.id} | {r.supplier} | {_dash(r.number)} | {fmt_zl(r.amount)} | termin: {r.due_date} | "
+                            f"{'opłacona' if r.paid else 'NIE'}"),
+    },
+    "ar_all": {
+        "table": "ar_invoices", "cols": "id, company, number, amount, paid, issue_date, due_date, paid_date",
+        "where": "", "order": "id DESC", "search": ("company", "number"),
+        "label": lambda r: (f"#{r.id} | {r.company} | {_dash(r.number)} | {fmt_zl(r.amount)} | "
+                            f"{'opłacona' if r.paid else 'NIE'} | wyst: {r.issue_date} | termin: {r.due_date} | "
+                            f"zapł: {_dash(r.paid_date)}"),
+    },
+}
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _picker_options(kind: str, query: str, version: tuple) -> dict:
+    # `version` = table_version(tabela) – zmiana danych unieważnia gotowe etykiety
+    spec = PICKERS[kind]
+    where, params = ([spec["where"]] if spec["where"] else []), []
+    q = query.strip().lstrip("#")
+    if q:
+        if spec["where"]:
+            # unarny + wyłącza indeks na filtrze stałym, żeby planer wybrał indeksy wyszukiwania
+            where = [f"+{spec['where']}"]
+        # % i _ to znaki specjalne LIKE – wyszukujemy zawsze po prefiksie
+        prefix = q.replace("%", "").replace("_", "") + "%"
+        match = [f"{col} LIKE ?" for col in spec["search"]]
+        params.extend([prefix] * len(match))
+        if q.isdigit():
+            match.append("id = ?")
+            params.append(int(q))
+        where.append("(" + " OR ".join(match) + ")")
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    df = read_df(
+        f"SELECT {spec['cols']} FROM {spec['table']} {where_sql} ORDER BY {spec['order']} LIMIT ?",
+        params=(*params, PICKER_LIMIT),
+    )
+    return {spec["label"](row): int(row.id) for row in df.itertuples(index=False)}
+
+def record_picker(kind: str, label: str, key: str):
+    """Pole wyszukiwania + selectbox z najwyżej PICKER_LIMIT rekordami; zwraca id albo None."""
+    query = st.text_input(f"{label} – szukaj (#id, numer, kontrahent)", key=f"{key}_q")
+    options = _picker_options(kind, query, table_version(PICKERS[kind]["table"]))
+    if not options:
+        st.info("Brak pasujących rekordów.")
+        return None
+    if len(options) == PICKER_LIMIT:
+        st.caption(f"Pokazano pierwsze {PICKER_LIMIT} wyników – zawęź wyszukiwanie.")
+    chosen = st.selectbox(label, list(options.keys()), key=key)
+    return options.get(chosen)
+
+# ------------------ WYSZUKIWARKA GLOBALNA --------
+@st.cache_resource(show_spinner=False)
+def fts_available(path: str) -> bool:
+    with get_pool(path, readonly=True).connection() as conn:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='fts_ar_invoices'"
+        ).fetchone() is not None
+
+def fts_query(text: str, cols=None) -> str:
+    """Tekst użytkownika -> zapytanie MATCH: każde słowo jako prefiks, wszystkie wymagane."""
+    terms = re.findall(r"\w+", _fts_fold(text or ""))
+    if not terms:
+        return ""
+    expr = " AND ".join(f'"{t}"*' for t in terms)
+    return f"{{{' '.join(cols)}}} : ({expr})" if cols else expr
+
+def global_search(text: str, limit: int = SEARCH_LIMIT) -> pd.DataFrame:
+    match = fts_query(text)
+    if not match or not fts_available(clinic_db()):
+        return pd.DataFrame(columns=["moduł", "id", "data", "opis", "kwota", "fragment"])
+    parts, params = [], []
+    for table, (module, _, date_col, label, amount) in SEARCH_SOURCES.items():
+        fts = f"fts_{table}"
+        parts.append(f"""SELECT * FROM (
+            SELECT '{module}' AS "moduł", t.id, t.{date_col} AS data, {label} AS opis, {amount} AS kwota,
+                   snippet({fts}, -1, '[', ']', '…', 10) AS fragment, bm25({fts}) AS _rank
+            FROM {fts} JOIN {table} t ON t.id = {fts}.rowid
+            WHERE {fts} MATCH ? ORDER BY _rank LIMIT ?)""")
+        params.extend([match, limit])
+    df = read_df(" UNION ALL ".join(parts) + " ORDER BY _rank LIMIT ?", params=(*params, limit))
+    return df.drop(columns=["_rank"])
+
+def search_results_box(text: str):
+    st.subheader(f"🔎 Wyniki wyszukiwania: „{text}”")
+    if not fts_available(clinic_db()):
+        st.warning("Ta wersja SQLite nie obsługuje FTS5 – wyszukiwarka jest niedostępna.")
+        return
+    df = global_search(text)
+    if df.empty:
+        st.info("Brak wyników.")
+        return
+    if len(df) == SEARCH_LIMIT:
+        st.caption(f"Pokazano {SEARCH_LIMIT} najlepiej dopasowanych wyników – zawęź wyszukiwanie.")
+    st.dataframe(zl_frame(df, ["kwota"]), use_container_width=True, hide_index=True)
+    st.divider()
 
 # ------------------ UI: RECEPCJA -----------------
 def page_recepcja():
@@ -231,8 +2509,8 @@ def page_recepcja():
             if st.button("Dodaj lekarza"):
                 if new_vet.strip():
                     try:
-                        with cnx() as conn:
-                            conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'lekarz', 1)", (new_vet.strip(),))
+                        write(lambda conn: conn.execute(
+                            "INSERT INTO employees (name, role, active) VALUES (?, 'lekarz', 1)", (new_vet.strip(),)).lastrowid)
                         st.success(f"Dodano lekarza: {new_vet.strip()}")
                         st.rerun()
                     except sqlite3.IntegrityError:
@@ -242,8 +2520,8 @@ def page_recepcja():
             if st.button("Dodaj technika"):
                 if new_tech.strip():
                     try:
-                        with cnx() as conn:
-                            conn.execute("INSERT INTO employees (name, role, active) VALUES (?, 'technik', 1)", (new_tech.strip(),))
+                        write(lambda conn: conn.execute(
+                            "INSERT INTO employees (name, role, active) VALUES (?, 'technik', 1)", (new_tech.strip(),)).lastrowid)
                         st.success(f"Dodano technika: {new_tech.strip()}")
                         st.rerun()
                     except sqlite3.IntegrityError:
@@ -254,7 +2532,7 @@ def page_recepcja():
     if not lekarze or not technicy:
         st.info("Brakuje aktywnych pracowników. Dodaj ich wyżej lub w zakładce **Pracownicy (admin)**.")
 
-    with st.form("raport_form"):
+    with entry_form("raport_form"):
         d = st.date_input("Data", value=date.today())
         shift = st.selectbox("Zmiana", ["poranna", "popołudniowa"])
         staff_vet = st.selectbox("Lekarz na zmianie", lekarze or ["— brak —"])
@@ -268,29 +2546,27 @@ def page_recepcja():
         if staff_vet in (None, "", "— brak —") or not staff_tech_list:
             st.error("Uzupełnij lekarza i co najmniej jednego technika.")
         else:
+            def save_report(conn):
+                report_id = conn.execute(
+                    """INSERT INTO daily_reports
+                       (report_date, shift, staff_vet, staff_tech, kasa, terminal, uwagi)
+                       VALUES (?,?,?,?,?,?,?)""",
+                    (d.isoformat(), shift, staff_vet, ", ".join(staff_tech_list), to_grosze(kasa), to_grosze(terminal), uwagi),
+                ).lastrowid
+                conn.executemany("INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?,?)",
+                                 [(report_id, tech) for tech in staff_tech_list])
+                return report_id
+
             try:
-                with cnx() as conn:
-                    cur = conn.cursor()
-                    cur.execute(
-                        """INSERT INTO daily_reports
-                           (report_date, shift, staff_vet, staff_tech, kasa, terminal, uwagi)
-                           VALUES (?,?,?,?,?,?,?)""",
-                        (d.isoformat(), shift, staff_vet, ", ".join(staff_tech_list), kasa, terminal, uwagi),
-                    )
-                    report_id = cur.lastrowid
-                    for tech in staff_tech_list:
-                        cur.execute("INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?,?)",
-                                    (report_id, tech))
-                    conn.commit()
-                st.success("Zapisano raport i przypisano techników.")
+                submit_form_write("raport_form", save_report, "Zapisano raport i przypisano techników.")
             except sqlite3.Error as e:
                 st.error(f"Błąd SQL: {e}")
 
     st.subheader("Ostatnie wpisy")
     try:
-        df = pd.read_sql_query(
+        df = keyset_page(
+            "rec_list",
             """
-            SELECT
               r.id,
               r.report_date,
               r.shift,
@@ -301,13 +2577,20 @@ def page_recepcja():
                  WHERE t.daily_report_id = r.id
               ), '') AS staff_tech,
               r.kasa, r.terminal, r.uwagi
-            FROM daily_reports r
-            ORDER BY r.id DESC
-            LIMIT 10
             """,
-            cnx(),
+            "daily_reports r",
+            sort="r.id", id_col="r.id",
+        )
+        st.dataframe(zl_frame(df, ["kasa", "terminal"]), use_container_width=True)
+        export_box(
+            "rec",
+            """SELECT r.id, r.report_date, r.shift, r.staff_vet,
+                      COALESCE((SELECT GROUP_CONCAT(t.tech_name, ', ') FROM daily_report_techs t
+                                WHERE t.daily_report_id = r.id), '') AS staff_tech,
+                      r.kasa / 100.0 AS kasa, r.terminal / 100.0 AS terminal, r.uwagi
+               FROM daily_reports r ORDER BY r.report_date, r.id""",
+            filename="raporty_dzienne",
         )
-        st.dataframe(df, use_container_width=True)
     except Exception as e:
         st.warning(f"Nie udało się pobrać danych: {e}")
 
@@ -322,20 +2605,18 @@ def page_recepcja():
             d_to   = st.date_input("Do dnia", value=date.today(), key="del_to")
 
         try:
-            df_del = pd.read_sql_query(
+            df_del = keyset_page(
+                "rec_del",
                 """
-                SELECT
                   r.id, r.report_date, r.shift, r.staff_vet,
                   COALESCE((SELECT GROUP_CONCAT(t.tech_name, ', ') FROM daily_report_techs t
                             WHERE t.daily_report_id = r.id), '') AS techs,
                   (r.kasa + r.terminal) AS razem
-                FROM daily_reports r
-                WHERE date(r.report_date) BETWEEN ? AND ?
-                ORDER BY r.report_date DESC, r.id DESC
-                LIMIT 200
                 """,
-                cnx(),
-                params=(d_from.isoformat(), d_to.isoformat()),
+                "daily_reports r",
+                where=["r.report_date BETWEEN ? AND ?"],
+                params=[d_from.isoformat(), d_to.isoformat()],
+                sort="r.report_date", id_col="r.id",
             )
         except Exception as e:
             st.warning(f"Nie udało się pobrać listy do usunięcia: {e}")
@@ -345,7 +2626,7 @@ def page_recepcja():
             st.info("Brak raportów w podanym zakresie.")
         else:
             options = {
-                f"#{row.id} | {row.report_date} {row.shift} | Lekarz: {row.staff_vet} | Tech: {row.techs} | {row.razem:.2f} zł":
+                f"#{row.id} | {row.report_date} {row.shift} | Lekarz: {row.staff_vet} | Tech: {row.techs} | {fmt_zl(row.razem)}":
                 int(row.id)
                 for row in df_del.itertuples(index=False)
             }
@@ -353,9 +2634,8 @@ def page_recepcja():
             sure = st.checkbox("Tak, potwierdzam trwałe usunięcie")
             if st.button("🗑️ Usuń wybrany raport") and sure:
                 try:
-                    with cnx() as conn:
-                        conn.execute("DELETE FROM daily_reports WHERE id=?", (options[chosen],))
-                        conn.commit()
+                    report_id = options[chosen]
+                    write(lambda conn: conn.execute("DELETE FROM daily_reports WHERE id=?", (report_id,)).rowcount)
                     st.success("Raport usunięty.")
                     st.rerun()
                 except Exception as e:
@@ -365,10 +2645,10 @@ def page_recepcja():
 def page_faktury_kosztowe():
     st.header("📥 Faktury kosztowe (AP)")
 
-    tab_add, tab_list = st.tabs(["➕ Dodaj fakturę", "📋 Lista / Płatności / Usuwanie"])
+    tab_add, tab_list, tab_age = st.tabs(["➕ Dodaj fakturę", "📋 Lista / Płatności / Usuwanie", "⏳ Wiekowanie"])
 
     with tab_add:
-        with st.form("ap_add_form"):
+        with entry_form("ap_add_form"):
             col1, col2 = st.columns(2)
             with col1:
                 inv_date = st.date_input("Data faktury", value=date.today())
@@ -386,14 +2666,12 @@ def page_faktury_kosztowe():
                 st.error("Wymagane: Dostawca oraz kwota > 0.")
             else:
                 try:
-                    with cnx() as conn:
-                        conn.execute(
-                            """INSERT INTO ap_invoices
-                               (invoice_date, due_date, supplier, number, category, amount, notes, paid)
-                               VALUES (?,?,?,?,?,?,?,0)""",
-                            (inv_date.isoformat(), due_date.isoformat(), supplier, number, category, amount, notes),
-                        )
-                    st.success("Faktura dodana.")
+                    row = (inv_date.isoformat(), due_date.isoformat(), supplier, number, category, to_grosze(amount), notes)
+                    submit_form_write("ap_add_form", lambda conn: conn.execute(
+                        """INSERT INTO ap_invoices
+                           (invoice_date, due_date, supplier, number, category, amount, notes, paid)
+                           VALUES (?,?,?,?,?,?,?,0)""", row,
+                    ).lastrowid, "Faktura dodana.")
                 except sqlite3.Error as e:
                     st.error(f"Błąd SQL: {e}")
 
@@ -404,13 +2682,19 @@ def page_faktury_kosztowe():
         where = "WHERE paid=0" if only_unpaid else ""
         order = "ORDER BY due_date ASC" if order_by_due else "ORDER BY id DESC"
 
+        ap_sql = f"""SELECT id, invoice_date, due_date, supplier, number, category, amount / 100.0 AS amount, paid, paid_date, notes
+                     FROM ap_invoices {where} {order}"""
         try:
-            df = pd.read_sql_query(
-                f"""SELECT id, invoice_date, due_date, supplier, number, category, amount, paid, paid_date, notes
-                    FROM ap_invoices {where} {order}""",
-                cnx(),
+            df = keyset_page(
+                "ap_list",
+                "id, invoice_date, due_date, supplier, number, category, amount, paid, paid_date, notes",
+                "ap_invoices",
+                where=["paid=0"] if only_unpaid else [],
+                sort="due_date" if order_by_due else "id",
+                desc=not order_by_due,
             )
-            st.dataframe(df, use_container_width=True)
+            st.dataframe(zl_frame(df, ["amount"]), use_container_width=True)
+            export_box("ap", ap_sql, filename="AP_faktury")
         except Exception as e:
             st.warning(f"Nie udało się pobrać listy: {e}")
             df = pd.DataFrame()
@@ -419,61 +2703,67 @@ def page_faktury_kosztowe():
         u = st.session_state.get("user", {})
         if u.get("role") == "admin":
             st.subheader("✅ Oznacz jako opłaconą")
-            try:
-                df_unpaid = pd.read_sql_query(
-                    "SELECT id, supplier, number, amount, due_date FROM ap_invoices WHERE paid=0 ORDER BY due_date ASC",
-                    cnx(),
-                )
-            except Exception as e:
-                st.warning(f"Nie udało się pobrać niezapłaconych: {e}")
-                df_unpaid = pd.DataFrame()
-
-            if not df_unpaid.empty:
-                options_pay = {
-                    f"#{row.id} | {row.supplier} | {row.number or '—'} | {row.amount:.2f} PLN | termin: {row.due_date}": int(row.id)
-                    for row in df_unpaid.itertuples(index=False)
-                }
-                sel_pay = st.selectbox("Wybierz fakturę do oznaczenia", list(options_pay.keys()), key="pay_sel")
-                if st.button("💸 Oznacz jako opłaconą (dzisiaj)"):
-                    try:
-                        with cnx() as conn:
-                            conn.execute(
-                                "UPDATE ap_invoices SET paid=1, paid_date=? WHERE id=?",
-                                (date.today().isoformat(), options_pay[sel_pay]),
-                            )
-                        st.success("Oznaczono jako opłaconą.")
-                        st.rerun()
-                    except sqlite3.Error as e:
-                        st.error(f"Błąd SQL: {e}")
+            pay_id = record_picker("ap_unpaid", "Wybierz fakturę do oznaczenia", key="pay_sel")
+            if pay_id is not None and st.button("💸 Oznacz jako opłaconą (dzisiaj)"):
+                try:
+                    write(lambda conn: conn.execute(
+                        "UPDATE ap_invoices SET paid=1, paid_date=? WHERE id=?",
+                        (date.today().isoformat(), pay_id),
+                    ).rowcount)
+                    st.success("Oznaczono jako opłaconą.")
+                    st.rerun()
+                except sqlite3.Error as e:
+                    st.error(f"Błąd SQL: {e}")
 
             st.subheader("🗑️ Usuń fakturę (ADMIN)")
-            try:
-                df_all = pd.read_sql_query(
-                    "SELECT id, supplier, number, amount, due_date, paid FROM ap_invoices ORDER BY id DESC",
-                    cnx(),
-                )
-            except Exception as e:
-                st.warning(f"Nie udało się pobrać faktur: {e}")
-                df_all = pd.DataFrame()
-
-            if not df_all.empty:
-                options_del = {
-                    f"#{row.id} | {row.supplier} | {row.number or '—'} | {row.amount:.2f} PLN | termin: {row.due_date} | {'opłacona' if row.paid else 'NIE'}":
-                    int(row.id)
-                    for row in df_all.itertuples(index=False)
-                }
-                sel_del = st.selectbox("Wybierz fakturę do usunięcia", list(options_del.keys()), key="del_sel")
+            del_id = record_picker("ap_all", "Wybierz fakturę do usunięcia", key="del_sel")
+            if del_id is not None:
                 sure = st.checkbox("Tak, potwierdzam usunięcie tej faktury")
                 if st.button("🗑️ Usuń fakturę") and sure:
                     try:
-                        with cnx() as conn:
-                            conn.execute("DELETE FROM ap_invoices WHERE id=?", (options_del[sel_del],))
+                        write(lambda conn: conn.execute("DELETE FROM ap_invoices WHERE id=?", (del_id,)).rowcount)
                         st.success("Faktura usunięta.")
                         st.rerun()
                     except sqlite3.Error as e:
                         st.error(f"Błąd SQL: {e}")
 
+    with tab_age:
+        aging_box("ap", key="ap_age")
+
 # ------------------ UI: AR (pełen obieg) ----------
+AR_LIST_SORT = "(CASE WHEN paid=1 THEN COALESCE(paid_date, issue_date) ELSE issue_date END)"
+
+def ar_list_filter(status: str, by_paid_date: bool, dt_from: date, dt_to: date,
+                   category=None, text: str = "") -> tuple:
+    """WHERE (lista warunków) i parametry listy faktur AR wg filtrów zakładki."""
+    where = []
+    params = []
+    if status == "Tylko nieopłacone":
+        where.append("paid=0")
+    elif status == "Tylko opłacone":
+        where.append("paid=1")
+
+    if not by_paid_date:
+        where.append("issue_date BETWEEN ? AND ?")
+    else:
+        where.append("paid=1")
+        where.append("paid_date BETWEEN ? AND ?")
+    params.extend([dt_from.isoformat(), dt_to.isoformat()])
+
+    if category:
+        where.append("category=?")
+        params.append(category)
+
+    match = fts_query(text, cols=("company", "number")) if fts_available(clinic_db()) else ""
+    if match:
+        where.append("id IN (SELECT rowid FROM fts_ar_invoices WHERE fts_ar_invoices MATCH ?)")
+        params.append(match)
+    elif (text or "").strip():
+        where.append("(company LIKE ? OR IFNULL(number,'') LIKE ?)")
+        like = f"%{text.strip()}%"
+        params.extend([like, like])
+    return where, params
+
 def page_ar():
     st.header(" Faktury przychodowe (AR) – wystawione / nieopłacone / opłacone")
 
@@ -487,7 +2777,7 @@ def page_ar():
     # --- Dodawanie ---
     with tab_add:
         st.caption("Możesz dodać fakturę wystawioną (domyślnie nieopłacona) albo już opłaconą.")
-        with st.form("ar_add_form"):
+        with entry_form("ar_add_form"):
             col1, col2 = st.columns(2)
             with col1:
                 issue_date = st.date_input("Data wystawienia", value=date.today())
@@ -507,15 +2797,13 @@ def page_ar():
                 st.error("Wymagane: Nabywca i kwota > 0.")
             else:
                 try:
-                    with cnx() as conn:
-                        conn.execute(
-                            """INSERT INTO ar_invoices
-                               (issue_date, due_date, company, number, category, amount, notes, paid, paid_date)
-                               VALUES (?,?,?,?,?,?,?,?,?)""",
-                            (issue_date.isoformat(), due_date.isoformat(), company, number, category, amount, notes,
-                             int(mark_paid), (paid_date.isoformat() if mark_paid else None)),
-                        )
-                    st.success("Faktura AR dodana.")
+                    row = (issue_date.isoformat(), due_date.isoformat(), company, number, category, to_grosze(amount), notes,
+                           int(mark_paid), (paid_date.isoformat() if mark_paid else None))
+                    submit_form_write("ar_add_form", lambda conn: conn.execute(
+                        """INSERT INTO ar_invoices
+                           (issue_date, due_date, company, number, category, amount, notes, paid, paid_date)
+                           VALUES (?,?,?,?,?,?,?,?,?)""", row,
+                    ).lastrowid, "Faktura AR dodana.")
                 except sqlite3.Error as e:
                     st.error(f"Błąd SQL: {e}")
 
@@ -538,66 +2826,40 @@ def page_ar():
 
         company_q = st.text_input("Szukaj po firmie / numerze (opcjonalnie)")
 
-        # budowa WHERE
-        where = []
-        params = []
-        if status == "Tylko nieopłacone":
-            where.append("paid=0")
-        elif status == "Tylko opłacone":
-            where.append("paid=1")
-
-        if date_mode == "Data wystawienia":
-            where.append("date(issue_date) BETWEEN ? AND ?")
-        else:
-            where.append("paid=1")
-            where.append("date(paid_date) BETWEEN ? AND ?")
-        params.extend([dt_from.isoformat(), dt_to.isoformat()])
-
-        if cat != "(wszystkie)":
-            where.append("category=?")
-            params.append(cat)
-
-        if company_q.strip():
-            where.append("(company LIKE ? OR IFNULL(number,'') LIKE ?)")
-            like = f"%{company_q.strip()}%"
-            params.extend([like, like])
-
+        where, params = ar_list_filter(status, date_mode != "Data wystawienia", dt_from, dt_to,
+                                       None if cat == "(wszystkie)" else cat, company_q)
         where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-        order_sql = "ORDER BY (CASE WHEN paid=1 THEN date(paid_date) ELSE date(issue_date) END) DESC, id DESC"
+        sort_key = AR_LIST_SORT
+        order_sql = f"ORDER BY {sort_key} DESC, id DESC"
 
+        ar_sql = f"""SELECT id, issue_date, due_date, company, number, category, amount / 100.0 AS amount, paid, paid_date, notes
+                     FROM ar_invoices
+                     {where_sql}
+                     {order_sql}"""
         try:
-            df = pd.read_sql_query(
-                f"""SELECT id, issue_date, due_date, company, number, category, amount, paid, paid_date, notes
-                    FROM ar_invoices
-                    {where_sql}
-                    {order_sql}""",
-                cnx(),
-                params=params,
+            df = keyset_page(
+                "ar_list",
+                "id, issue_date, due_date, company, number, category, amount, paid, paid_date, notes",
+                "ar_invoices",
+                where=where, params=params, sort=sort_key,
             )
-            st.dataframe(df, use_container_width=True)
-            st.download_button("⬇️ Eksport CSV", df.to_csv(index=False).encode("utf-8"), "AR_faktury.csv", "text/csv")
+            st.dataframe(zl_frame(df, ["amount"]), use_container_width=True)
+            export_box("ar", ar_sql, params, filename="AR_faktury")
         except Exception as e:
             st.warning(f"Nie udało się pobrać listy: {e}")
             df = pd.DataFrame()
 
         # Akcje: oznacz/odznacz płatność
-        if not df.empty:
-            st.subheader("Akcje")
-            options = {
-                f"#{row.id} | {row.company} | {row.number or '—'} | {row.amount:.2f} PLN | "
-                f"{'opłacona' if row.paid else 'NIE'} | wyst: {row.issue_date} | termin: {row.due_date} | zapł: {row.paid_date or '—'}"
-                : int(row.id)
-                for row in df.itertuples(index=False)
-            }
-            selected = st.selectbox("Wybierz fakturę", list(options.keys()))
-
+        st.subheader("Akcje")
+        selected_id = record_picker("ar_all", "Wybierz fakturę", key="ar_action_sel")
+        if selected_id is not None:
             cA, cB = st.columns(2)
             with cA:
                 pd_dt = st.date_input("Data zapłaty", value=date.today(), key="ar_paid_dt")
                 if st.button("💸 Oznacz jako opłaconą"):
                     try:
-                        with cnx() as conn:
-                            conn.execute("UPDATE ar_invoices SET paid=1, paid_date=? WHERE id=?", (pd_dt.isoformat(), options[selected]))
+                        write(lambda conn: conn.execute(
+                            "UPDATE ar_invoices SET paid=1, paid_date=? WHERE id=?", (pd_dt.isoformat(), selected_id)).rowcount)
                         st.success("Oznaczono jako opłaconą.")
                         st.rerun()
                     except sqlite3.Error as e:
@@ -608,8 +2870,8 @@ def page_ar():
                 if u.get("role") == "admin":
                     if st.button("↩️ Cofnij płatność (ADMIN)"):
                         try:
-                            with cnx() as conn:
-                                conn.execute("UPDATE ar_invoices SET paid=0, paid_date=NULL WHERE id=?", (options[selected],))
+                            write(lambda conn: conn.execute(
+                                "UPDATE ar_invoices SET paid=0, paid_date=NULL WHERE id=?", (selected_id,)).rowcount)
                             st.success("Cofnięto oznaczenie płatności.")
                             st.rerun()
                         except sqlite3.Error as e:
@@ -617,37 +2879,7 @@ def page_ar():
 
     # --- Wiekowanie (aging) ---
     with tab_age:
-        st.caption("Wiekowanie liczone po **terminie płatności** dla **nieopłaconych** na dziś.")
-        today = date.today().isoformat()
-        df_age = pd.read_sql_query(
-            """
-            SELECT id, company, number, amount, due_date,
-                   CAST(julianday(?) - julianday(due_date) AS INTEGER) AS days_past_due
-            FROM ar_invoices
-            WHERE paid=0
-            ORDER BY due_date ASC
-            """,
-            cnx(),
-            params=(today,),
-        )
-        if df_age.empty:
-            st.success("Brak nieopłaconych faktur AR.")
-        else:
-            # kubełki
-            def bucket(d):
-                if d <= 0: return "0–30"
-                if d <= 30: return "0–30"
-                if d <= 60: return "31–60"
-                if d <= 90: return "61–90"
-                return "90+"
-            df_age["bucket"] = df_age["days_past_due"].apply(bucket)
-            pivot = df_age.groupby("bucket")["amount"].sum().reindex(["0–30", "31–60", "61–90", "90+"], fill_value=0).reset_index()
-            st.subheader("Suma zaległości wg kubełków")
-            st.dataframe(pivot, use_container_width=True)
-            st.bar_chart(pivot.set_index("bucket"))
-
-            st.subheader("Lista nieopłaconych (szczegóły)")
-            st.dataframe(df_age, use_container_width=True)
+        aging_box("ar", key="ar_age")
 
     # --- Administracja (usuń) ---
     with tab_admin:
@@ -655,24 +2887,18 @@ def page_ar():
         if u.get("role") != "admin":
             st.error("Brak uprawnień do administracji.")
         else:
-            df_all = pd.read_sql_query(
-                "SELECT id, issue_date, due_date, company, number, amount, paid, paid_date FROM ar_invoices ORDER BY id DESC LIMIT 200",
-                cnx(),
+            df_all = keyset_page(
+                "ar_admin",
+                "id, issue_date, due_date, company, number, amount, paid, paid_date",
+                "ar_invoices",
             )
-            if df_all.empty:
-                st.info("Brak faktur do usunięcia.")
-            else:
-                opts = {
-                    f"#{row.id} | {row.company} | {row.number or '—'} | {row.amount:.2f} | wyst: {row.issue_date} | termin: {row.due_date} | {'opłacona' if row.paid else 'NIE'}"
-                    : int(row.id)
-                    for row in df_all.itertuples(index=False)
-                }
-                sel = st.selectbox("Wybierz fakturę do usunięcia", list(opts.keys()))
+            st.dataframe(zl_frame(df_all, ["amount"]), use_container_width=True)
+            del_id = record_picker("ar_all", "Wybierz fakturę do usunięcia", key="ar_del_sel")
+            if del_id is not None:
                 sure = st.checkbox("Tak, potwierdzam trwałe usunięcie")
                 if st.button("🗑️ Usuń fakturę") and sure:
                     try:
-                        with cnx() as conn:
-                            conn.execute("DELETE FROM ar_invoices WHERE id=?", (opts[sel],))
+                        write(lambda conn: conn.execute("DELETE FROM ar_invoices WHERE id=?", (del_id,)).rowcount)
                         st.success("Faktura usunięta.")
                         st.rerun()
                     except sqlite3.Error as e:
@@ -689,7 +2915,7 @@ def page_leasingi():
     tab_add, tab_list = st.tabs(["➕ Dodaj leasing", "📋 Lista / Usuwanie"])
 
     with tab_add:
-        with st.form("lease_add_form"):
+        with entry_form("lease_add_form"):
             name = st.text_input("Nazwa / Przedmiot")
             monthly = st.number_input("Rata miesięczna [PLN]", min_value=0.0, step=0.01)
             start = st.date_input("Start umowy", value=date.today())
@@ -701,30 +2927,28 @@ def page_leasingi():
                 st.error("Wymagane: Nazwa i rata miesięczna > 0.")
             else:
                 try:
-                    with cnx() as conn:
-                        conn.execute(
-                            """INSERT INTO leasings (name, monthly_amount, start_date, end_date, notes)
-                               VALUES (?,?,?,?,?)""",
-                            (name, monthly, start.isoformat(), end.isoformat(), notes),
-                        )
-                    st.success("Leasing dodany.")
+                    row = (name, to_grosze(monthly), start.isoformat(), end.isoformat(), notes)
+                    submit_form_write("lease_add_form", lambda conn: conn.execute(
+                        """INSERT INTO leasings (name, monthly_amount, start_date, end_date, notes)
+                           VALUES (?,?,?,?,?)""", row,
+                    ).lastrowid, "Leasing dodany.")
                 except sqlite3.Error as e:
                     st.error(f"Błąd SQL: {e}")
 
     with tab_list:
         try:
-            df = pd.read_sql_query(
-                "SELECT id, name, monthly_amount, start_date, end_date, notes FROM leasings ORDER BY id DESC",
-                cnx(),
-            )
-            st.dataframe(df, use_container_width=True)
+            lease_sql = ("SELECT id, name, monthly_amount / 100.0 AS monthly_amount, start_date, end_date, notes "
+                         "FROM leasings ORDER BY id DESC")
+            df = keyset_page("lease_list", "id, name, monthly_amount, start_date, end_date, notes", "leasings")
+            st.dataframe(zl_frame(df, ["monthly_amount"]), use_container_width=True)
+            export_box("lease", lease_sql, filename="leasingi")
         except Exception as e:
             st.warning(f"Nie udało się wczytać leasingów: {e}")
             df = pd.DataFrame()
 
         if not df.empty:
             options = {
-                f"#{row.id} | {row.name} | {row.monthly_amount:.2f} PLN/m-c | {row.start_date} → {row.end_date}":
+                f"#{row.id} | {row.name} | {fmt_zl(row.monthly_amount)}/m-c | {row.start_date} → {row.end_date}":
                 int(row.id)
                 for row in df.itertuples(index=False)
             }
@@ -732,8 +2956,8 @@ def page_leasingi():
             sure = st.checkbox("Tak, potwierdzam usunięcie leasingu")
             if st.button("🗑️ Usuń leasing") and sure:
                 try:
-                    with cnx() as conn:
-                        conn.execute("DELETE FROM leasings WHERE id=?", (options[sel],))
+                    lease_id = options[sel]
+                    write(lambda conn: conn.execute("DELETE FROM leasings WHERE id=?", (lease_id,)).rowcount)
                     st.success("Leasing usunięty.")
                     st.rerun()
                 except sqlite3.Error as e:
@@ -753,7 +2977,7 @@ def page_employees_admin():
 
     with tabs[0]:
         st.subheader("Dodaj pracownika")
-        with st.form("emp_add_form"):
+        with entry_form("emp_add_form"):
             name = st.text_input("Imię i nazwisko")
             role = st.selectbox("Rola", ["lekarz", "technik"])
             salary = st.number_input("Pensja miesięczna [PLN]", min_value=0.0, step=0.01)
@@ -763,12 +2987,10 @@ def page_employees_admin():
                 st.error("Podaj imię i nazwisko.")
             else:
                 try:
-                    with cnx() as conn:
-                        conn.execute(
-                            "INSERT INTO employees (name, role, monthly_salary, active) VALUES (?,?,?,1)",
-                            (name.strip(), role, salary),
-                        )
-                    st.success("Pracownik dodany.")
+                    row = (name.strip(), role, to_grosze(salary))
+                    submit_form_write("emp_add_form", lambda conn: conn.execute(
+                        "INSERT INTO employees (name, role, monthly_salary, active) VALUES (?,?,?,1)", row,
+                    ).lastrowid, "Pracownik dodany.")
                     st.rerun()
                 except sqlite3.IntegrityError:
                     st.error("Taki pracownik już istnieje (unikalna nazwa).")
@@ -777,7 +2999,7 @@ def page_employees_admin():
 
         st.subheader("Lista i edycja")
         df = get_employees_df()
-        st.dataframe(df, use_container_width=True)
+        st.dataframe(zl_frame(df, ["monthly_salary"]), use_container_width=True)
 
         with st.form("emp_edit_form"):
             emp_names = df["name"].tolist()
@@ -786,14 +3008,16 @@ def page_employees_admin():
                 new_role = st.selectbox("Rola", ["lekarz", "technik"])
                 new_sal = st.number_input("Pensja [PLN]", min_value=0.0, step=0.01, key="emp_sal")
                 active = st.checkbox("Aktywny", value=True)
+                valid_from = st.date_input("Pensja / zatrudnienie obowiązuje od", value=date.today(), key="emp_valid_from")
                 ok2 = st.form_submit_button("💾 Zapisz zmiany")
                 if ok2:
                     try:
-                        with cnx() as conn:
-                            conn.execute(
-                                "UPDATE employees SET role=?, monthly_salary=?, active=? WHERE name=?",
-                                (new_role, new_sal, int(active), who),
-                            )
+                        emp_id = int(df.loc[df["name"] == who, "id"].iloc[0])
+                        def save_employee(conn):
+                            conn.execute("UPDATE employees SET role=? WHERE id=?", (new_role, emp_id))
+                            set_employee_terms(conn, emp_id, to_grosze(new_sal), active, valid_from)
+
+                        write(save_employee)
                         st.success("Zaktualizowano dane.")
                         st.rerun()
                     except sqlite3.Error as e:
@@ -801,14 +3025,21 @@ def page_employees_admin():
             else:
                 st.info("Brak pracowników w bazie.")
 
+        with st.expander("📜 Historia wynagrodzeń"):
+            hist = read_df(
+                """SELECT e.name, h.monthly_salary, h.valid_from, h.valid_to
+                   FROM salary_history h LEFT JOIN employees e ON e.id = h.employee_id
+                   ORDER BY e.name, h.valid_from"""
+            )
+            st.dataframe(zl_frame(hist, ["monthly_salary"]), use_container_width=True, hide_index=True)
+
         st.subheader("🗑️ Usuń pracownika")
         if not df.empty:
             who_del = st.selectbox("Kto do usunięcia?", df["name"].tolist(), key="emp_del")
             sure = st.checkbox("Tak, rozumiem skutki (usunięcie z listy personelu).")
             if st.button("Usuń pracownika") and sure:
                 try:
-                    with cnx() as conn:
-                        conn.execute("DELETE FROM employees WHERE name=?", (who_del,))
+                    write(lambda conn: conn.execute("DELETE FROM employees WHERE name=?", (who_del,)).rowcount)
                     st.success("Usunięto pracownika.")
                     st.rerun()
                 except sqlite3.Error as e:
@@ -816,54 +3047,31 @@ def page_employees_admin():
 
     with tabs[1]:
         st.subheader("Podsumowanie miesięczne (utarg przypisany do zmian)")
-        year = st.number_input("Rok", value=date.today().year, step=1, format="%d")
-        month = st.number_input("Miesiąc", min_value=1, max_value=12, value=date.today().month, step=1)
-        ym = f"{int(year)}-{int(month):02}"
+        c1, c2, c3 = st.columns(3)
+        year = c1.number_input("Rok", value=date.today().year, step=1, format="%d")
+        month = c2.number_input("Miesiąc", min_value=1, max_value=12, value=date.today().month, step=1)
+        month_to = c3.number_input("Do miesiąca", min_value=1, max_value=12, value=int(month), step=1)
+        compare = st.checkbox("Porównaj z tym samym okresem rok wcześniej", key="emp_yoy")
+        ym_from = f"{int(year)}-{int(month):02}"
+        ym_to = f"{int(year)}-{max(int(month), int(month_to)):02}"
 
         try:
-            stats = pd.read_sql_query(
-                """
-                WITH vet_shifts AS (
-                    SELECT staff_vet AS staff, (kasa+terminal) AS rev
-                    FROM daily_reports
-                    WHERE strftime('%Y-%m', report_date)=?
-                ),
-                tech_shifts AS (
-                    SELECT t.tech_name AS staff, (r.kasa+r.terminal) AS rev
-                    FROM daily_reports r
-                    JOIN daily_report_techs t ON t.daily_report_id = r.id
-                    WHERE strftime('%Y-%m', r.report_date)=?
-                )
-                SELECT staff AS name,
-                       COUNT(*) AS shifts_count,
-                       SUM(rev) AS revenue_on_shifts
-                FROM (
-                    SELECT * FROM vet_shifts
-                    UNION ALL
-                    SELECT * FROM tech_shifts
-                )
-                WHERE staff IS NOT NULL AND staff <> ''
-                GROUP BY staff
-                ORDER BY revenue_on_shifts DESC
-                """,
-                cnx(),
-                params=(ym, ym),
-            )
+            stats = employee_shift_stats(ym_from, ym_to, compare_years=1 if compare else 0)
         except Exception as e:
             st.error(f"Nie udało się policzyć statystyk: {e}")
-            stats = pd.DataFrame(columns=["name", "shifts_count", "revenue_on_shifts"])
+            stats = pd.DataFrame(columns=["employee_id", "name", "role", "monthly_salary", "active",
+                                          "shifts_count", "revenue_on_shifts"])
 
-        emp = get_employees_df()[["name", "role", "monthly_salary", "active"]]
-        emp = emp[emp["active"] == 1].drop(columns=["active"])
-        merged = emp.merge(stats, on="name", how="left").fillna({"shifts_count": 0, "revenue_on_shifts": 0})
-        merged = merged.sort_values("revenue_on_shifts", ascending=False)
+        merged = stats[stats["active"] == 1].drop(columns=["employee_id", "active"])
+        money = ["monthly_salary", "revenue_on_shifts", "revenue_on_shifts_prev"]
 
-        st.dataframe(merged, use_container_width=True)
+        st.dataframe(zl_frame(merged, money), use_container_width=True)
         if not merged.empty:
-            st.metric("Najwyższy utarg (miesiąc)",
-                      f"{merged.iloc[0]['revenue_on_shifts']:,.2f} zł",
+            st.metric("Najwyższy utarg (okres)",
+                      fmt_zl(merged.iloc[0]["revenue_on_shifts"]),
                       help=merged.iloc[0]["name"])
-            st.bar_chart(merged.set_index("name")[["revenue_on_shifts"]])
+            cols = ["revenue_on_shifts", "revenue_on_shifts_prev"] if compare else ["revenue_on_shifts"]
+            st.bar_chart(zl_frame(merged.set_index("name")[cols]))
 
 # ------------------ UI: SKLEP ---------------------
 def page_shop():
@@ -871,31 +3079,33 @@ def page_shop():
     tab_utarg, tab_zakup = st.tabs(["Utarg dzienny", "Faktury zakupowe"])
 
     with tab_utarg:
-        with st.form("shop_sales_form"):
+        with entry_form("shop_sales_form"):
             sdt = st.date_input("Data utargu", value=date.today())
             sk  = st.number_input("Kasa (PLN)", min_value=0.0, step=0.01, key="ssk")
             stt = st.number_input("Terminal (PLN)", min_value=0.0, step=0.01, key="sst")
             ok = st.form_submit_button("💾 Zapisz utarg")
         if ok:
             try:
-                with cnx() as conn:
-                    conn.execute("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES (?,?,?)",
-                                 (sdt.isoformat(), sk, stt))
-                st.success("Utarg zapisany")
+                row = (sdt.isoformat(), to_grosze(sk), to_grosze(stt))
+                submit_form_write("shop_sales_form", lambda conn: conn.execute(
+                    "INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES (?,?,?)", row
+                ).lastrowid, "Utarg zapisany")
             except sqlite3.Error as e:
                 st.error(f"Błąd SQL: {e}")
 
         try:
-            df_sales = pd.read_sql_query(
-                "SELECT id, sale_date, kasa, terminal, (kasa+terminal) AS razem FROM shop_sales ORDER BY sale_date DESC, id DESC LIMIT 10",
-                cnx(),
-            )
-            st.dataframe(df_sales, use_container_width=True)
+            df_sales = keyset_page("shop_sales_list", "id, sale_date, kasa, terminal, (kasa+terminal) AS razem",
+                                   "shop_sales", sort="sale_date")
+            st.dataframe(zl_frame(df_sales, ["kasa", "terminal", "razem"]), use_container_width=True)
+            export_box("shop_sales",
+                       "SELECT id, sale_date, kasa / 100.0 AS kasa, terminal / 100.0 AS terminal, (kasa+terminal) / 100.0 AS razem "
+                       "FROM shop_sales ORDER BY sale_date, id",
+                       filename="sklep_utargi")
         except Exception as e:
             st.warning(f"Nie udało się pobrać utargów: {e}")
 
     with tab_zakup:
-        with st.form("shop_exp_form"):
+        with entry_form("shop_exp_form"):
             zdt = st.date_input("Data faktury", value=date.today(), key="zdt")
             zam = st.number_input("Kwota", min_value=0.0, step=0.01, key="zam")
             znr = st.text_input("Nr faktury", key="znr")
@@ -904,21 +3114,21 @@ def page_shop():
             ok2 = st.form_submit_button("💾 Dodaj fakturę zakupu")
         if ok2:
             try:
-                with cnx() as conn:
-                    conn.execute(
-                        "INSERT INTO shop_expenses (expense_date, amount, invoice_number, supplier, paid) VALUES (?,?,?,?,?)",
-                        (zdt.isoformat(), zam, znr, zsup, int(zpa)),
-                    )
-                st.success("Faktura dodana")
+                row = (zdt.isoformat(), to_grosze(zam), znr, zsup, int(zpa))
+                submit_form_write("shop_exp_form", lambda conn: conn.execute(
+                    "INSERT INTO shop_expenses (expense_date, amount, invoice_number, supplier, paid) VALUES (?,?,?,?,?)", row,
+                ).lastrowid, "Faktura dodana")
             except sqlite3.Error as e:
                 st.error(f"Błąd SQL: {e}")
 
         try:
-            df_ex = pd.read_sql_query(
-                "SELECT id, expense_date, supplier, invoice_number, amount, paid FROM shop_expenses ORDER BY expense_date DESC, id DESC LIMIT 10",
-                cnx(),
-            )
-            st.dataframe(df_ex, use_container_width=True)
+            df_ex = keyset_page("shop_exp_list", "id, expense_date, supplier, invoice_number, amount, paid",
+                                "shop_expenses", sort="expense_date")
+            st.dataframe(zl_frame(df_ex, ["amount"]), use_container_width=True)
+            export_box("shop_exp",
+                       "SELECT id, expense_date, supplier, invoice_number, amount / 100.0 AS amount, paid "
+                       "FROM shop_expenses ORDER BY expense_date, id",
+                       filename="sklep_faktury")
         except Exception as e:
             st.warning(f"Nie udało się pobrać faktur sklepu: {e}")
 
@@ -930,273 +3140,410 @@ def page_farm():
 
     # Wpisy: magazyn
     with tab_mag:
-        with st.form("farm_mag_form"):
+        with entry_form("farm_mag_form"):
             d = st.date_input("Data (magazyn)", value=date.today())
             kw = st.number_input("Kwota (PLN) – magazyn", min_value=0.0, step=0.01)
             uw = st.text_input("Uwagi (opcjonalnie)")
             ok = st.form_submit_button("💾 Dodaj wpis (magazyn)")
         if ok:
-            with cnx() as conn:
-                conn.execute("INSERT INTO farm_reports (report_date, typ, kwota, uwagi) VALUES (?,?,?,?)",
-                             (d.isoformat(), "magazyn", kw, uw))
-            st.success("Dodano wpis magazynowy.")
-        dfm = pd.read_sql_query(
-            "SELECT id, report_date, kwota, uwagi FROM farm_reports WHERE typ='magazyn' ORDER BY report_date DESC, id DESC LIMIT 20",
-            cnx()
-        )
-        st.dataframe(dfm, use_container_width=True)
+            try:
+                row = (d.isoformat(), "magazyn", to_grosze(kw), uw)
+                submit_form_write("farm_mag_form", lambda conn: conn.execute(
+                    "INSERT INTO farm_reports (report_date, typ, kwota, uwagi) VALUES (?,?,?,?)", row,
+                ).lastrowid, "Dodano wpis magazynowy.")
+            except sqlite3.Error as e:
+                st.error(f"Błąd zapisu: {e}")
+        dfm = keyset_page("farm_magazyn_list", "id, report_date, kwota, uwagi", "farm_reports",
+                            where=["typ=?"], params=["magazyn"], sort="report_date")
+        st.dataframe(zl_frame(dfm, ["kwota"]), use_container_width=True)
+        export_box("farm_magazyn",
+                   "SELECT id, report_date, kwota / 100.0 AS kwota, uwagi FROM farm_reports WHERE typ='magazyn' ORDER BY report_date, id",
+                   filename="zwierzeta_magazyn")
 
     # Wpisy: teren
     with tab_ter:
-        with st.form("farm_ter_form"):
+        with entry_form("farm_ter_form"):
             d = st.date_input("Data (teren)", value=date.today(), key="farm_d2")
             kw = st.number_input("Kwota (PLN) – teren", min_value=0.0, step=0.01, key="farm_kw2")
             uw = st.text_input("Uwagi (opcjonalnie)", key="farm_uw2")
             ok = st.form_submit_button("💾 Dodaj wpis (teren)")
         if ok:
-            with cnx() as conn:
-                conn.execute("INSERT INTO farm_reports (report_date, typ, kwota, uwagi) VALUES (?,?,?,?)",
-                             (d.isoformat(), "teren", kw, uw))
-            st.success("Dodano wpis terenowy.")
-        dft = pd.read_sql_query(
-            "SELECT id, report_date, kwota, uwagi FROM farm_reports WHERE typ='teren' ORDER BY report_date DESC, id DESC LIMIT 20",
-            cnx()
-        )
-        st.dataframe(dft, use_container_width=True)
+            try:
+                row = (d.isoformat(), "teren", to_grosze(kw), uw)
+                submit_form_write("farm_ter_form", lambda conn: conn.execute(
+                    "INSERT INTO farm_reports (report_date, typ, kwota, uwagi) VALUES (?,?,?,?)", row,
+                ).lastrowid, "Dodano wpis terenowy.")
+            except sqlite3.Error as e:
+                st.error(f"Błąd zapisu: {e}")
+        dft = keyset_page("farm_teren_list", "id, report_date, kwota, uwagi", "farm_reports",
+                            where=["typ=?"], params=["teren"], sort="report_date")
+        st.dataframe(zl_frame(dft, ["kwota"]), use_container_width=True)
+        export_box("farm_teren",
+                   "SELECT id, report_date, kwota / 100.0 AS kwota, uwagi FROM farm_reports WHERE typ='teren' ORDER BY report_date, id",
+                   filename="zwierzeta_teren")
 
     # Podsumowanie (miesiąc)
     with tab_pod:
         y = st.number_input("Rok", value=date.today().year, step=1, format="%d", key="farm_y")
         m = st.number_input("Miesiąc", min_value=1, max_value=12, value=date.today().month, step=1, key="farm_m")
-        first, last = ym_bounds(int(y), int(m))
-        df_sum = pd.read_sql_query(
-            """
-            SELECT typ, SUM(kwota) AS suma
-            FROM farm_reports
-            WHERE date(report_date) BETWEEN ? AND ?
-            GROUP BY typ
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
-        st.dataframe(df_sum, use_container_width=True)
-        total = float(df_sum["suma"].sum() if not df_sum.empty else 0.0)
-        st.metric("Suma (miesiąc, magazyn+teren)", f"{total:,.2f} zł")
-
-# ------------------ UI: PODSUMOWANIE --------------
-def page_summary_admin():
-    st.header("📊 Podsumowanie (admin)")
+        df_sum = farm_month_summary(int(y), int(m))
+        st.dataframe(zl_frame(df_sum, ["suma"]), use_container_width=True)
+        total = df_sum["suma"].sum() if not df_sum.empty else 0
+        st.metric("Suma (miesiąc, magazyn+teren)", fmt_zl(total))
+
+# ------------------ UI: IMPORT (ADMIN) -----------
+def page_import_admin():
+    st.header("📥 Import danych (CSV / XLSX)")
+    tables = list(IMPORT_TARGETS)
+    table = st.selectbox("Dokąd importować", tables, format_func=lambda t: IMPORT_TARGETS[t][0], key="imp_table")
+    label, types, required, key_cols = IMPORT_TARGETS[table]
+    if openpyxl is None:
+        st.caption("Import XLSX wymaga pakietu openpyxl – dostępny jest tylko CSV.")
+    up = st.file_uploader("Plik", type=import_types(), key="imp_file")
+    if up is None:
+        st.caption(f"Kolumny: {', '.join(types)} · wymagane: {', '.join(required)} · "
+                   f"duplikaty po: {', '.join(key_cols)}{' (w obrębie pliku)' if table in IMPORT_FILE_KEYS_ONLY else ''}")
+        return
 
-    tabs = st.tabs(["📅 Miesiąc", "📈 Trend 12 mies.", "⏰ Do zapłaty (najbliższe)", "🛒 Sklep", "🐄 Zwierzęta"])
+    try:
+        head = next(read_import_chunks(up, up.name, chunk_rows=20), pd.DataFrame())
+    except Exception as e:
+        st.error(f"Nie udało się odczytać pliku: {e}")
+        return
+    st.caption("Podgląd pierwszych wierszy:")
+    st.dataframe(head, use_container_width=True, hide_index=True)
+
+    st.markdown("**Mapowanie kolumn**")
+    guessed = guess_mapping(table, head.columns)
+    options = ["—"] + list(head.columns)
+    mapping = {}
+    grid = st.columns(3)
+    for i, col in enumerate(types):
+        default = options.index(guessed[col]) if col in guessed else 0
+        chosen = grid[i % 3].selectbox(f"{col}{' *' if col in required else ''}", options,
+                                       index=default, key=f"imp_map_{table}_{col}")
+        if chosen != "—":
+            mapping[col] = chosen
+    missing = [c for c in required if c not in mapping]
+    dry_run = st.checkbox("Tylko sprawdź (bez zapisu)", key="imp_dry")
+    if missing:
+        st.warning(f"Przypisz kolumny wymagane: {', '.join(missing)}")
+        return
 
-    # Miesiąc
-    with tabs[0]:
-        y = st.number_input("Rok", value=date.today().year, step=1, format="%d")
-        m = st.number_input("Miesiąc", min_value=1, max_value=12, value=date.today().month)
-        first, last = ym_bounds(int(y), int(m))
+    if st.button("Sprawdź plik" if dry_run else "Importuj", type="primary", key="imp_run"):
+        bar = st.empty()
+        done = {}  # statystyki po ostatniej zapisanej paczce – na wypadek przerwania importu
 
-        # Przychody dzienne (Recepcja)
-        df_rev_day = pd.read_sql_query(
-            """
-            SELECT date(report_date) AS d, SUM(kasa+terminal) AS revenue
-            FROM daily_reports
-            WHERE date(report_date) BETWEEN ? AND ?
-            GROUP BY date(report_date)
-            ORDER BY d
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
+        def show_progress(s):
+            done.update(s)
+            bar.caption(f"Wczytano {s['wczytane']} wierszy, dodano {s['dodane']}...")
 
-        # AP (koszty) – zapłacone dziennie
-        df_ap_day = pd.read_sql_query(
-            """
-            SELECT date(paid_date) AS d, SUM(amount) AS ap_paid
-            FROM ap_invoices
-            WHERE paid=1 AND date(paid_date) BETWEEN ? AND ?
-            GROUP BY date(paid_date)
-            ORDER BY d
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
+        try:
+            with st.spinner("Import..."):
+                stats, report = import_file(up, up.name, table, mapping, dry_run=dry_run, progress=show_progress)
+            st.session_state["imp_result"] = (table, up.name, dry_run, stats, report)
+        except Exception as e:
+            st.session_state.pop("imp_result", None)
+            if dry_run:
+                st.error(f"Sprawdzanie pliku przerwane: {e}")
+            else:
+                st.error(f"Import przerwany: {e}. Przed błędem zapisano {done.get('dodane', 0)} wierszy "
+                         f"(z {done.get('wczytane', 0)} wczytanych) – pozostają w bazie.")
+
+    result = st.session_state.get("imp_result")
+    if result and result[:2] == (table, up.name):
+        _, _, was_dry, stats, report = result
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("Wczytane", stats["wczytane"])
+        c2.metric("Do dodania" if was_dry else "Dodane", stats["dodane"])
+        c3.metric("Duplikaty", stats["duplikaty"])
+        c4.metric("Odrzucone", stats["odrzucone"])
+        c5.metric("Czas [s]", stats["czas_s"])
+        if not report.empty:
+            st.markdown("**Raport odrzuconych wierszy**")
+            if len(report) >= IMPORT_MAX_REJECTS:
+                st.caption(f"Raport obejmuje pierwsze {IMPORT_MAX_REJECTS} odrzuconych wierszy.")
+            st.dataframe(report.head(500), use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Pobierz raport (CSV)", report.to_csv(index=False).encode("utf-8"),
+                               f"odrzucone_{table}.csv", "text/csv", key="imp_report_dl")
+
+# ------------------ UI: UZGADNIANIE (ADMIN) ------
+def page_reconciliation_admin():
+    st.header("🏦 Uzgodnienie wyciągu z fakturami AR/AP")
+    open_tx = read_df("SELECT COUNT(*) AS n, MIN(tx_date) AS od FROM bank_transactions WHERE matched_id IS NULL")
+    st.caption(f"Nieuzgodnione transakcje: {int(open_tx['n'].iloc[0])}"
+               + (f" (najstarsza z {open_tx['od'].iloc[0]})" if open_tx["od"].iloc[0] else "")
+               + " · wyciągi wczytasz na stronie „Import danych”.")
+    c1, c2, c3 = st.columns(3)
+    d_from = c1.date_input("Transakcje od", value=date.today().replace(day=1) - timedelta(days=31), key="rec_from")
+    d_to = c2.date_input("Transakcje do", value=date.today(), key="rec_to")
+    window = c3.number_input("Dni po terminie płatności", min_value=0, max_value=365,
+                             value=RECON_WINDOW_DAYS, step=5, key="rec_window")
+
+    if st.button("🔍 Znajdź dopasowania", key="rec_find"):
+        with st.spinner("Dopasowywanie..."):
+            st.session_state["rec_matches"] = reconcile(d_from, d_to, int(window))
+    matches = st.session_state.get("rec_matches")
+    if matches is None:
+        return
+    if matches.empty:
+        st.info("Brak dopasowań w wybranym okresie.")
+        return
 
-        # AR (przychody) – opłacone dziennie
-        df_ar_day = pd.read_sql_query(
-            """
-            SELECT date(paid_date) AS d, SUM(amount) AS ar_paid
-            FROM ar_invoices
-            WHERE paid=1 AND date(paid_date) BETWEEN ? AND ?
-            GROUP BY date(paid_date)
-            ORDER BY d
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
+    counts = matches["pewność"].value_counts()
+    st.caption(" · ".join(f"{lvl}: {int(counts.get(lvl, 0))}" for lvl in RECON_LEVELS.values()))
+    edited = st.data_editor(
+        zl_frame(matches, ["kwota_bank", "kwota_faktury"]), use_container_width=True, hide_index=True, key="rec_editor",
+        disabled=[c for c in matches.columns if c != "zatwierdź"],
+        column_config={"zatwierdź": st.column_config.CheckboxColumn("Zatwierdź")},
+    )
+    chosen = edited[edited["zatwierdź"]]
+    if st.button(f"✅ Oznacz jako opłacone ({len(chosen)})", type="primary", disabled=chosen.empty, key="rec_apply"):
+        try:
+            done = apply_reconciliation(chosen)
+            st.session_state.pop("rec_matches", None)
+            st.success(f"Opłacone: AR {done.get('ar_invoices', 0)}, AP {done.get('ap_invoices', 0)}.")
+        except sqlite3.Error as e:
+            st.error(f"Błąd zapisu: {e}")
 
-        chart = pd.DataFrame({"d": pd.date_range(first, last)})
-        chart["d"] = chart["d"].dt.date
-        chart = (chart
-                 .merge(df_rev_day, on="d", how="left")
-                 .merge(df_ap_day, on="d", how="left")
-                 .merge(df_ar_day, on="d", how="left")
-                 .fillna(0.0)
-                 .set_index("d"))
+# ------------------ UI: PODSUMOWANIE --------------
+# Widoki liczone leniwie: renderujemy (i odpytujemy bazę) tylko wybrany widok,
+# a jego niezależne zapytania idą równolegle przez load_parallel().
+def _summary_month():
+    y = st.number_input("Rok", value=date.today().year, step=1, format="%d")
+    m = st.number_input("Miesiąc", min_value=1, max_value=12, value=date.today().month)
+    first, last = ym_bounds(int(y), int(m))
+
+    data = load_parallel({
+        # Przychody gabinetu, AR opłacone i AP zapłacone – dziennie z rollup_daily
+        "chart": lambda: rollup_by_day(first, last, list(vd.PNL_SOURCES)),
+        "pnl": lambda: monthly_pnl([f"{int(y)}-{int(m):02}"]),
+    })
+    chart = data["chart"].rename(columns={"clinic": "revenue"})
+    with span("miesiąc: wykres"):
         st.subheader("Przychody gabinet + AR (opłacone) vs. AP (koszty, zapłacone)")
-        st.line_chart(chart[["revenue", "ar_paid", "ap_paid"]])
-
-        # KPI
-        sum_revenue_gp = float(chart["revenue"].sum())
-        sum_ap_paid    = float(chart["ap_paid"].sum())
-        sum_ar_paid    = float(chart["ar_paid"].sum())
-        sum_leasing    = sum_leasing_for_month(int(y), int(m))
-        sum_salaries   = sum_salaries_active()
-        net = (sum_revenue_gp + sum_ar_paid) - (sum_ap_paid + sum_leasing + sum_salaries)
-
-        c1, c2, c3, c4, c5, c6 = st.columns(6)
-        c1.metric("Przychody (gabinet)", f"{sum_revenue_gp:,.2f} zł")
-        c2.metric("Przychody z faktur (AR opłacone)", f"{sum_ar_paid:,.2f} zł")
-        c3.metric("AP zapłacone (koszty)", f"{sum_ap_paid:,.2f} zł")
-        c4.metric("Leasingi (mies.)", f"{sum_leasing:,.2f} zł")
-        c5.metric("Wynagrodzenia (mies.)", f"{sum_salaries:,.2f} zł")
-        c6.metric("Wynik netto", f"{net:,.2f} zł")
-
-    # TREND 12 MIES.
-    with tabs[1]:
-        today = date.today()
-        months = []
-        y2, m2 = today.year, today.month
-        for _ in range(12):
-            months.append(f"{y2}-{m2:02}")
-            m2 -= 1
-            if m2 == 0:
-                m2 = 12
-                y2 -= 1
-        months = months[::-1]
-
-        df_r = pd.read_sql_query(
-            "SELECT strftime('%Y-%m', report_date) AS ym, SUM(kasa+terminal) AS revenue FROM daily_reports GROUP BY ym",
-            cnx(),
-        )
-        rev_map = dict(zip(df_r["ym"], df_r["revenue"]))
-
-        df_ap = pd.read_sql_query(
-            "SELECT strftime('%Y-%m', paid_date) AS ym, SUM(amount) AS ap_paid FROM ap_invoices WHERE paid=1 GROUP BY ym",
-            cnx(),
-        )
-        ap_map = dict(zip(df_ap["ym"], df_ap["ap_paid"]))
-
-        df_ar = pd.read_sql_query(
-            "SELECT strftime('%Y-%m', paid_date) AS ym, SUM(amount) AS ar_paid FROM ar_invoices WHERE paid=1 GROUP BY ym",
-            cnx(),
-        )
-        ar_map = dict(zip(df_ar["ym"], df_ar["ar_paid"]))
-
-        salaries_monthly = sum_salaries_active()
-        lease_list = []
-        for ym in months:
-            yy, mm = map(int, ym.split("-"))
-            lease_list.append(sum_leasing_for_month(yy, mm))
-
-        df12 = pd.DataFrame({
-            "ym": months,
-            "Przychody_gabinet": [float(rev_map.get(ym, 0.0) or 0.0) for ym in months],
-            "AR_oplacone":       [float(ar_map.get(ym, 0.0) or 0.0) for ym in months],
-            "AP_zaplacone":      [float(ap_map.get(ym, 0.0) or 0.0) for ym in months],
-            "Leasingi":          lease_list,
-            "Wynagrodzenia":     [salaries_monthly]*len(months),
-        }).set_index("ym")
-        df12["Przychody_razem"] = df12["Przychody_gabinet"] + df12["AR_oplacone"]
-        df12["Koszty_razem"]    = df12[["AP_zaplacone", "Leasingi", "Wynagrodzenia"]].sum(axis=1)
-        df12["Wynik_netto"]     = df12["Przychody_razem"] - df12["Koszty_razem"]
-
+        st.line_chart(zl_frame(chart[["revenue", "ar_paid", "ap_paid"]]))
+
+    # KPI
+    pnl = data["pnl"].iloc[0]
+    c1, c2, c3, c4, c5, c6 = st.columns(6)
+    c1.metric("Przychody (gabinet)", fmt_zl(pnl["Przychody_gabinet"]))
+    c2.metric("Przychody z faktur (AR opłacone)", fmt_zl(pnl["AR_oplacone"]))
+    c3.metric("AP zapłacone (koszty)", fmt_zl(pnl["AP_zaplacone"]))
+    c4.metric("Leasingi (mies.)", fmt_zl(pnl["Leasingi"]))
+    c5.metric("Wynagrodzenia (mies.)", fmt_zl(pnl["Wynagrodzenia"]))
+    c6.metric("Wynik netto", fmt_zl(pnl["Wynik_netto"]))
+
+def _summary_trend():
+    today = date.today()
+    months = []
+    y2, m2 = today.year, today.month
+    for _ in range(12):
+        months.append(f"{y2}-{m2:02}")
+        m2 -= 1
+        if m2 == 0:
+            m2 = 12
+            y2 -= 1
+    months = months[::-1]
+
+    df12 = zl_frame(monthly_pnl(months))
+
+    with span("trend: wykresy"):
         st.subheader("Przychody (gabinet+AR) vs koszty (12 mies.)")
         st.line_chart(df12[["Przychody_razem", "Koszty_razem"]])
         st.subheader("Wynik netto (12 mies.)")
         st.bar_chart(df12[["Wynik_netto"]])
         st.dataframe(df12, use_container_width=True)
 
+def _summary_due():
     # Do zapłaty (najbliższe) – AP
-    with tabs[2]:
-        days = st.slider("Pokaż zobowiązania AP na najbliższe (dni)", min_value=7, max_value=60, value=14, step=1)
-        today_str = date.today().isoformat()
-        future_str = (pd.Timestamp.today() + pd.Timedelta(days=days)).date().isoformat()
-        df_due = pd.read_sql_query(
-            """
-            SELECT id, supplier, number, amount, due_date
-            FROM ap_invoices
-            WHERE paid=0 AND date(due_date) BETWEEN ? AND ?
-            ORDER BY due_date ASC
-            """,
-            cnx(),
-            params=(today_str, future_str),
-        )
-        if df_due.empty:
-            st.success("Brak zobowiązań AP w wybranym horyzoncie.")
-        else:
-            st.dataframe(df_due, use_container_width=True)
-
-    # Sklep – skrót
-    with tabs[3]:
-        y = st.number_input("Rok (sklep)", value=date.today().year, step=1, format="%d", key="shop_y")
-        m = st.number_input("Miesiąc (sklep)", min_value=1, max_value=12, value=date.today().month, key="shop_m")
-        first, last = ym_bounds(int(y), int(m))
+    days = st.slider("Pokaż zobowiązania AP na najbliższe (dni)", min_value=7, max_value=60, value=14, step=1)
+    df_due = service_call(vd.due_list, date.today(), date.today() + timedelta(days=days))
+    if df_due.empty:
+        st.success("Brak zobowiązań AP w wybranym horyzoncie.")
+    else:
+        st.dataframe(zl_frame(df_due, ["amount"]), use_container_width=True)
+
+def _summary_shop():
+    y = st.number_input("Rok (sklep)", value=date.today().year, step=1, format="%d", key="shop_y")
+    m = st.number_input("Miesiąc (sklep)", min_value=1, max_value=12, value=date.today().month, key="shop_m")
+    first, last = ym_bounds(int(y), int(m))
+
+    chart = rollup_by_day(first, last, ["shop_sales", "shop_paid"]).rename(columns={"shop_sales": "sales"})
+    sum_shop_sales = chart["sales"].sum()
+    sum_shop_paid = chart["shop_paid"].sum()
+    st.subheader("Sklep: utargi i zapłacone wydatki (dziennie)")
+    st.line_chart(zl_frame(chart[["sales", "shop_paid"]]))
+
+    c1, c2 = st.columns(2)
+    c1.metric("Suma utargów (sklep)", fmt_zl(sum_shop_sales))
+    c2.metric("Suma zapłaconych wydatków (sklep)", fmt_zl(sum_shop_paid))
+
+def _summary_farm():
+    y = st.number_input("Rok (zwierzęta)", value=date.today().year, step=1, format="%d", key="farm_y2")
+    m = st.number_input("Miesiąc (zwierzęta)", min_value=1, max_value=12, value=date.today().month, step=1, key="farm_m2")
+    df_sum = farm_month_summary(int(y), int(m))
+    st.dataframe(zl_frame(df_sum, ["suma"]), use_container_width=True)
+    total = df_sum["suma"].sum() if not df_sum.empty else 0
+    st.metric("Suma (miesiąc, magazyn+teren)", fmt_zl(total))
+
+def _summary_cashflow():
+    c1, c2, c3 = st.columns(3)
+    months = c1.selectbox("Horyzont (miesiące)", [12, 18, 24], key="cf_months")
+    opening = c2.number_input("Saldo początkowe [PLN]", value=0.0, step=1000.0, key="cf_opening")
+    start = c3.date_input("Od dnia", value=date.today(), key="cf_start")
+    c4, c5, c6, c7 = st.columns(4)
+    revenue_pct = c4.slider("Utarg gabinetu [% bazy]", 50, 150, 100, step=5, key="cf_rev")
+    cost_pct = c5.slider("Koszty AP i płace [%]", 50, 150, 100, step=5, key="cf_cost")
+    delay = c6.slider("Opóźnienie wpłat AR [dni]", 0, 90, 0, step=5, key="cf_delay")
+    overdue = c7.checkbox("Zaległe AR wpłyną", value=True, key="cf_overdue")
+
+    df = forecast_cashflow(start, int(months), to_grosze(opening), revenue_pct / 100, cost_pct / 100,
+                           int(delay), overdue)
+    low_day = df["saldo"].idxmin()
+    negative = df.index[df["saldo"] < 0]
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Saldo na koniec", fmt_zl(df["saldo"].iloc[-1]))
+    m2.metric("Najniższe saldo", fmt_zl(df["saldo"].min()), help=f"dnia {low_day.date().isoformat()}")
+    m3.metric("Pierwszy dzień pod kreską", negative[0].date().isoformat() if len(negative) else "—")
+
+    st.subheader("Saldo narastające (dziennie)")
+    st.line_chart(zl_frame(df[["saldo"]]))
+    monthly = df.drop(columns=["saldo"]).resample("MS").sum()
+    monthly["saldo_koniec"] = df["saldo"].resample("MS").last()
+    monthly.index = monthly.index.strftime("%Y-%m")
+    monthly = zl_frame(monthly)
+    st.subheader("Miesięcznie")
+    st.bar_chart(monthly[["wpływy_AR", "utarg_prognoza", "wydatki_AP", "leasingi", "wynagrodzenia"]])
+    st.dataframe(monthly, use_container_width=True)
+
+def _summary_clinics():
+    # wszystkie filie naraz: P&L każdej z jej pliku bazy, sumy grupy składane z wyników filii
+    today = date.today()
+    months = [str(p) for p in pd.period_range(end=pd.Period(today, "M"), periods=12, freq="M")]
+    pnl = consolidated_pnl(months)
+    by_clinic = pnl.groupby(level="filia", sort=False).sum()
+    group = pnl.groupby(level="ym").sum()
+
+    with span("filie: tabele"):
+        st.subheader(f"Filie – 12 mies. ({months[0]} – {months[-1]})")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Przychody grupy", fmt_zl(group["Przychody_razem"].sum()))
+        c2.metric("Koszty grupy", fmt_zl(group["Koszty_razem"].sum()))
+        c3.metric("Wynik netto grupy", fmt_zl(group["Wynik_netto"].sum()))
+        st.dataframe(zl_frame(pd.concat([by_clinic, by_clinic.sum().to_frame("Razem").T])),
+                     use_container_width=True)
+        st.subheader("Wynik netto per filia i miesiąc")
+        st.bar_chart(zl_frame(pnl["Wynik_netto"].unstack("filia")))
+        st.subheader("Grupa – miesięcznie")
+        st.dataframe(zl_frame(group), use_container_width=True)
+
+SUMMARY_VIEWS = {
+    "📅 Miesiąc": _summary_month,
+    "📈 Trend 12 mies.": _summary_trend,
+    "⏰ Do zapłaty (najbliższe)": _summary_due,
+    "💰 Prognoza przepływów": _summary_cashflow,
+    "🛒 Sklep": _summary_shop,
+    "🐄 Zwierzęta": _summary_farm,
+    "🏥 Filie (zbiorczo)": _summary_clinics,
+}
 
-        df_shop_rev = pd.read_sql_query(
-            """
-            SELECT date(sale_date) AS d, SUM(kasa+terminal) AS sales
-            FROM shop_sales
-            WHERE date(sale_date) BETWEEN ? AND ?
-            GROUP BY date(sale_date)
-            ORDER BY d
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
-        sum_shop_sales = float(df_shop_rev["sales"].sum()) if not df_shop_rev.empty else 0.0
+def page_summary_admin():
+    st.header("📊 Podsumowanie (admin)")
 
-        df_shop_paid = pd.read_sql_query(
-            """
-            SELECT date(expense_date) AS d, SUM(amount) AS shop_paid
-            FROM shop_expenses
-            WHERE paid=1 AND date(expense_date) BETWEEN ? AND ?
-            GROUP BY date(expense_date)
-            ORDER BY d
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
-        sum_shop_paid = float(df_shop_paid["shop_paid"].sum()) if not df_shop_paid.empty else 0.0
+    view = st.radio("Widok", list(SUMMARY_VIEWS.keys()), horizontal=True, key="summary_view",
+                    label_visibility="collapsed")
+    if analytic_mode().get():
+        snap = vs.open_snapshot(snapshot_dir(clinic_db()))
+        st.caption(f"📦 Tryb analityczny: agregaty ze snapshotu z {snap.manifest['updated_at'] or '—'} "
+                   "(terminy płatności i prognoza – z bazy).")
+    with span(f"widok: {view}"):
+        SUMMARY_VIEWS[view]()
+
+# ------------------ UI: DIAGNOSTYKA (ADMIN) ------
+def _quantiles(df: pd.DataFrame, by: str) -> pd.DataFrame:
+    g = df.groupby(by)["ms"]
+    out = pd.DataFrame({"liczba": g.size(), "p50_ms": g.quantile(0.5), "p95_ms": g.quantile(0.95),
+                        "max_ms": g.max(), "suma_ms": g.sum()})
+    return out.sort_values("p95_ms", ascending=False).round(2)
+
+def page_diagnostics_admin():
+    st.header("🔧 Diagnostyka")
+    prof = get_profiler()
+    spans, queries = prof.spans_df(), prof.queries_df()
+
+    c1, c2, c3 = st.columns([2, 1, 1])
+    slow_ms = c1.number_input("Próg wolnego zapytania [ms]", min_value=0.0, value=SLOW_QUERY_MS, step=10.0,
+                              key="diag_slow_ms")
+    c2.download_button("⬇️ Eksport JSON", prof.to_json().encode("utf-8"), "vetfinance_profil.json",
+                       "application/json", key="diag_json")
+    if c3.button("Wyczyść profil", key="diag_clear"):
+        prof.clear()
+        st.rerun()
 
-        chart = pd.DataFrame({"d": pd.date_range(first, last)})
-        chart["d"] = chart["d"].dt.date
-        chart = chart.merge(df_shop_rev, on="d", how="left").merge(df_shop_paid, on="d", how="left").fillna(0.0)
-        chart = chart.set_index("d")
-        st.subheader("Sklep: utargi i zapłacone wydatki (dziennie)")
-        st.line_chart(chart[["sales", "shop_paid"]])
+    tab_pages, tab_slow, tab_sql, tab_db = st.tabs(
+        ["⏱️ Strony (p50/p95)", "🐢 Wolne zapytania", "🧮 Zapytania (zbiorczo)", "🗄️ Baza"])
 
-        c1, c2 = st.columns(2)
-        c1.metric("Suma utargów (sklep)", f"{sum_shop_sales:,.2f} zł")
-        c2.metric("Suma zapłaconych wydatków (sklep)", f"{sum_shop_paid:,.2f} zł")
-
-    # Zwierzęta – skrót
-    with tabs[4]:
-        y = st.number_input("Rok (zwierzęta)", value=date.today().year, step=1, format="%d", key="farm_y2")
-        m = st.number_input("Miesiąc (zwierzęta)", min_value=1, max_value=12, value=date.today().month, step=1, key="farm_m2")
-        first, last = ym_bounds(int(y), int(m))
-        df_sum = pd.read_sql_query(
-            """
-            SELECT typ, SUM(kwota) AS suma
-            FROM farm_reports
-            WHERE date(report_date) BETWEEN ? AND ?
-            GROUP BY typ
-            """,
-            cnx(),
-            params=(first.isoformat(), last.isoformat()),
-        )
-        st.dataframe(df_sum, use_container_width=True)
-        total = float(df_sum["suma"].sum() if not df_sum.empty else 0.0)
-        st.metric("Suma (miesiąc, magazyn+teren)", f"{total:,.2f} zł")
+    with tab_pages:
+        if spans.empty:
+            st.info("Brak pomiarów – przejdź po stronach aplikacji.")
+        else:
+            runs = spans[spans["span"] == "przebieg"]
+            st.subheader("Pełny przebieg strony")
+            st.dataframe(_quantiles(runs, "strona"), use_container_width=True)
+            st.subheader("Odcinki (widoki, init_db)")
+            st.dataframe(_quantiles(spans[spans["span"] != "przebieg"], "span"), use_container_width=True)
+
+    with tab_slow:
+        if queries.empty:
+            st.info("Brak zarejestrowanych zapytań.")
+        else:
+            slow = queries[queries["ms"] >= slow_ms].sort_values("ms", ascending=False)
+            st.caption(f"{len(slow)} z {len(queries)} zapytań ≥ {slow_ms:g} ms "
+                       f"(plan zapisywany dla ≥ {SLOW_QUERY_MS:g} ms)")
+            st.dataframe(slow[["strona", "ms", "wiersze", "sql", "parametry", "plan"]].head(500),
+                         use_container_width=True, hide_index=True)
+
+    with tab_sql:
+        if not queries.empty:
+            hits = queries.groupby("sql")["cache"].mean().rename("trafienia_cache")
+            agg = _quantiles(queries[~queries["cache"]], "sql").join(hits, how="outer").fillna(0)
+            st.dataframe(agg.sort_values("suma_ms", ascending=False), use_container_width=True)
+
+    with tab_db:
+        st.json({"filia": clinic_db(), "pula": db_pool_stats(),
+                 "kolejka_zapisów": get_write_queue(clinic_db()).stats(), "cache": get_query_cache().stats()})
+        if st.button("Sprawdź plany zapytań"):
+            st.dataframe(check_query_plans(), use_container_width=True)
+        if st.button("Sprawdź agregaty"):
+            with ro_cnx() as conn:
+                diff = pd.concat([check_rollups(conn).assign(tabela="rollup_daily"),
+                                  check_staff_shifts(conn).assign(tabela="staff_shifts_monthly")])
+            if diff.empty:
+                st.success("Agregaty zgodne z tabelami źródłowymi.")
+            else:
+                st.warning(f"Rozbieżności: {len(diff)}")
+                st.dataframe(diff, use_container_width=True)
+        if st.button("Przebuduj agregaty"):
+            def rebuild(conn):
+                rebuild_rollups(conn)
+                rebuild_staff_shifts(conn)
+
+            write(rebuild)
+            get_query_cache().clear()
+            st.success("Agregaty przebudowane.")
+        worker = get_snapshot_worker(clinic_db())
+        if worker is not None:
+            st.subheader("Snapshot Parquet")
+            with ro_cnx() as conn:
+                dirty = conn.execute("SELECT COUNT(*) FROM snapshot_dirty").fetchone()[0]
+            st.json({**vs.open_snapshot(worker.out_dir).stats(), "zmienione_partycje": dirty,
+                     "wątek": worker.stats()})
+            if st.button("Odśwież snapshot"):
+                with st.spinner("Odświeżanie snapshotu..."):
+                    stats = worker.refresh()
+                st.success(f"Snapshot odświeżony: {stats['partitions']} partycji, {stats['rows']} wierszy "
+                           f"w {stats['ms']:.0f} ms.")
 
 # ------------------ LOGOWANIE ---------------------
 def login_box():
@@ -1218,21 +3565,40 @@ def user_topbar():
         u = st.session_state.get("user")
         if u:
             st.success(f"Zalogowano: {u['full_name']} ({u['role']})")
+            st.text_input("🔎 Szukaj we wszystkich modułach", key="global_q",
+                          placeholder="kontrahent, numer, uwagi, personel…")
             if st.button("Wyloguj"):
                 st.session_state.pop("user")
                 st.rerun()
 
+def clinic_box() -> str:
+    # filia (shard) sesji; przy jednej filii bez pola wyboru
+    names = list(clinics())
+    if len(names) == 1:
+        return names[0]
+    return st.sidebar.selectbox("🏥 Filia", names, key="clinic")
+
 # ------------------ MAIN -------------------------
 def main():
     st.set_page_config(page_title="VetFinance", layout="wide", page_icon="🐾")
-    init_db()
-
     if "user" not in st.session_state:
         login_box()
         return
 
     user_topbar()
+    path = clinics()[clinic_box()]
+    token = clinic_context().set(path)
+    try:
+        with span("init_db"):
+            init_db(path)
+        session_pages()
+    finally:
+        clinic_context().reset(token)
+
+def session_pages():
     role = st.session_state["user"]["role"]
+    if st.session_state.get("global_q", "").strip():
+        search_results_box(st.session_state["global_q"].strip())
 
     pages = {
         "Recepcja": page_recepcja,
@@ -1244,10 +3610,23 @@ def main():
     if role == "admin":
         pages["Leasingi"] = page_leasingi
         pages["Pracownicy (admin)"] = page_employees_admin
+        pages["Import danych (admin)"] = page_import_admin
+        pages["Uzgodnienie z bankiem (admin)"] = page_reconciliation_admin
+        pages["Diagnostyka (admin)"] = page_diagnostics_admin
         pages["Podsumowanie (admin)"] = page_summary_admin
 
     choice = st.sidebar.radio("Nawigacja", list(pages.keys()))
-    pages[choice]()
+    analytic = False
+    if role == "admin" and get_snapshot_worker(clinic_db()) is not None:
+        analytic = st.sidebar.checkbox("📦 Tryb analityczny (snapshot)", key="analytic_mode",
+                                       help="Podsumowania i statystyki pracowników ze snapshotu Parquet "
+                                            f"(odświeżany co {SNAPSHOT_INTERVAL_S // 60} min) zamiast z bazy.")
+    token = analytic_mode().set(analytic)
+    try:
+        with profiled_rerun(choice):
+            pages[choice]()
+    finally:
+        analytic_mode().reset(token)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,365 @@
+# VetFinance – benchmark ścieżek danych (bez serwera Streamlit)
+# =============================================================================
+# Generuje powtarzalne (seed) dane syntetyczne w skali 10k / 100k / 1M wierszy
+# i mierzy scenariusze odpowiadające stronom aplikacji. Wynik: JSON.
+#
+# Uruchom:
+#   python benchmark.py --scale 100k                      # dane w bench_data/100k-s42
+#   python benchmark.py --scale 100k --out wyniki.json
+#   python benchmark.py --scale 100k --compare main.json  # kod wyjścia 1 przy regresji
+#
+# Raz wygenerowana baza jest używana ponownie (--regenerate wymusza nową).
+# =============================================================================
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import vetfinance_data as vd
+import vetfinance_snapshot as vs
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+# udział tabel w łącznej liczbie wierszy (techników jest średnio 1,5 na raport)
+SHARES = {
+    "daily_reports": 0.20, "ap_invoices": 0.18, "ar_invoices": 0.18, "shop_sales": 0.04,
+    "shop_expenses": 0.05, "farm_reports": 0.04, "bank_transactions": 0.01,
+}
+YEARS = 5
+N_VETS, N_TECHS, N_LEASINGS, N_COUNTERPARTIES = 12, 20, 10, 300
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ------------------ GENERATOR --------------------
+def _dates(rng, n: int, first: date, last: date) -> np.ndarray:
+    span = (last - first).days + 1
+    days = np.sort(rng.integers(0, span, n))
+    return np.datetime64(first) + days.astype("timedelta64[D]")
+
+def _iso(d: np.ndarray) -> list:
+    return np.datetime_as_string(d.astype("datetime64[D]")).tolist()
+
+def _money(rng, n: int, mean: float) -> np.ndarray:
+    # kwoty w groszach (int64), jak w bazie aplikacji; `mean` w złotych
+    return vd.round_grosze(rng.lognormal(np.log(mean * 100), 0.6, n))
+
+def _invoices(rng, n: int, first: date, today: date, prefix: str, due_days: int):
+    issue = _dates(rng, n, first, today)
+    due = issue + np.timedelta64(due_days, "D")
+    age = (np.datetime64(today) - issue).astype(int)
+    # starsze faktury prawie zawsze opłacone, świeże częściej otwarte
+    paid = rng.random(n) < np.where(age > 60, 0.97, 0.55)
+    paid_on = issue + rng.integers(0, due_days + 20, n).astype("timedelta64[D]")
+    paid_on = np.minimum(paid_on, np.datetime64(today))
+    names = np.array([f"{prefix} {i:03d}" for i in range(N_COUNTERPARTIES)])
+    party = names[rng.zipf(1.6, n) % N_COUNTERPARTIES]
+    year = issue.astype("datetime64[Y]").astype(int) + 1970
+    number = [f"FV/{i}/{y}" for i, y in zip(range(1, n + 1), year)]
+    paid_iso = _iso(paid_on)
+    return [
+        (i_, d_, p_, num, "Inne", int(a), "", int(pd_), pdt if pd_ else None)
+        for i_, d_, p_, num, a, pd_, pdt in zip(
+            _iso(issue), _iso(due), party.tolist(), number, _money(rng, n, 900), paid, paid_iso)
+    ]
+
+def generate(v, scale: str, seed: int):
+    """Wypełnia pustą bazę aplikacji (po migracjach) danymi syntetycznymi."""
+    total = SCALES[scale]
+    counts = {t: max(1, int(total * share)) for t, share in SHARES.items()}
+    rng = np.random.default_rng(seed)
+    today = date.today()
+    first = date(today.year - YEARS, today.month, 1)
+
+    vets = [f"Lekarz {i:02d}" for i in range(N_VETS)]
+    techs = [f"Technik {i:02d}" for i in range(N_TECHS)]
+    with v.cnx() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # triggery (agregaty, FTS, wersje, historia płac) wyłączone na czas ładowania,
+        # potem odtworzone i przeliczone zbiorczo – tak jak robią to migracje
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+            conn.execute(f"DROP TRIGGER {name}")
+
+        emp = [(n, "lekarz", int(rng.integers(9, 16) * 100_000), 1) for n in vets]
+        emp += [(n, "technik", int(rng.integers(5, 8) * 100_000), 1) for n in techs]
+        conn.executemany("INSERT INTO employees (name, role, monthly_salary, active) VALUES (?,?,?,?)", emp)
+        # historia płac: pensja startowa i podwyżka w połowie okresu
+        mid = first + (today - first) / 2
+        hist = []
+        for emp_id, (_, _, salary, _) in enumerate(emp, start=1):
+            hist.append((emp_id, salary * 9 // 10, first.isoformat(), (mid - timedelta(days=1)).isoformat()))
+            hist.append((emp_id, salary, mid.isoformat(), None))
+        conn.executemany(
+            "INSERT INTO salary_history (employee_id, monthly_salary, valid_from, valid_to) VALUES (?,?,?,?)", hist)
+
+        starts = _dates(rng, N_LEASINGS, first, today)
+        conn.executemany(
+            "INSERT INTO leasings (name, monthly_amount, start_date, end_date) VALUES (?,?,?,?)",
+            [(f"Leasing {i}", float(a), s, e) for i, (a, s, e) in enumerate(zip(
+                _money(rng, N_LEASINGS, 2500), _iso(starts), _iso(starts + np.timedelta64(365 * 4, "D"))))],
+        )
+
+        n = counts["daily_reports"]
+        n_techs = rng.integers(1, 3, n) + (rng.random(n) < 0.25)
+        tech_lists = [", ".join(rng.choice(techs, k, replace=False)) for k in n_techs]
+        conn.executemany(
+            """INSERT INTO daily_reports (report_date, shift, kasa, terminal, uwagi, staff_vet, staff_tech)
+               VALUES (?,?,?,?,?,?,?)""",
+            list(zip(_iso(_dates(rng, n, first, today)), rng.choice(["poranna", "popołudniowa"], n).tolist(),
+                     _money(rng, n, 700).tolist(), _money(rng, n, 1100).tolist(), [""] * n,
+                     rng.choice(vets, n).tolist(), tech_lists)),
+        )
+        conn.execute("""
+            INSERT INTO daily_report_techs (daily_report_id, tech_name)
+            WITH RECURSIVE split(id, tech, rest) AS (
+                SELECT id, '', staff_tech || ', ' FROM daily_reports
+                UNION ALL
+                SELECT id, substr(rest, 1, instr(rest, ', ') - 1), substr(rest, instr(rest, ', ') + 2)
+                FROM split WHERE rest <> ''
+            )
+            SELECT id, tech FROM split WHERE tech <> ''
+        """)
+
+        conn.executemany(
+            """INSERT INTO ap_invoices (invoice_date, due_date, supplier, number, category, amount, notes, paid, paid_date)
+               VALUES (?,?,?,?,?,?,?,?,?)""",
+            _invoices(rng, counts["ap_invoices"], first, today, "Dostawca", 14),
+        )
+        ar = _invoices(rng, counts["ar_invoices"], first, today, "Firma", 30)
+        conn.executemany(
+            """INSERT INTO ar_invoices (issue_date, due_date, company, number, category, amount, notes, paid, paid_date)
+               VALUES (?,?,?,?,?,?,?,?,?)""",
+            ar,
+        )
+
+        n = counts["shop_sales"]
+        conn.executemany("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES (?,?,?)",
+                         list(zip(_iso(_dates(rng, n, first, today)), _money(rng, n, 150).tolist(),
+                                  _money(rng, n, 250).tolist())))
+        n = counts["shop_expenses"]
+        conn.executemany(
+            "INSERT INTO shop_expenses (expense_date, amount, invoice_number, supplier, paid) VALUES (?,?,?,?,?)",
+            list(zip(_iso(_dates(rng, n, first, today)), _money(rng, n, 300).tolist(),
+                     [f"S/{i}" for i in range(n)], rng.choice(["Hurtownia A", "Hurtownia B", "Karma"], n).tolist(),
+                     (rng.random(n) < 0.9).astype(int).tolist())),
+        )
+        n = counts["farm_reports"]
+        conn.executemany("INSERT INTO farm_reports (report_date, typ, kwota, uwagi) VALUES (?,?,?,?)",
+                         list(zip(_iso(_dates(rng, n, first, today)), rng.choice(["magazyn", "teren"], n).tolist(),
+                                  _money(rng, n, 400).tolist(), [""] * n)))
+
+        # przelewy: część otwartych faktur AR z ostatnich miesięcy + szum
+        open_ar = [(r[1], r[5], r[2], r[3]) for r in ar if not r[7]]
+        n = counts["bank_transactions"]
+        pick = rng.choice(len(open_ar), min(n // 2, len(open_ar)), replace=False) if open_ar else []
+        tx = [(open_ar[i][0], open_ar[i][1], open_ar[i][2].upper(), f"zaplata {open_ar[i][3]}") for i in pick]
+        noise = n - len(tx)
+        tx += list(zip(_iso(_dates(rng, noise, today - timedelta(days=90), today)),
+                       (-_money(rng, noise, 200)).tolist(), ["Bank"] * noise, ["oplata"] * noise))
+        conn.executemany("INSERT INTO bank_transactions (tx_date, amount, counterparty, title) VALUES (?,?,?,?)", tx)
+
+        v.create_rollup_triggers(conn)
+        v.create_version_triggers(conn, v.VERSIONED_TABLES)
+        for table, (_, cols, *_) in v.SEARCH_SOURCES.items():
+            v.create_search_triggers(conn, table, cols)
+        v.create_salary_triggers(conn)
+        v.create_staff_shift_triggers(conn)
+        v.create_snapshot_triggers(conn, vs.SNAPSHOT_TABLES)
+        v.rebuild_rollups(conn)
+        v.rebuild_staff_shifts(conn)
+        v.rebuild_search_index(conn)
+    with v.cnx() as conn:
+        conn.execute("ANALYZE")
+
+
+# ------------------ SCENARIUSZE ------------------
+def scenarios(v) -> dict:
+    today = date.today()
+    first, last = v.ym_bounds(today.year, today.month)
+    months = [str(p) for p in pd.period_range(end=pd.Period(today, "M"), periods=12, freq="M")]
+
+    def month_summary():
+        v.load_parallel({
+            "chart": lambda: v.rollup_by_day(first, last, list(vd.PNL_SOURCES)),
+            "pnl": lambda: v.monthly_pnl([months[-1]]),
+        })
+
+    def direct(fn, *args):
+        # warstwa danych bez cache aplikacji – własne połączenie tylko do odczytu
+        def run():
+            with v.ro_cnx() as conn:
+                fn(conn, *args)
+        return run
+
+    def on_snapshot(fn, *args):
+        # agregat ze snapshotu Parquet (tryb analityczny) – bez cache aplikacji
+        def run():
+            fn(vs.open_snapshot(v.snapshot_dir(v.DB)), *args)
+        return run
+
+    def ar_list(text=""):
+        where, params = v.ar_list_filter("Tylko nieopłacone", False, date(today.year - 1, 1, 1), today, None, text)
+        df, has_next, _ = v.keyset_fetch("id, issue_date, due_date, company, number, amount", "ar_invoices",
+                                         where, params, sort=v.AR_LIST_SORT)
+        if has_next:  # druga strona – jak przycisk „Następna”
+            cursor = (v._py(df["_sort_key"].iloc[-1]), v._py(df["_row_id"].iloc[-1]))
+            v.keyset_fetch("id, issue_date, due_date, company, number, amount", "ar_invoices",
+                           where, params, sort=v.AR_LIST_SORT, cursor=cursor)
+
+    pnl_60m = tuple(str(p) for p in pd.period_range(end=pd.Period(today, "M"), periods=60, freq="M"))
+    out = {
+        "podsumowanie_miesiac": month_summary,
+        "trend_12m": lambda: v.monthly_pnl(months),
+        "filie_pnl_12m": lambda: v.consolidated_pnl(months),
+        "vd_pnl_60m": direct(vd.monthly_pnl, pnl_60m),
+        "vd_zmiany_rok_rr": direct(vd.staff_shift_yoy, f"{today.year - 1}-01", f"{today.year - 1}-12"),
+        "vd_aging_ar": direct(vd.aging_detail, "ar", today),
+        "aging_ar": lambda: (v.aging_detail("ar", today), v.aging_matrix("ar", today)),
+        "aging_ar_rok_temu": lambda: v.aging_matrix("ar", today - timedelta(days=365)),
+        "aging_ap": lambda: v.aging_matrix("ap", today),
+        "statystyki_zmian": lambda: v.employee_shift_stats(months[-1], months[-1]),
+        "statystyki_zmian_12m_rr": lambda: v.employee_shift_stats(months[0], months[-1], compare_years=1),
+        "lista_ar_filtr": ar_list,
+        "lista_ar_szukaj": lambda: ar_list("firma 01"),
+        "wyszukiwarka": lambda: v.global_search("firma 012"),
+        "prognoza_24m": lambda: v.forecast_cashflow(today, 24),
+        "uzgadnianie_90d": lambda: v.reconcile(today - timedelta(days=90), today),
+    }
+    if vs.pq is not None:
+        out["snapshot_pnl_60m"] = on_snapshot(vs.monthly_pnl, pnl_60m)
+        out["snapshot_zmiany_rok_rr"] = on_snapshot(vs.staff_shift_yoy, f"{today.year - 1}-01", f"{today.year - 1}-12")
+    return out
+
+def _clear_caches(v):
+    v.get_query_cache().clear()
+    v.st.cache_data.clear()
+
+def _stats(samples: list) -> dict:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {"min": round(ordered[0], 3), "median": round(statistics.median(ordered), 3),
+            "p95": round(p95, 3), "n": len(ordered)}
+
+def run_scenarios(v, repeat: int, only=None) -> list:
+    results = []
+    for name, fn in scenarios(v).items():
+        if only and name not in only:
+            continue
+        cold, warm = [], []
+        for _ in range(repeat):
+            # zimno: pusty cache zapytań i st.cache_data (jak po zmianie danych)
+            _clear_caches(v)
+            t0 = time.perf_counter()
+            fn()
+            cold.append((time.perf_counter() - t0) * 1000)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            warm.append((time.perf_counter() - t0) * 1000)
+        results.append({"scenario": name, "cold_ms": _stats(cold), "warm_ms": _stats(warm)})
+        print(f"  {name:<24} zimno {results[-1]['cold_ms']['median']:>9.1f} ms   "
+              f"ciepło {results[-1]['warm_ms']['median']:>8.1f} ms", file=sys.stderr)
+    return results
+
+
+# ------------------ PORÓWNANIE -------------------
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Tabela median (zimno) względem bazowego pliku; True, gdy któryś scenariusz zwolnił ponad próg."""
+    base = {r["scenario"]: r for r in baseline.get("results", [])}
+    regressed = False
+    print(f"\n{'scenariusz':<24} {'bazowo':>10} {'teraz':>10} {'x':>6}", file=sys.stderr)
+    for r in current["results"]:
+        b = base.get(r["scenario"])
+        if not b:
+            continue
+        old, new = b["cold_ms"]["median"], r["cold_ms"]["median"]
+        ratio = new / old if old else float("inf")
+        flag = "  <-- regresja" if ratio > threshold else ""
+        regressed |= ratio > threshold
+        print(f"{r['scenario']:<24} {old:>10.1f} {new:>10.1f} {ratio:>6.2f}{flag}", file=sys.stderr)
+    return regressed
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ścieżek danych VetFinance na danych syntetycznych.")
+    ap.add_argument("--scale", choices=list(SCALES), default="10k")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--repeat", type=int, default=5, help="powtórzeń na scenariusz (zimno i ciepło)")
+    ap.add_argument("--workdir", help="katalog z bazą (domyślnie bench_data/<skala>-s<seed>)")
+    ap.add_argument("--regenerate", action="store_true", help="wygeneruj bazę od nowa")
+    ap.add_argument("--only", nargs="*", help="tylko wybrane scenariusze")
+    ap.add_argument("--out", help="zapisz wynik JSON do pliku (domyślnie stdout)")
+    ap.add_argument("--compare", help="plik JSON z poprzedniego uruchomienia do porównania")
+    ap.add_argument("--threshold", type=float, default=1.25, help="dopuszczalny wzrost mediany (x)")
+    args = ap.parse_args()
+
+    workdir = os.path.abspath(args.workdir or os.path.join(APP_DIR, "bench_data", f"{args.scale}-s{args.seed}"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # aplikacja otwiera bazę DB względem katalogu roboczego
+    logging.disable(logging.WARNING)  # „No runtime found” itp. z Streamlit bez serwera
+    sys.path.insert(0, APP_DIR)
+    import VetFinanceOfficial as v
+
+    if args.regenerate:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(v.DB + suffix):
+                os.remove(v.DB + suffix)
+    fresh = not os.path.exists(v.DB)
+    v.init_db()
+    gen_s = None
+    if fresh:
+        print(f"Generowanie danych {args.scale} (seed {args.seed}) w {workdir} ...", file=sys.stderr)
+        t0 = time.perf_counter()
+        generate(v, args.scale, args.seed)
+        gen_s = round(time.perf_counter() - t0, 2)
+
+    if vs.pq is not None:
+        # snapshot dla scenariuszy snapshot_* (przy kolejnych uruchomieniach tylko zmiany)
+        stats = v.refresh_snapshot(v.get_pool(readonly=True), v.get_write_queue(), v.snapshot_dir(v.DB))
+        print(f"Snapshot: {stats['partitions']} partycji, {stats['rows']} wierszy w {stats['ms']:.0f} ms",
+              file=sys.stderr)
+
+    with v.ro_cnx() as conn:
+        rows = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in (*SHARES, "daily_report_techs", "employees", "leasings", "salary_history")}
+    print(f"Scenariusze (x{args.repeat}):", file=sys.stderr)
+    result = {
+        "meta": {
+            "scale": args.scale, "seed": args.seed, "repeat": args.repeat, "rows": rows,
+            "generate_s": gen_s, "git": _git_rev(), "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version, "pandas": pd.__version__, "numpy": np.__version__,
+            "machine": platform.machine(), "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run_scenarios(v, args.repeat, args.only),
+    }
+    payload = json.dumps(result, ensure_ascii=False, indent=1)
+    if args.out:
+        with open(args.out if os.path.isabs(args.out) else os.path.join(APP_DIR, args.out), "w",
+                  encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.compare:
+        path = args.compare if os.path.isabs(args.compare) else os.path.join(APP_DIR, args.compare)
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(result, baseline, args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import logging
+import os
+import shutil
+import sys
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+logging.disable(logging.WARNING)  # "No runtime found" – aplikacja importowana bez serwera Streamlit
+
+import VetFinanceOfficial as app  # noqa: E402
+
+
+def migrated_db(path: str) -> str:
+    conn = app.open_connection(path)
+    try:
+        app.migrate(conn)
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return migrated_db(str(tmp_path / "test.db"))
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = app.open_connection(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def legacy_db_path(tmp_path):
+    # baza z repozytorium (schemat sprzed migracji) podniesiona do bieżącej wersji
+    path = str(tmp_path / "legacy.db")
+    shutil.copy(os.path.join(REPO, "VetFinanceDB1.db"), path)
+    return migrated_db(path)
+
+
+def use_clinic(path: str):
+    """Ustawia plik bazy bieżącej filii (cnx()/write()) do końca testu."""
+    token = app.clinic_context().set(path)
+
+    def restore():
+        app.clinic_context().reset(token)
+        app.get_write_queue(path).close()
+        app.get_pool(path).close_all()
+        app.get_pool(path, readonly=True).close_all()
+    return restore
+
+
+@pytest.fixture
+def clinic(db_path):
+    restore = use_clinic(db_path)
+    yield db_path
+    restore()
+
+
+@pytest.fixture
+def legacy_clinic(legacy_db_path):
+    restore = use_clinic(legacy_db_path)
+    yield legacy_db_path
+    restore()
+
+
+@pytest.fixture
+def admin_app(tmp_path, monkeypatch):
+    """Aplikacja (AppTest) zalogowana jako admin, ze świeżą bazą w katalogu testu."""
+    monkeypatch.chdir(tmp_path)
+    # pule, kolejka zapisów i init_db są zasobami per ścieżka, a DB to ścieżka względna
+    st.cache_resource.clear()
+    at = AppTest.from_file(os.path.join(REPO, "VetFinanceOfficial.py"), default_timeout=60)
+    at.session_state["user"] = {"username": "admin", "full_name": "Admin", "role": "admin"}
+    at.run()
+    yield at
+    st.cache_resource.clear()
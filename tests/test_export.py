@@ -0,0 +1,15 @@
+def test_only_latest_prepared_export_is_kept(admin_app):
+    at = admin_app
+    at.sidebar.radio[0].set_value("Sklep").run()
+
+    at.button(key="shop_sales_prep").click().run()
+    assert at.session_state["_export"][0][0] == "shop_sales"
+    assert [b.label for b in at.get("download_button")] == ["Pobierz sklep_utargi.csv"]
+
+    at.button(key="shop_exp_prep").click().run()
+    assert at.session_state["_export"][0][0] == "shop_exp"  # poprzedni plik zastąpiony
+    assert [b.label for b in at.get("download_button")] == ["Pobierz sklep_faktury.csv"]
+
+    at.selectbox(key="shop_exp_fmt").set_value("CSV (gzip)").run()
+    assert "_export" not in at.session_state  # plik dla starego formatu zwolniony
+    assert not at.get("download_button") and not at.exception
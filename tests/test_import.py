@@ -0,0 +1,105 @@
+import io
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import VetFinanceOfficial as app
+
+REPORTS_CSV = "data;zmiana;kasa;terminal\n2024-03-01;poranna;100,50;20\n2024-03-02;popołudniowa;80;0\n"
+REPORTS_MAPPING = {"report_date": "data", "shift": "zmiana", "kasa": "kasa", "terminal": "terminal"}
+
+
+def test_legacy_not_null_text_columns_are_filled(legacy_clinic):
+    conn = sqlite3.connect(legacy_clinic)
+    try:
+        assert {"staff_vet", "staff_tech"} <= app.table_not_null(conn, "daily_reports")
+        before = conn.execute("SELECT COUNT(*) FROM daily_reports").fetchone()[0]
+    finally:
+        conn.close()
+
+    stats, report = app.import_file(io.BytesIO(REPORTS_CSV.encode("utf-8")), "raporty.csv",
+                                    "daily_reports", REPORTS_MAPPING)
+    assert stats["dodane"] == 2 and stats["odrzucone"] == 0 and report.empty
+
+    conn = sqlite3.connect(legacy_clinic)
+    try:
+        rows = conn.execute("SELECT staff_vet, staff_tech, kasa FROM daily_reports WHERE report_date >= '2024-03-01' "
+                            "ORDER BY report_date").fetchall()
+        assert conn.execute("SELECT COUNT(*) FROM daily_reports").fetchone()[0] == before + 2
+    finally:
+        conn.close()
+    assert rows == [("", "", 10050), ("", "", 8000)]
+
+
+def test_fresh_schema_keeps_null_for_missing_text(clinic):
+    app.import_file(io.BytesIO(REPORTS_CSV.encode("utf-8")), "raporty.csv", "daily_reports", REPORTS_MAPPING)
+    conn = sqlite3.connect(clinic)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM daily_reports WHERE staff_vet IS NULL").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def test_shop_sales_dedupe_only_within_file(clinic):
+    conn = sqlite3.connect(clinic)
+    try:
+        with conn:
+            conn.execute("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES ('2024-03-01', 10000, 2000)")
+    finally:
+        conn.close()
+
+    csv = "data;kasa;terminal\n2024-03-01;100;20\n2024-03-02;50;0\n2024-03-02;50;0\n"
+    stats, report = app.import_file(io.BytesIO(csv.encode("utf-8")), "utarg.csv", "shop_sales",
+                                    {"sale_date": "data", "kasa": "kasa", "terminal": "terminal"})
+    # ten sam utarg co w bazie to drugi, osobny wpis; powtórzony wiersz pliku – duplikat
+    assert stats["dodane"] == 2 and stats["duplikaty"] == 1
+    assert report["wiersz"].tolist() == [4]
+    conn = sqlite3.connect(clinic)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM shop_sales WHERE sale_date = '2024-03-01'").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def test_check_values_match_case_insensitively_and_keep_allowed_spelling():
+    # CHECK-i ze starej bazy (sprzed m017) z imionami pisanymi wielką literą
+    checks = {"shift": {"poranna", "popołudniowa"}, "staff_vet": {"Ewelina Marecka", "Patrycja Jurczak"}}
+    raw = pd.DataFrame({"d": ["2024-03-01"] * 4, "z": ["Poranna", "poranna", "POPOŁUDNIOWA", "poranna"],
+                        "v": ["Ewelina Marecka", "patrycja jurczak", "Ewelina Marecka", "Jan Nowak"]})
+    mapping = {"report_date": "d", "shift": "z", "staff_vet": "v"}
+    out, bad, reasons = app._validate_chunk(raw, "daily_reports", mapping, checks, {"staff_vet"})
+    assert bad.tolist() == [False, False, False, True]
+    assert reasons.iloc[3].startswith("staff_vet spoza dozwolonych")
+    assert out["shift"].tolist()[:3] == ["poranna", "poranna", "popołudniowa"]
+    assert out["staff_vet"].tolist() == ["Ewelina Marecka", "Patrycja Jurczak", "Ewelina Marecka", "Jan Nowak"]
+
+
+def test_not_null_date_without_value_is_rejected():
+    raw = pd.DataFrame({"d": ["2024-01-05", "2024-01-06"], "t": ["2024-01-20", "2024-01-21"],
+                        "s": ["Hurt", "Hurt"], "k": ["10", "20"], "p": ["2024-01-10", ""]})
+    mapping = {"invoice_date": "d", "due_date": "t", "supplier": "s", "amount": "k", "paid_date": "p"}
+    _, bad, reasons = app._validate_chunk(raw, "ap_invoices", mapping, {}, {"paid_date"})
+    assert bad.tolist() == [False, True]
+    assert reasons.iloc[1] == "brak wartości: paid_date"
+
+
+def test_progress_counts_committed_rows_before_failure(clinic, monkeypatch):
+    insert_batch, calls = app._insert_batch, []
+
+    def failing_second(conn, table, df):
+        calls.append(len(df))
+        if len(calls) == 2:
+            raise sqlite3.OperationalError("database is locked")
+        return insert_batch(conn, table, df)
+
+    monkeypatch.setattr(app, "_insert_batch", failing_second)
+    done = {}
+    with pytest.raises(sqlite3.OperationalError):
+        app.import_file(io.BytesIO(REPORTS_CSV.encode("utf-8")), "raporty.csv", "daily_reports", REPORTS_MAPPING,
+                        chunk_rows=1, progress=done.update)
+    conn = sqlite3.connect(clinic)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM daily_reports").fetchone()[0] == done["dodane"] == 1
+    finally:
+        conn.close()
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import VetFinanceOfficial as app
+import vetfinance_data as vd
+from conftest import migrated_db
+
+MONTHS = ["2025-01", "2025-02", "2025-03"]
+
+
+@pytest.mark.parametrize("value, grosze", [
+    (0, 0), (None, 0), ("", 0), (0.29, 29), (19.99, 1999), ("12.3", 1230), (100, 10000),
+    (1.005, 101), (2.675, 268), (0.125, 13), (-0.015, -2), (-1.005, -101),
+])
+def test_to_grosze(value, grosze):
+    assert vd.to_grosze(value) == grosze
+
+
+def test_round_grosze_half_away_from_zero():
+    values = [0.5, 1.5, 2.5, -0.5, -2.5, 0.49, -0.49, 28.499999999999996, 1.005 * 100]
+    assert vd.round_grosze(values).tolist() == [1, 2, 3, -1, -3, 0, 0, 29, 101]
+    assert vd.round_grosze(values).dtype == np.int64
+
+
+def test_grosze_series_keeps_missing():
+    out = vd.grosze_series(pd.Series([1.005, np.nan, 19.99]))
+    assert str(out.dtype) == "Int64"
+    assert out.isna().tolist() == [False, True, False]
+    assert out.dropna().tolist() == [101, 1999]
+
+
+def test_fmt_zl():
+    assert vd.fmt_zl(123456) == "1,234.56 zł"
+    assert vd.fmt_zl(-5) == "-0.05 zł"
+
+
+def _fill_clinic(conn):
+    conn.executemany("INSERT INTO daily_reports (report_date, shift, kasa, terminal) VALUES (?,?,?,?)",
+                     [("2025-01-10", "poranna", 10050, 2000), ("2025-02-05", "poranna", 5000, 0)])
+    conn.execute("INSERT INTO ar_invoices (issue_date, due_date, company, amount, paid, paid_date) "
+                 "VALUES ('2025-02-01', '2025-02-15', 'Firma', 30000, 1, '2025-02-20')")
+    conn.execute("INSERT INTO ap_invoices (invoice_date, due_date, supplier, amount, paid, paid_date) "
+                 "VALUES ('2025-02-25', '2025-03-10', 'Hurt', 12345, 1, '2025-03-01')")
+    conn.execute("INSERT INTO leasings (name, monthly_amount, start_date, end_date) "
+                 "VALUES ('USG', 150000, '2025-01-01', '2025-02-28')")
+    conn.execute("INSERT INTO salary_history (employee_id, monthly_salary, valid_from) VALUES (1, 500000, '2025-01-16')")
+    conn.commit()
+
+
+def test_group_pnl_frame_matches_single_clinic_pnl(tmp_path):
+    conns = {name: app.open_connection(migrated_db(str(tmp_path / f"{name}.db"))) for name in ("A", "B")}
+    try:
+        _fill_clinic(conns["A"])
+        parts = {name: (vd.rollup_month_rows(c, tuple(MONTHS), vd.PNL_SOURCES), vd.leasing_contracts(c),
+                        vd.salary_periods(c)) for name, c in conns.items()}
+        group = vd.group_pnl_frame(parts, MONTHS)
+        single = {name: vd.monthly_pnl(c, tuple(MONTHS)) for name, c in conns.items()}
+    finally:
+        for c in conns.values():
+            c.close()
+
+    for name in conns:
+        part = group.loc[name]
+        assert part.index.tolist() == MONTHS
+        assert (part.dtypes == np.int64).all()
+        assert part.to_numpy().tolist() == single[name][part.columns].to_numpy().tolist()
+    a = group.loc["A"]
+    assert a["Przychody_gabinet"].tolist() == [12050, 5000, 0]
+    assert a["AR_oplacone"].tolist() == [0, 30000, 0]
+    assert a["AP_zaplacone"].tolist() == [0, 0, 12345]
+    assert a["Leasingi"].tolist() == [150000, 150000, 0]
+    assert a["Wynagrodzenia"].tolist() == [258065, 500000, 500000]  # styczeń od 16.: 500000 * 16/31
+    assert a["Wynik_netto"].tolist() == [12050 - 150000 - 258065, 35000 - 650000, -512345]
+    assert (group.loc["B"].to_numpy() == 0).all()
+
+
+def test_migration_converts_float_amounts_to_grosze(tmp_path, monkeypatch):
+    conn = app.open_connection(str(tmp_path / "v14.db"))
+    try:
+        monkeypatch.setattr(app, "MIGRATIONS", [m for m in app.MIGRATIONS if m[0] <= 14])
+        assert app.migrate(conn) == 14
+        conn.executemany("INSERT INTO daily_reports (report_date, shift, kasa, terminal) VALUES (?,?,?,?)",
+                         [("2025-01-10", "poranna", 100.29, 1.005), ("2025-01-11", "poranna", 0.1 + 0.2, 0)])
+        conn.execute("INSERT INTO ap_invoices (invoice_date, due_date, supplier, amount, paid, paid_date) "
+                     "VALUES ('2025-01-02', '2025-01-20', 'Hurt', 2.675, 1, '2025-01-15')")
+        conn.execute("INSERT INTO employees (name, role, monthly_salary) VALUES ('Anna', 'lekarz', 4999.99)")
+        conn.commit()
+        monkeypatch.undo()
+
+        assert app.migrate(conn) == app.MIGRATIONS[-1][0]
+        assert conn.execute("SELECT kasa, terminal, typeof(kasa) FROM daily_reports ORDER BY id").fetchall() == [
+            (10029, 101, "integer"), (30, 0, "integer")]
+        assert conn.execute("SELECT amount FROM ap_invoices").fetchone()[0] == 268
+        assert conn.execute("SELECT monthly_salary FROM employees").fetchone()[0] == 499999
+        assert conn.execute("SELECT monthly_salary FROM salary_history").fetchone()[0] == 499999
+        assert conn.execute("SELECT amount FROM rollup_monthly WHERE ym='2025-01' AND source='clinic'").fetchone()[0] \
+            == 10029 + 101 + 30
+        assert app.check_rollups(conn).empty
+        assert app.check_staff_shifts(conn).empty
+    finally:
+        conn.close()
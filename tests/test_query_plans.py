@@ -0,0 +1,13 @@
+import re
+
+import pytest
+
+import VetFinanceOfficial as app
+
+
+@pytest.mark.parametrize("name, sql, index", app.PLAN_CHECKS, ids=[c[0] for c in app.PLAN_CHECKS])
+def test_plan_uses_expected_index(conn, name, sql, index):
+    plan = app.query_plan(conn, sql, ("2000-01-01", "2000-12-31"))
+    assert any(re.search(rf"USING (COVERING )?INDEX {index}\b", step) for step in plan), plan
+    # pełny skan tabeli bazowej (bez indeksu) = regresja planu
+    assert not [step for step in plan if re.fullmatch(r"SCAN \w+", step)], plan
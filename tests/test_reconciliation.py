@@ -0,0 +1,34 @@
+import sqlite3
+
+import pandas as pd
+
+import VetFinanceOfficial as app
+
+
+def test_invoice_paid_only_when_transaction_was_still_unmatched(clinic):
+    conn = sqlite3.connect(clinic)
+    try:
+        conn.executemany("INSERT INTO ar_invoices (id, issue_date, due_date, company, number, amount) VALUES (?,?,?,?,?,?)",
+                         [(1, "2025-03-01", "2025-03-15", "Firma A", "FV/1", 10000),
+                          (2, "2025-03-01", "2025-03-15", "Firma B", "FV/2", 20000),
+                          (3, "2025-03-01", "2025-03-15", "Firma C", "FV/3", 30000)])
+        conn.executemany("INSERT INTO bank_transactions (id, tx_date, amount, counterparty, title, matched_table, matched_id) "
+                         "VALUES (?,?,?,?,?,?,?)",
+                         [(10, "2025-03-10", 10000, "Firma A", "FV/1", None, None),
+                          (11, "2025-03-11", 20000, "Firma B", "FV/2", "ar_invoices", 3)])  # już uzgodniona
+        conn.commit()
+    finally:
+        conn.close()
+
+    matches = pd.DataFrame({"tabela": ["ar_invoices", "ar_invoices"], "faktura_id": [1, 2], "tx_id": [10, 11],
+                            "tx_date": ["2025-03-10", "2025-03-11"]})
+    assert app.apply_reconciliation(matches) == {"ar_invoices": 1, "ap_invoices": 0}
+
+    conn = sqlite3.connect(clinic)
+    try:
+        paid = conn.execute("SELECT id, paid, paid_date FROM ar_invoices ORDER BY id").fetchall()
+        links = conn.execute("SELECT id, matched_table, matched_id FROM bank_transactions ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    assert paid == [(1, 1, "2025-03-10"), (2, 0, None), (3, 0, None)]
+    assert links == [(10, "ar_invoices", 1), (11, "ar_invoices", 3)]
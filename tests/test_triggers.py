@@ -0,0 +1,149 @@
+from datetime import date, timedelta
+
+import pytest
+
+import VetFinanceOfficial as app
+
+
+def _rows(conn, sql, params=()):
+    return sorted(conn.execute(sql, params).fetchall())
+
+
+@pytest.fixture
+def staffed(conn):
+    conn.executemany("INSERT INTO employees (name, role, monthly_salary, active) VALUES (?,?,?,1)",
+                     [("Anna", "lekarz", 500000), ("Ewa", "technik", 400000), ("Olga", "technik", 400000),
+                      ("Iga", "technik", 400000)])
+    conn.commit()
+    return conn
+
+
+def _report(conn, day, kasa, terminal, vet, techs):
+    rid = conn.execute("INSERT INTO daily_reports (report_date, shift, staff_vet, staff_tech, kasa, terminal) "
+                       "VALUES (?, 'poranna', ?, ?, ?, ?)", (day, vet, ", ".join(techs), kasa, terminal)).lastrowid
+    conn.executemany("INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?,?)",
+                     [(rid, t) for t in techs])
+    return rid
+
+
+def _churn(conn):
+    """INSERT/UPDATE/DELETE na wszystkich tabelach źródłowych agregatów."""
+    r1 = _report(conn, "2025-01-10", 10000, 2000, "Anna", ["Ewa", "Olga"])
+    r2 = _report(conn, "2025-01-20", 5000, 0, "Anna", ["Ewa"])
+    r3 = _report(conn, "2025-02-03", 7000, 100, "Anna", ["Olga", "Iga"])
+    conn.execute("UPDATE daily_reports SET kasa = 12000 WHERE id=?", (r1,))
+    conn.execute("UPDATE daily_reports SET report_date = '2025-02-01' WHERE id=?", (r2,))
+    conn.execute("UPDATE daily_reports SET staff_vet = 'Gość' WHERE id=?", (r3,))
+    conn.execute("DELETE FROM daily_report_techs WHERE daily_report_id=? AND tech_name='Iga'", (r3,))
+    conn.execute("UPDATE daily_report_techs SET tech_name='Olga' WHERE daily_report_id=?", (r2,))
+    conn.execute("INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?, 'Ewa')", (r3,))
+    conn.execute("UPDATE daily_report_techs SET tech_name='Iga' WHERE daily_report_id=? AND tech_name='Ewa'", (r1,))
+    r4 = _report(conn, "2025-03-05", 3000, 3000, "Anna", ["Ewa"])
+    conn.execute("INSERT INTO daily_report_techs (daily_report_id, tech_name) VALUES (?, 'Iga')", (r4,))
+    conn.execute("DELETE FROM daily_reports WHERE id=?", (r2,))
+    conn.execute("UPDATE employees SET name='Ewa Nowak' WHERE name='Ewa'")
+    conn.execute("DELETE FROM employees WHERE name='Olga'")
+
+    for table, date_col, party in (("ap_invoices", "invoice_date", "supplier"), ("ar_invoices", "issue_date", "company")):
+        ids = [conn.execute(f"INSERT INTO {table} ({date_col}, due_date, {party}, amount, paid, paid_date) "
+                            "VALUES (?,?,?,?,?,?)", row).lastrowid
+               for row in (("2025-01-02", "2025-01-20", "X", 10000, 0, None),
+                           ("2025-01-03", "2025-01-20", "Y", 20000, 1, "2025-01-15"),
+                           ("2025-01-04", "2025-01-20", "Z", 30000, 1, "2025-01-31"))]
+        conn.execute(f"UPDATE {table} SET paid=1, paid_date='2025-02-01' WHERE id=?", (ids[0],))
+        conn.execute(f"UPDATE {table} SET amount=25000 WHERE id=?", (ids[1],))
+        conn.execute(f"UPDATE {table} SET paid_date='2025-02-02' WHERE id=?", (ids[2],))
+        conn.execute(f"UPDATE {table} SET paid=0, paid_date=NULL WHERE id=?", (ids[1],))
+        conn.execute(f"DELETE FROM {table} WHERE id=?", (ids[2],))
+
+    s = conn.execute("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES ('2025-01-05', 100, 200)").lastrowid
+    conn.execute("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES ('2025-01-06', 50, 0)")
+    conn.execute("UPDATE shop_sales SET terminal = 300 WHERE id=?", (s,))
+    e = conn.execute("INSERT INTO shop_expenses (expense_date, amount, paid) VALUES ('2025-01-07', 900, 0)").lastrowid
+    conn.execute("UPDATE shop_expenses SET paid = 1 WHERE id=?", (e,))
+    f = conn.execute("INSERT INTO farm_reports (report_date, typ, kwota) VALUES ('2025-01-08', 'magazyn', 4000)").lastrowid
+    conn.execute("INSERT INTO farm_reports (report_date, typ, kwota) VALUES ('2025-01-09', 'teren', 1000)")
+    conn.execute("UPDATE farm_reports SET typ='teren', report_date='2025-02-08' WHERE id=?", (f,))
+    conn.commit()
+
+
+def test_rollups_match_full_recompute(staffed):
+    _churn(staffed)
+    assert app.check_rollups(staffed).empty
+    live = {t: _rows(staffed, f"SELECT * FROM {t} WHERE cnt<>0 OR amount<>0") for t in ("rollup_daily", "rollup_monthly")}
+    app.rebuild_rollups(staffed)
+    assert live == {t: _rows(staffed, f"SELECT * FROM {t}") for t in ("rollup_daily", "rollup_monthly")}
+    month = dict(_rows(staffed, "SELECT source, amount FROM rollup_monthly WHERE ym='2025-02'"))
+    assert month == {"clinic": 7100, "ap_paid": 10000, "ar_paid": 10000, "farm_teren": 4000}
+
+
+def test_staff_shifts_match_full_recompute(staffed):
+    _churn(staffed)
+    assert app.check_staff_shifts(staffed).empty
+    live = _rows(staffed, "SELECT employee_id, ym, shifts, revenue FROM staff_shifts_monthly WHERE shifts<>0")
+    app.rebuild_staff_shifts(staffed)
+    assert live == _rows(staffed, "SELECT employee_id, ym, shifts, revenue FROM staff_shifts_monthly")
+    anna, iga = (staffed.execute("SELECT id FROM employees WHERE name=?", (n,)).fetchone()[0] for n in ("Anna", "Iga"))
+    assert [r for r in live if r[0] == anna] == [(anna, "2025-01", 1, 14000), (anna, "2025-03", 1, 6000)]
+    assert [r for r in live if r[0] == iga] == [(iga, "2025-01", 1, 14000), (iga, "2025-03", 1, 6000)]
+    # technik po zmianie nazwiska nie pasuje już do raportów, usunięty pracownik nie ma faktów
+    assert {r[0] for r in live} == {anna, iga}
+
+
+def test_salary_history_follows_employee_changes(staffed):
+    today = date.fromisoformat(staffed.execute("SELECT date('now', 'localtime')").fetchone()[0])
+    anna = staffed.execute("SELECT id FROM employees WHERE name='Anna'").fetchone()[0]
+
+    def history():
+        return staffed.execute("SELECT monthly_salary, valid_from, valid_to FROM salary_history "
+                               "WHERE employee_id=? ORDER BY valid_from", (anna,)).fetchall()
+
+    assert history() == [(500000, today.isoformat(), None)]
+    staffed.execute("UPDATE employees SET monthly_salary=600000 WHERE id=?", (anna,))
+    assert history() == [(600000, today.isoformat(), None)]  # zmiana tego samego dnia zastępuje wpis
+    app.set_employee_terms(staffed, anna, 700000, True, date(2025, 1, 1))
+    assert history() == [(700000, "2025-01-01", None)]
+    staffed.execute("UPDATE employees SET active=0 WHERE id=?", (anna,))
+    yesterday = (today - timedelta(days=1)).isoformat()
+    assert history() == [(700000, "2025-01-01", yesterday)]
+    staffed.execute("UPDATE employees SET active=1 WHERE id=?", (anna,))
+    assert history() == [(700000, "2025-01-01", yesterday), (700000, today.isoformat(), None)]
+    staffed.execute("DELETE FROM employees WHERE id=?", (anna,))
+    assert history() == [(700000, "2025-01-01", yesterday)]
+
+
+def test_table_versions_bump_per_changed_row(staffed):
+    def versions():
+        return dict(staffed.execute("SELECT tbl, version FROM table_versions").fetchall())
+
+    before = versions()
+    staffed.executemany("INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES (?,?,?)",
+                        [("2025-01-01", 1, 1), ("2025-01-02", 2, 2)])
+    staffed.execute("UPDATE shop_sales SET kasa = kasa + 1")
+    staffed.execute("DELETE FROM shop_sales WHERE sale_date='2025-01-01'")
+    staffed.execute("SELECT * FROM shop_sales").fetchall()
+    after = versions()
+    assert after["shop_sales"] == before["shop_sales"] + 5
+    changed = {t for t in after if after[t] != before.get(t)}
+    # rollup_* zmieniają triggery agregatów – cache zapytań po nich też musi się unieważnić
+    assert changed <= {"shop_sales", "rollup_daily", "rollup_monthly"}
+
+
+def test_snapshot_dirty_marks_changed_partitions(conn):
+    conn.execute("DELETE FROM snapshot_dirty")
+    a = conn.execute("INSERT INTO ar_invoices (issue_date, due_date, company, amount) "
+                     "VALUES ('2025-01-05', '2025-01-20', 'X', 100)").lastrowid
+    conn.execute("INSERT INTO ar_invoices (issue_date, due_date, company, amount) "
+                 "VALUES ('2025-02-05', '2025-02-20', 'Y', 100)")
+
+    def dirty():
+        return dict(((ym, rewrite) for ym, rewrite in conn.execute(
+            "SELECT ym, rewrite FROM snapshot_dirty WHERE tbl='ar_invoices'")))
+
+    assert dirty() == {"2025-01": 0, "2025-02": 0}  # same dopisane wiersze
+    conn.execute("UPDATE ar_invoices SET issue_date='2025-03-01' WHERE id=?", (a,))
+    assert dirty() == {"2025-01": 1, "2025-02": 0, "2025-03": 1}
+    conn.execute("DELETE FROM ar_invoices WHERE issue_date='2025-02-05'")
+    assert dirty() == {"2025-01": 1, "2025-02": 1, "2025-03": 1}
+    seq = dict(conn.execute("SELECT ym, seq FROM snapshot_dirty WHERE tbl='ar_invoices'").fetchall())
+    assert seq == {"2025-01": 2, "2025-02": 2, "2025-03": 1}
@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+
+import pytest
+
+import VetFinanceOfficial as app
+
+
+@pytest.fixture
+def wq(db_path):
+    wq = app.WriteQueue(db_path)
+    yield wq
+    wq.close()
+
+
+def insert_sale(row):
+    return lambda conn: conn.execute(
+        "INSERT INTO shop_sales (sale_date, kasa, terminal) VALUES (?,?,?)", row).lastrowid
+
+
+def test_resubmitted_form_nonce_is_written_once(wq, conn):
+    row = ("2024-05-01", 12345, 500)
+    key = app.form_write_key("shop_sales_form", "nonce-1")
+    first = wq.write(insert_sale(row), key=key)
+    second = wq.write(insert_sale(row), key=key)
+    assert not first["duplicate"]
+    assert second["duplicate"]
+    assert second["result"] == first["result"]
+    assert conn.execute("SELECT COUNT(*) FROM shop_sales").fetchone()[0] == 1
+
+
+def test_repeated_form_entry_gets_new_nonce(admin_app, tmp_path):
+    at = admin_app
+    at.sidebar.radio[0].set_value("Sklep").run()
+    at.number_input(key="ssk").set_value(120.0)
+
+    def save():
+        next(b for b in at.button if b.label == "💾 Zapisz utarg").click().run()
+        assert not at.exception
+
+    drawn = at.session_state["_form_nonce_shop_sales_form"]
+    save()
+    save()  # drugi, świadomy wpis z tymi samymi wartościami
+    assert at.session_state["_form_nonce_shop_sales_form"] != drawn
+    # kliknięcie, które przerwało przebieg przed wylosowaniem nowego klucza, niesie stary klucz
+    at.session_state["_form_nonce_shop_sales_form"] = drawn
+    save()
+    assert [i.value for i in at.info] == ["Ten formularz został już zapisany – pominięto ponowne wysłanie."]
+    with sqlite3.connect(tmp_path / app.DB) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM shop_sales WHERE kasa = 12000").fetchone()[0] == 2
+
+
+def test_failed_write_is_not_logged(wq, conn):
+    key = app.form_write_key("shop_sales_form", "nonce-1")
+    with pytest.raises(sqlite3.Error):
+        wq.write(lambda c: c.execute("INSERT INTO no_such_table VALUES (1)"), key=key)
+    ack = wq.write(insert_sale(("2024-05-01", 1, 1)), key=key)
+    assert not ack["duplicate"]
+
+
+def test_failing_request_in_batch_rolls_back_only_itself(wq, conn):
+    started, release = threading.Event(), threading.Event()
+
+    def slow(c):
+        started.set()
+        release.wait(5)
+        return insert_sale(("2024-05-01", 1, 1))(c)
+
+    first = wq.submit(slow)
+    assert started.wait(5)
+    # czekają w kolejce, więc wątek piszący weźmie je jedną partią
+    ok1 = wq.submit(insert_sale(("2024-05-02", 2, 2)))
+    bad = wq.submit(lambda c: c.execute("INSERT INTO no_such_table VALUES (1)"))
+    ok2 = wq.submit(insert_sale(("2024-05-03", 3, 3)))
+    release.set()
+    first.result(5)
+    assert ok1.result(5)["batch"] == 3
+    with pytest.raises(sqlite3.Error):
+        bad.result(5)
+    ok2.result(5)
+    assert conn.execute("SELECT COUNT(*) FROM shop_sales").fetchone()[0] == 3
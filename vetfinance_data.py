@@ -0,0 +1,390 @@
+# VetFinance – warstwa danych
+# =============================================================================
+# Zapytania i agregaty bez Streamlit: każda funkcja dostaje jawne połączenie
+# SQLite i zwraca zwartą ramkę. Aplikacja dokłada pulę połączeń, cache per
+# wersje tabel i ładowanie równoległe (service_call / load_parallel);
+# benchmark.py i skrypty mogą wołać je bezpośrednio.
+#
+# `@reads(...)` zapisuje tabele, z których funkcja czyta – po nich aplikacja
+# unieważnia cache wyniku.
+#
+# Kwoty w bazie i w zwracanych ramkach to całkowite grosze (int64); na złote
+# zamieniamy dopiero przy wyświetlaniu (fmt_zl, zl_frame).
+#
+# Ramki z `query(..., schema=...)` mają jawne typy (SCHEMAS): słowniki
+# (category) dla zmian, ról, kategorii i kontrahentów, daty jako datetime64,
+# flagi int8 i teksty w stringach Arrow – zamiast kolumn object.
+# =============================================================================
+
+import sqlite3
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow  # noqa: F401  (stringi Arrow w ramkach)
+    STRING_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    STRING_DTYPE = pd.StringDtype()
+
+PNL_SOURCES = ("clinic", "ar_paid", "ap_paid")
+
+AGING_BOUNDS = (30, 60, 90)
+AGING_NOT_DUE = "Nieprzeterminowane"
+# strona -> (tabela, kolumna daty wystawienia, kolumna kontrahenta)
+AGING_SIDES = {
+    "ar": ("ar_invoices", "issue_date", "company"),
+    "ap": ("ap_invoices", "invoice_date", "supplier"),
+}
+
+# ------------------ KWOTY (grosze) ---------------
+def to_grosze(value) -> int:
+    """Kwota w złotych (z formularza, float/str) -> grosze; połówki od zera."""
+    return int(Decimal(str(value or 0)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def round_grosze(values) -> np.ndarray:
+    # ułamkowe grosze (proporcje, prognozy) -> int64; połówki od zera jak to_grosze
+    v = np.round(np.asarray(values, dtype=float), 6)  # 28.499999999999996 -> 28.5
+    return (np.sign(v) * np.floor(np.abs(v) + 0.5)).astype(np.int64)
+
+def grosze_series(zl: pd.Series) -> pd.Series:
+    """Kwoty w złotych (float, NaN = brak) -> grosze jako Int64 (z <NA>)."""
+    out = pd.Series(pd.NA, index=zl.index, dtype="Int64")
+    ok = zl.notna()
+    out[ok] = round_grosze(zl[ok].to_numpy(dtype=float) * 100)
+    return out
+
+def fmt_zl(grosze) -> str:
+    # dokładnie, bez float: 123456 -> "1,234.56 zł"
+    g = int(grosze)
+    return f"{'-' if g < 0 else ''}{abs(g) // 100:,}.{abs(g) % 100:02d} zł"
+
+def zl_frame(df, cols=None):
+    """Kopia ramki/serii z kwotami w złotych (float) – tylko do tabel i wykresów; `cols=None` = wszystkie liczbowe."""
+    if isinstance(df, pd.Series):
+        return df / 100
+    cols = [c for c in (cols if cols is not None else df.select_dtypes("number").columns) if c in df.columns]
+    return df.assign(**{c: df[c] / 100 for c in cols})
+
+# ------------------ TYPY KOLUMN ------------------
+# tabela -> kolumna -> rodzaj; kolumny spoza schematu zostają jak z SQLite
+SCHEMAS = {
+    "daily_reports": {"report_date": "date", "shift": "category", "staff_vet": "category",
+                      "staff_tech": "text", "kasa": "money", "terminal": "money", "uwagi": "text"},
+    "daily_report_techs": {"tech_name": "category"},
+    "ap_invoices": {"invoice_date": "date", "due_date": "date", "supplier": "category", "number": "text",
+                    "category": "category", "amount": "money", "notes": "text", "paid": "flag",
+                    "paid_date": "date"},
+    "ar_invoices": {"issue_date": "date", "due_date": "date", "company": "category", "number": "text",
+                    "category": "category", "amount": "money", "notes": "text", "paid": "flag",
+                    "paid_date": "date"},
+    "leasings": {"name": "text", "monthly_amount": "money", "start_date": "date", "end_date": "date",
+                 "notes": "text"},
+    "employees": {"name": "category", "role": "category", "monthly_salary": "money", "active": "flag"},
+    "salary_history": {"monthly_salary": "money", "valid_from": "date", "valid_to": "date"},
+    "shop_sales": {"sale_date": "date", "kasa": "money", "terminal": "money"},
+    "shop_expenses": {"expense_date": "date", "amount": "money", "invoice_number": "text",
+                      "supplier": "category", "paid": "flag"},
+    "farm_reports": {"report_date": "date", "typ": "category", "kwota": "money", "uwagi": "text"},
+    "bank_transactions": {"tx_date": "date", "amount": "money", "counterparty": "text", "title": "text",
+                          "account": "category", "ref": "text", "matched_table": "category"},
+    "rollup_daily": {"day": "date", "source": "category", "amount": "money"},
+    "rollup_monthly": {"ym": "category", "source": "category", "amount": "money"},
+    "staff_shifts_monthly": {"ym": "category", "revenue": "money"},
+}
+TYPED_CHUNK_ROWS = 50_000  # tyle wierszy naraz z kursora przy czytaniu z typami
+
+def schema(table: str, **aliases: str) -> dict:
+    """Schemat tabeli; `alias="kolumna"` dokłada typ kolumny wybranej pod inną nazwą (SELECT x AS alias)."""
+    cols = SCHEMAS[table]
+    return {**cols, **{alias: cols[col] for alias, col in aliases.items()}}
+
+def _typed_column(values: pd.Series, kind: str) -> pd.Series:
+    if kind == "date":
+        # ISO 'YYYY-MM-DD' -> dzień; rozdzielczość sekundowa to najgrubsza, jaką trzyma pandas
+        try:
+            return pd.Series(values.to_numpy(dtype="datetime64[s]"), index=values.index, name=values.name)
+        except ValueError:  # tekst spoza ISO (stare wpisy) – wolniejsza ścieżka, błędne jako NaT
+            return pd.to_datetime(values, errors="coerce", format="mixed", dayfirst=True).astype("datetime64[s]")
+    if kind == "flag":
+        return values.fillna(0).astype(np.int8)
+    if kind == "money":
+        return values.astype(np.int64) if values.notna().all() else values.astype("Int64")
+    if kind == "category":
+        return values.astype("category")
+    return values.astype(STRING_DTYPE)
+
+def typed(df: pd.DataFrame, types: dict) -> pd.DataFrame:
+    """Ramka z typami wg schematu (kolumny spoza `types` bez zmian)."""
+    return df.assign(**{c: _typed_column(df[c], kind) for c, kind in types.items() if c in df.columns})
+
+def _concat_typed(chunks: list) -> pd.DataFrame:
+    # słowniki paczek scalane w jeden (union_categoricals) – bez powrotu do object
+    if len(chunks) == 1:
+        return chunks[0]
+    out = pd.concat(chunks, ignore_index=True)
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            out[col] = union_categoricals([c[col] for c in chunks])
+    return out
+
+def reads(*tables: str):
+    def mark(fn):
+        fn.reads = tables
+        return fn
+    return mark
+
+def query(conn: sqlite3.Connection, sql: str, params=(), types: dict = None,
+          chunk_rows: int = TYPED_CHUNK_ROWS) -> pd.DataFrame:
+    """Wynik zapytania jako ramka; z `types` czytana paczkami i typowana paczka po paczce."""
+    # przez conn.execute – połączenia z puli aplikacji mierzą go w profilerze
+    cur = conn.execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    if types is None:
+        return pd.DataFrame.from_records(cur.fetchall(), columns=cols)
+    chunks = []
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if not rows and chunks:
+            break
+        chunks.append(typed(pd.DataFrame.from_records(rows, columns=cols), types))
+        if not rows:
+            break
+    return _concat_typed(chunks)
+
+def month_overlap(months: list, start: pd.Series, end: pd.Series):
+    """Liczba dni wspólnych miesięcy ('YYYY-MM') z okresami [start, end] – macierz miesiąc x okres."""
+    m_start = np.array(months, dtype="datetime64[M]")
+    first = m_start.astype("datetime64[D]")[:, None]
+    last = ((m_start + 1).astype("datetime64[D]") - 1)[:, None]
+    lo = start.to_numpy().astype("datetime64[D]")[None, :]
+    hi = end.to_numpy().astype("datetime64[D]")[None, :]
+    overlap = (np.minimum(hi, last) - np.maximum(lo, first)).astype(np.int64) + 1
+    return np.clip(overlap, 0, None), (last - first).astype(np.int64) + 1
+
+# ------------------ AGREGATY (rollup) ------------
+@reads("rollup_daily")
+def rollup_by_day(conn: sqlite3.Connection, first: date, last: date, sources: tuple) -> pd.DataFrame:
+    """Dzień x źródło z rollup_daily; dni bez wpisów = 0."""
+    marks = ",".join("?" * len(sources))
+    df = query(conn,
+               f"SELECT day, source, amount FROM rollup_daily WHERE day BETWEEN ? AND ? AND source IN ({marks})",
+               (first.isoformat(), last.isoformat(), *sources), {"day": "date", "amount": "money"})
+    return rollup_days_frame(df, first, last, sources)
+
+def rollup_days_frame(df: pd.DataFrame, first: date, last: date, sources) -> pd.DataFrame:
+    """Wiersze (day: datetime64, source, amount) -> dzień x źródło; dni bez wpisów = 0."""
+    days = pd.Index(pd.date_range(first, last).date, name="d")
+    if df.empty:
+        return pd.DataFrame(0, index=days, columns=list(sources), dtype=np.int64)
+    wide = df.pivot_table(index="day", columns="source", values="amount", aggfunc="sum", observed=True)
+    wide.index = wide.index.date
+    return wide.reindex(index=days, columns=list(sources)).fillna(0).astype(np.int64)
+
+@reads("rollup_monthly")
+def rollup_by_month(conn: sqlite3.Connection, months: tuple, sources: tuple) -> pd.DataFrame:
+    """Miesiąc ('YYYY-MM') x źródło z rollup_monthly."""
+    return rollup_months_frame(rollup_month_rows(conn, months, sources), months, sources)
+
+@reads("rollup_monthly")
+def rollup_month_rows(conn: sqlite3.Connection, months: tuple, sources: tuple) -> pd.DataFrame:
+    """Wiersze (ym, source, amount) rollup_monthly z zakresu miesięcy."""
+    marks = ",".join("?" * len(sources))
+    return query(conn,
+                 f"SELECT ym, source, amount FROM rollup_monthly WHERE ym BETWEEN ? AND ? AND source IN ({marks})",
+                 (min(months), max(months), *sources))
+
+def rollup_months_frame(df: pd.DataFrame, months, sources) -> pd.DataFrame:
+    """Wiersze (ym, source, amount) -> miesiąc x źródło; miesiące bez wpisów = 0."""
+    idx = pd.Index(list(months), name="ym")
+    if df.empty:
+        return pd.DataFrame(0, index=idx, columns=list(sources), dtype=np.int64)
+    wide = df.pivot_table(index="ym", columns="source", values="amount", aggfunc="sum", observed=True)
+    wide.index = wide.index.astype(str)
+    wide.columns = wide.columns.astype(str)
+    return wide.reindex(index=idx, columns=list(sources)).fillna(0).astype(np.int64)
+
+@reads("rollup_monthly")
+def farm_month_summary(conn: sqlite3.Connection, y: int, m: int) -> pd.DataFrame:
+    return query(conn,
+                 """SELECT substr(source, 6) AS typ, amount AS suma FROM rollup_monthly
+                    WHERE ym=? AND source IN ('farm_magazyn', 'farm_teren') AND cnt>0 ORDER BY typ""",
+                 (f"{y}-{m:02}",))
+
+# ------------------ LEASINGI I WYNAGRODZENIA -----
+@reads("leasings")
+def leasing_contracts(conn: sqlite3.Connection) -> pd.DataFrame:
+    df = query(conn, "SELECT id, name, monthly_amount, start_date, end_date FROM leasings ORDER BY id",
+               (), schema("leasings"))
+    return df.dropna(subset=["start_date", "end_date"])
+
+def leasing_schedule(contracts: pd.DataFrame, months: list, prorate: bool = False) -> pd.DataFrame:
+    """Macierz miesiąc ('YYYY-MM') x umowa z ratą należną w danym miesiącu.
+
+    Bez `prorate` rata liczy się w całości za każdy miesiąc, który zachodzi na okres umowy;
+    z `prorate` – proporcjonalnie do liczby dni umowy w miesiącu.
+    """
+    idx = pd.Index(list(months), name="ym")
+    if contracts.empty or not months:
+        return pd.DataFrame(index=idx)
+    overlap, days_in_month = month_overlap(list(months), contracts["start_date"], contracts["end_date"])
+    amount = contracts["monthly_amount"].to_numpy(dtype=np.int64)[None, :]
+    if prorate:
+        values = round_grosze(amount * overlap / days_in_month)
+    else:
+        values = np.where(overlap > 0, amount, 0)
+    return pd.DataFrame(values, index=idx, columns=contracts["id"].to_numpy())
+
+@reads("salary_history")
+def salary_periods(conn: sqlite3.Connection) -> pd.DataFrame:
+    # otwarty koniec okresu = daleka przyszłość
+    df = query(conn, "SELECT employee_id, monthly_salary, valid_from, valid_to FROM salary_history",
+               (), schema("salary_history"))
+    df["valid_to"] = df["valid_to"].fillna(pd.Timestamp("2200-01-01"))
+    return df.dropna(subset=["valid_from"])
+
+def salary_costs(periods: pd.DataFrame, months: list, prorate: bool = True) -> pd.Series:
+    """Koszt wynagrodzeń per miesiąc ('YYYY-MM') wg pensji obowiązujących w danym miesiącu.
+
+    Z `prorate` okres zatrudnienia/pensji krótszy niż miesiąc liczy się proporcjonalnie do dni.
+    """
+    idx = pd.Index(list(months), name="ym")
+    if periods.empty or not months:
+        return pd.Series(0, index=idx, dtype=np.int64)
+    return pd.Series(_salary_matrix(periods, months, prorate).sum(axis=1), index=idx, dtype=np.int64)
+
+def _salary_matrix(periods: pd.DataFrame, months, prorate: bool = True) -> np.ndarray:
+    # miesiąc x okres pensji; proporcja liczona i zaokrąglana per pensja, sumy dopiero potem (całkowite)
+    overlap, days_in_month = month_overlap(list(months), periods["valid_from"], periods["valid_to"])
+    amount = periods["monthly_salary"].to_numpy(dtype=np.int64)[None, :]
+    return round_grosze(amount * overlap / days_in_month) if prorate else np.where(overlap > 0, amount, 0)
+
+# ------------------ WYNIK MIESIĘCZNY (P&L) -------
+@reads("rollup_monthly", "leasings", "salary_history")
+def monthly_pnl(conn: sqlite3.Connection, months: tuple) -> pd.DataFrame:
+    """Przychody, koszty i wynik netto per miesiąc ('YYYY-MM'): rollupy + leasingi + płace."""
+    return pnl_frame(rollup_by_month(conn, months, PNL_SOURCES), leasing_contracts(conn), salary_periods(conn), months)
+
+def pnl_frame(rollup: pd.DataFrame, contracts: pd.DataFrame, periods: pd.DataFrame, months) -> pd.DataFrame:
+    df = pd.DataFrame({
+        "Przychody_gabinet": rollup["clinic"],
+        "AR_oplacone":       rollup["ar_paid"],
+        "AP_zaplacone":      rollup["ap_paid"],
+        "Leasingi":          leasing_schedule(contracts, months).sum(axis=1).reindex(rollup.index, fill_value=0).astype(np.int64),
+        "Wynagrodzenia":     salary_costs(periods, months),
+    })
+    return _pnl_totals(df)
+
+def _pnl_totals(df: pd.DataFrame) -> pd.DataFrame:
+    df["Przychody_razem"] = df["Przychody_gabinet"] + df["AR_oplacone"]
+    df["Koszty_razem"]    = df[["AP_zaplacone", "Leasingi", "Wynagrodzenia"]].sum(axis=1)
+    df["Wynik_netto"]     = df["Przychody_razem"] - df["Koszty_razem"]
+    return df
+
+def _by_clinic(values: np.ndarray, codes: np.ndarray, n_clinics: int) -> np.ndarray:
+    # macierz miesiąc x pozycja -> filia x miesiąc (spłaszczona jak indeks (filia, ym))
+    per_clinic = np.zeros((n_clinics, values.shape[0]), dtype=np.int64)
+    np.add.at(per_clinic, codes, values.T.astype(np.int64))
+    return per_clinic.ravel()
+
+def group_pnl_frame(parts: dict, months) -> pd.DataFrame:
+    """pnl_frame wielu filii jednym przebiegiem; parts = filia -> (wiersze rollup_month_rows,
+    leasing_contracts, salary_periods) tej filii. Indeks (filia, ym)."""
+    names = list(parts)
+    idx = pd.MultiIndex.from_product([names, list(months)], names=["filia", "ym"])
+    rows = pd.concat([p[0].assign(filia=name) for name, p in parts.items()], ignore_index=True)
+    if rows.empty:
+        rollup = pd.DataFrame(0, index=idx, columns=list(PNL_SOURCES), dtype=np.int64)
+    else:
+        rows["ym"] = rows["ym"].astype(str)
+        rows["source"] = rows["source"].astype(str)
+        rollup = rows.pivot_table(index=["filia", "ym"], columns="source", values="amount", aggfunc="sum")
+        rollup = rollup.reindex(index=idx, columns=list(PNL_SOURCES)).fillna(0).astype(np.int64)
+    # umowy i okresy pensji wszystkich filii w jednej macierzy, sumy per filia (kod = pozycja w `names`)
+    contracts = pd.concat([p[1] for p in parts.values()], ignore_index=True)
+    periods = pd.concat([p[2] for p in parts.values()], ignore_index=True)
+    leasing_codes = np.repeat(np.arange(len(names)), [len(p[1]) for p in parts.values()])
+    salary_codes = np.repeat(np.arange(len(names)), [len(p[2]) for p in parts.values()])
+    leasing = leasing_schedule(contracts, months).to_numpy() if len(contracts) else np.zeros((len(months), 0))
+    salaries = _salary_matrix(periods, months) if len(periods) else np.zeros((len(months), 0))
+    df = pd.DataFrame({
+        "Przychody_gabinet": rollup["clinic"],
+        "AR_oplacone":       rollup["ar_paid"],
+        "AP_zaplacone":      rollup["ap_paid"],
+        "Leasingi":          _by_clinic(leasing, leasing_codes, len(names)),
+        "Wynagrodzenia":     _by_clinic(salaries, salary_codes, len(names)),
+    }, index=idx)
+    return _pnl_totals(df)
+
+# ------------------ WIEKOWANIE (aging) -----------
+def aging_labels(bounds=AGING_BOUNDS) -> list:
+    edges = [0, *bounds]
+    return [AGING_NOT_DUE] + [f"{a + 1}–{b}" for a, b in zip(edges, edges[1:])] + [f"{edges[-1]}+"]
+
+def aging_detail(conn: sqlite3.Connection, side: str, as_of: date, bounds: tuple = AGING_BOUNDS) -> pd.DataFrame:
+    """Otwarte faktury AR/AP na dzień `as_of` z liczbą dni po terminie i kubełkiem."""
+    table, issue_col, party_col = AGING_SIDES[side]
+    as_of = as_of.isoformat()
+    df = query(conn,
+               f"""SELECT id, {party_col} AS kontrahent, number, {issue_col} AS data_wystawienia, due_date, amount
+                   FROM {table}
+                   WHERE {issue_col} <= ? AND (paid=0 OR paid_date > ?)""",
+               (as_of, as_of), schema(table, kontrahent=party_col, data_wystawienia=issue_col))
+    df["dni_po_terminie"] = (pd.Timestamp(as_of) - df["due_date"]).dt.days.astype("Int64")
+    df["kubełek"] = pd.cut(df["dni_po_terminie"].astype(float), bins=[-np.inf, 0, *bounds, np.inf],
+                           labels=aging_labels(bounds))
+    return df.sort_values("due_date", kind="stable").reset_index(drop=True)
+
+def aging_matrix(detail: pd.DataFrame, bounds: tuple = AGING_BOUNDS) -> pd.DataFrame:
+    """Macierz kontrahent x kubełek (suma kwot) z ramki aging_detail, malejąco po saldzie."""
+    matrix = detail.pivot_table(index="kontrahent", columns="kubełek", values="amount",
+                                aggfunc="sum", fill_value=0, observed=False)
+    matrix = matrix.reindex(columns=aging_labels(bounds), fill_value=0).astype(np.int64)
+    matrix.columns = matrix.columns.astype(str)
+    matrix["Razem"] = matrix.sum(axis=1)
+    return matrix.sort_values("Razem", ascending=False)
+
+# ------------------ ZMIANY PERSONELU -------------
+@reads("staff_shifts_monthly", "employees")
+def staff_shift_stats(conn: sqlite3.Connection, ym_from: str, ym_to: str) -> pd.DataFrame:
+    """Zmiany i utarg zmian per pracownik w miesiącach [ym_from, ym_to] (także pracownicy bez zmian)."""
+    return query(conn,
+                 """SELECT e.id AS employee_id, e.name, e.role, e.monthly_salary, e.active,
+                           IFNULL(SUM(f.shifts), 0) AS shifts_count,
+                           IFNULL(SUM(f.revenue), 0) AS revenue_on_shifts
+                    FROM employees e
+                    LEFT JOIN staff_shifts_monthly f ON f.employee_id = e.id AND f.ym BETWEEN ? AND ?
+                    GROUP BY e.id
+                    ORDER BY revenue_on_shifts DESC, e.name""",
+                 (ym_from, ym_to))
+
+def shift_year(ym: str, years: int) -> str:
+    return f"{int(ym[:4]) - years}{ym[4:]}"
+
+@reads("staff_shifts_monthly", "employees")
+def staff_shift_yoy(conn: sqlite3.Connection, ym_from: str, ym_to: str, years: int = 1) -> pd.DataFrame:
+    """staff_shift_stats z kolumnami *_prev za ten sam okres `years` lat wcześniej i zmianą utargu w %."""
+    cur = staff_shift_stats(conn, ym_from, ym_to)
+    prev = staff_shift_stats(conn, shift_year(ym_from, years), shift_year(ym_to, years))
+    return shift_yoy_frame(cur, prev)
+
+def shift_yoy_frame(cur: pd.DataFrame, prev: pd.DataFrame) -> pd.DataFrame:
+    df = cur.merge(prev[["employee_id", "shifts_count", "revenue_on_shifts"]], on="employee_id",
+                   how="left", suffixes=("", "_prev"))
+    base = df["revenue_on_shifts_prev"].where(df["revenue_on_shifts_prev"] != 0)
+    df["zmiana_utargu_%"] = ((df["revenue_on_shifts"] / base - 1) * 100).round(1)
+    return df
+
+# ------------------ DO ZAPŁATY -------------------
+@reads("ap_invoices")
+def due_list(conn: sqlite3.Connection, date_from: date, date_to: date) -> pd.DataFrame:
+    """Nieopłacone faktury AP z terminem w [date_from, date_to], od najbliższego terminu."""
+    return query(conn,
+                 """SELECT id, supplier, number, amount, due_date
+                    FROM ap_invoices
+                    WHERE paid=0 AND due_date BETWEEN ? AND ?
+                    ORDER BY due_date ASC""",
+                 (date_from.isoformat(), date_to.isoformat()), schema("ap_invoices"))
@@ -0,0 +1,342 @@
+# VetFinance – snapshot kolumnowy (Parquet) i tryb analityczny
+# =============================================================================
+# Tabele bazy trafiają do plików Parquet podzielonych na partycje rok/miesiąc:
+#   <katalog>/<tabela>/year=YYYY/month=MM/part-NNNNNN.parquet
+# (tabele słownikowe bez daty – leasingi, pracownicy, płace – w <tabela>/all).
+#
+# Triggery znaczą zmienione partycje w snapshot_dirty. Odświeżenie bierze tylko
+# je: same INSERT-y dopisują do partycji nowy plik z wierszami o id większym niż
+# ostatnio zapisane, UPDATE/DELETE przepisują partycję od nowa. Manifest
+# (_manifest.json) zna pliki każdej partycji, więc odczyt zakresu miesięcy
+# otwiera tylko potrzebne pliki. Zastąpione pliki są kasowane dopiero przy
+# następnym odświeżeniu – czytelnik ze starszym manifestem zdąży je przeczytać.
+#
+# Funkcje analityczne na dole mają te same nazwy i wyniki co ich odpowiedniki
+# w vetfinance_data, ale zamiast połączenia SQLite biorą Snapshot – raporty nie
+# konkurują wtedy z zapisami formularzy o plik bazy.
+#
+# Uruchom (np. z crona):
+#   python vetfinance_snapshot.py --db VetFinanceDB1.db --out VetFinanceDB1.snapshot
+# =============================================================================
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+import vetfinance_data as vd
+
+try:  # wymagane tylko przez snapshot
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+# tabela -> kolumna daty wyznaczająca partycję (None = jedna partycja "all")
+SNAPSHOT_TABLES = {
+    "daily_reports": "report_date",
+    "ap_invoices": "invoice_date",
+    "ar_invoices": "issue_date",
+    "shop_sales": "sale_date",
+    "shop_expenses": "expense_date",
+    "farm_reports": "report_date",
+    "bank_transactions": "tx_date",
+    "rollup_daily": "day",
+    "rollup_monthly": "ym",
+    "staff_shifts_monthly": "ym",
+    "leasings": None,
+    "employees": None,
+    "salary_history": None,
+}
+# tabele z rosnącym `id` – nowe wiersze można dopisać bez przepisywania partycji
+APPEND_TABLES = ("daily_reports", "ap_invoices", "ar_invoices", "shop_sales", "shop_expenses",
+                 "farm_reports", "bank_transactions")
+MANIFEST = "_manifest.json"
+ALL = ""  # klucz partycji tabel bez daty
+ARROW_TYPES = {
+    "date": "date32", "category": "dictionary", "flag": "int8", "money": "int64", "text": "string",
+}
+
+_LOCK = threading.Lock()  # jedno odświeżenie naraz w procesie
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError("Snapshot Parquet wymaga pakietu pyarrow.")
+
+def partition_ym(table: str) -> str:
+    """Wyrażenie SQL klucza partycji ('YYYY-MM' albo '' bez daty) dla wiersza `{r}`."""
+    col = SNAPSHOT_TABLES[table]
+    return f"IFNULL(substr({{r}}.{col}, 1, 7), '')" if col else "''"
+
+def partition_dir(out_dir: str, table: str, ym: str) -> str:
+    if not ym:
+        return os.path.join(out_dir, table, "all")
+    return os.path.join(out_dir, table, f"year={ym[:4]}", f"month={ym[5:7]}")
+
+# ------------------ ZAPIS ------------------------
+def _arrow_type(kind: str, declared: str):
+    kind = ARROW_TYPES.get(kind)
+    if kind == "date32":
+        return pa.date32()
+    if kind == "dictionary":
+        return pa.dictionary(pa.int32(), pa.string())
+    if kind:
+        return getattr(pa, kind)()
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return pa.int64()
+    if "REAL" in declared or "FLOA" in declared:
+        return pa.float64()
+    return pa.string()
+
+def arrow_schema(conn: sqlite3.Connection, table: str):
+    kinds = vd.SCHEMAS.get(table, {})
+    cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    return pa.schema([(name, _arrow_type(kinds.get(name), declared)) for _cid, name, declared, *_ in cols])
+
+def load_manifest(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generation": 0, "updated_at": None, "tables": {}, "garbage": []}
+
+def _save_manifest(out_dir: str, manifest: dict):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _write_part(conn, out_dir: str, table: str, ym: str, schema, generation: int, after_id: int = None):
+    # wiersze partycji (albo tylko nowsze niż after_id) -> nowy plik; zwraca (plik, wiersze, max id)
+    col = SNAPSHOT_TABLES[table]
+    where, params = [], []
+    if col and ym:
+        where.append(f"{col} >= ? AND {col} < ?")  # 'YYYY-MM' <= '2025-03-15' < 'YYYY-MM~' – zakres po indeksie
+        params += [ym, ym + "~"]
+    elif col:
+        where.append(f"{col} IS NULL")
+    if after_id is not None:
+        where.append("id > ?")
+        params.append(after_id)
+    sql = f"SELECT * FROM {table}" + (f" WHERE {' AND '.join(where)}" if where else "")
+    df = vd.query(conn, sql, params, vd.SCHEMAS.get(table, {}))
+    if df.empty:
+        return None, 0, after_id
+    folder = partition_dir(out_dir, table, ym)
+    os.makedirs(folder, exist_ok=True)
+    name = f"part-{generation:06d}.parquet"
+    tmp = os.path.join(folder, name + ".tmp")
+    pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False), tmp)
+    os.replace(tmp, os.path.join(folder, name))
+    max_id = int(df["id"].max()) if "id" in df.columns else None
+    return os.path.relpath(os.path.join(folder, name), out_dir), len(df), max_id
+
+def _drop_files(out_dir: str, files: list):
+    for rel in files:
+        try:
+            os.remove(os.path.join(out_dir, rel))
+        except FileNotFoundError:
+            pass
+
+def refresh(conn: sqlite3.Connection, out_dir: str) -> dict:
+    """Zapisuje zmienione partycje (wszystkie przy pierwszym przebiegu tabeli); zwraca statystyki i
+    listę obsłużonych wpisów snapshot_dirty (`done`) do skasowania przez clear_dirty()."""
+    _require_pyarrow()
+    t0 = time.perf_counter()
+    stats = {"partitions": 0, "appended": 0, "rewritten": 0, "rows": 0, "done": []}
+    with _LOCK:
+        os.makedirs(out_dir, exist_ok=True)
+        manifest = load_manifest(out_dir)
+        generation = manifest["generation"] + 1
+        # pliki zastąpione w poprzednim przebiegu – czytelnik z tamtym manifestem już je porzucił
+        _drop_files(out_dir, manifest.get("garbage", []))
+        garbage = []
+        # jedna transakcja odczytu (WAL): znaczniki i dane z tej samej chwili
+        conn.execute("BEGIN")
+        try:
+            dirty = {}
+            for tbl, ym, rewrite, seq in conn.execute("SELECT tbl, ym, rewrite, seq FROM snapshot_dirty"):
+                dirty.setdefault(tbl, {})[ym] = (rewrite, seq)
+            for table in SNAPSHOT_TABLES:
+                parts = manifest["tables"].get(table)
+                todo = dirty.get(table, {})
+                schema = arrow_schema(conn, table)
+                if parts is None:
+                    # pierwszy raz: cała tabela, partycja po partycji
+                    parts = {}
+                    col = SNAPSHOT_TABLES[table]
+                    yms = [r[0] for r in conn.execute(
+                        f"SELECT DISTINCT {partition_ym(table).format(r=table)} FROM {table}")] if col else [ALL]
+                    todo = {**{ym: (1, None) for ym in yms}, **{ym: (1, seq) for ym, (_, seq) in todo.items()}}
+                    os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+                    pq.write_table(schema.empty_table(), os.path.join(out_dir, table, "_schema.parquet"))
+                for ym, (rewrite, seq) in sorted(todo.items()):
+                    entry = parts.get(ym)
+                    append = not rewrite and entry is not None and table in APPEND_TABLES
+                    path, rows, max_id = _write_part(conn, out_dir, table, ym, schema, generation,
+                                                     entry["max_id"] if append else None)
+                    if append:
+                        if path:
+                            entry["files"].append(path)
+                            entry["rows"] += rows
+                            entry["max_id"] = max_id
+                        stats["appended"] += 1
+                    else:
+                        old = entry["files"] if entry else []
+                        if path:
+                            parts[ym] = {"files": [path], "rows": rows, "max_id": max_id}
+                        else:
+                            parts.pop(ym, None)
+                        garbage += old
+                        stats["rewritten"] += 1
+                    stats["partitions"] += 1
+                    stats["rows"] += rows
+                    if seq is not None:
+                        stats["done"].append((table, ym, seq))
+                manifest["tables"][table] = parts
+        finally:
+            conn.rollback()
+        manifest["generation"] = generation
+        manifest["garbage"] = garbage
+        manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        _save_manifest(out_dir, manifest)
+    stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return stats
+
+def clear_dirty(conn: sqlite3.Connection, done: list) -> int:
+    # tylko wpisy niezmienione od odczytu (ten sam seq) – nowszy zapis zostaje na następny przebieg
+    cur = conn.executemany("DELETE FROM snapshot_dirty WHERE tbl=? AND ym=? AND seq=?", done)
+    return cur.rowcount
+
+# ------------------ ODCZYT -----------------------
+class Snapshot:
+    """Widok snapshotu wg manifestu z chwili otwarcia (`generation` rośnie przy każdym odświeżeniu)."""
+
+    def __init__(self, out_dir: str):
+        _require_pyarrow()
+        self.dir = out_dir
+        self.manifest = load_manifest(out_dir)
+        self._schemas = {}
+
+    @property
+    def generation(self) -> int:
+        return self.manifest["generation"]
+
+    @property
+    def ready(self) -> bool:
+        return all(t in self.manifest["tables"] for t in SNAPSHOT_TABLES)
+
+    def files(self, table: str, ym_from: str = None, ym_to: str = None) -> list:
+        parts = self.manifest["tables"].get(table, {})
+        return [os.path.join(self.dir, f) for ym, entry in sorted(parts.items())
+                if (ym_from is None or ym >= ym_from) and (ym_to is None or ym <= ym_to)
+                for f in entry["files"]]
+
+    def read(self, table: str, columns: list = None, ym_from: str = None, ym_to: str = None) -> pd.DataFrame:
+        """Kolumny tabeli z partycji w zakresie miesięcy [ym_from, ym_to] (daty jako datetime64)."""
+        # jawny schemat: bez odczytu stopki każdego pliku przed skanem (partycje są małe, a jest ich dużo)
+        data = ds.dataset(self.files(table, ym_from, ym_to), schema=self.schema(table),
+                          format="parquet").to_table(columns=columns)
+        return data.to_pandas(date_as_object=False, types_mapper={pa.string(): vd.STRING_DTYPE}.get)
+
+    def schema(self, table: str):
+        if table not in self._schemas:
+            self._schemas[table] = pq.read_schema(os.path.join(self.dir, table, "_schema.parquet"))
+        return self._schemas[table]
+
+    def stats(self) -> dict:
+        tables = self.manifest["tables"]
+        return {"katalog": self.dir, "generacja": self.generation, "stan_na": self.manifest["updated_at"],
+                "partycje": sum(len(p) for p in tables.values()),
+                "pliki": sum(len(e["files"]) for p in tables.values() for e in p.values()),
+                "wiersze": sum(e["rows"] for p in tables.values() for e in p.values())}
+
+_opened = {}
+
+def open_snapshot(out_dir: str) -> Snapshot:
+    """Snapshot z katalogu; ponownie czyta manifest dopiero po jego zmianie."""
+    try:
+        mtime = os.stat(os.path.join(out_dir, MANIFEST)).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    snap = _opened.get(out_dir)
+    if snap is None or snap[0] != mtime:
+        snap = _opened[out_dir] = (mtime, Snapshot(out_dir))
+    return snap[1]
+
+# ------------------ AGREGATY ZE SNAPSHOTU --------
+# te same nazwy i wyniki co w vetfinance_data, pierwszy argument: Snapshot
+def _ym(d: date) -> str:
+    return d.isoformat()[:7]
+
+def rollup_by_day(snap: Snapshot, first: date, last: date, sources: tuple) -> pd.DataFrame:
+    df = snap.read("rollup_daily", ["day", "source", "amount"], _ym(first), _ym(last))
+    df = df[df["source"].isin(sources) & df["day"].between(pd.Timestamp(first), pd.Timestamp(last))]
+    return vd.rollup_days_frame(df, first, last, sources)
+
+def rollup_by_month(snap: Snapshot, months: tuple, sources: tuple) -> pd.DataFrame:
+    return vd.rollup_months_frame(rollup_month_rows(snap, months, sources), months, sources)
+
+def rollup_month_rows(snap: Snapshot, months: tuple, sources: tuple) -> pd.DataFrame:
+    df = snap.read("rollup_monthly", ["ym", "source", "amount"], min(months), max(months))
+    return df[df["source"].isin(sources)].reset_index(drop=True)
+
+def farm_month_summary(snap: Snapshot, y: int, m: int) -> pd.DataFrame:
+    ym = f"{y}-{m:02}"
+    df = snap.read("rollup_monthly", ["source", "amount", "cnt"], ym, ym)
+    df = df[df["source"].isin(["farm_magazyn", "farm_teren"]) & (df["cnt"] > 0)]
+    out = pd.DataFrame({"typ": df["source"].astype(str).str.slice(5), "suma": df["amount"]})
+    return out.sort_values("typ").reset_index(drop=True)
+
+def leasing_contracts(snap: Snapshot) -> pd.DataFrame:
+    df = snap.read("leasings", ["id", "name", "monthly_amount", "start_date", "end_date"])
+    return df.sort_values("id").dropna(subset=["start_date", "end_date"]).reset_index(drop=True)
+
+def salary_periods(snap: Snapshot) -> pd.DataFrame:
+    df = snap.read("salary_history", ["employee_id", "monthly_salary", "valid_from", "valid_to"])
+    df["valid_to"] = df["valid_to"].fillna(pd.Timestamp("2200-01-01"))
+    return df.dropna(subset=["valid_from"])
+
+def monthly_pnl(snap: Snapshot, months: tuple) -> pd.DataFrame:
+    return vd.pnl_frame(rollup_by_month(snap, months, vd.PNL_SOURCES), leasing_contracts(snap),
+                        salary_periods(snap), months)
+
+def staff_shift_stats(snap: Snapshot, ym_from: str, ym_to: str) -> pd.DataFrame:
+    emp = snap.read("employees", ["id", "name", "role", "monthly_salary", "active"])
+    facts = snap.read("staff_shifts_monthly", ["employee_id", "shifts", "revenue"], ym_from, ym_to)
+    per_emp = facts.groupby("employee_id")[["shifts", "revenue"]].sum()
+    df = emp.rename(columns={"id": "employee_id"}).astype({"name": str, "role": str, "active": np.int64})
+    df["shifts_count"] = df["employee_id"].map(per_emp["shifts"]).fillna(0).astype(np.int64)
+    df["revenue_on_shifts"] = df["employee_id"].map(per_emp["revenue"]).fillna(0).astype(np.int64)
+    return (df.sort_values(["revenue_on_shifts", "name"], ascending=[False, True], kind="stable")
+              .reset_index(drop=True))
+
+def staff_shift_yoy(snap: Snapshot, ym_from: str, ym_to: str, years: int = 1) -> pd.DataFrame:
+    return vd.shift_yoy_frame(staff_shift_stats(snap, ym_from, ym_to),
+                              staff_shift_stats(snap, vd.shift_year(ym_from, years), vd.shift_year(ym_to, years)))
+
+# ------------------ CLI --------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Odświeża snapshot Parquet bazy VetFinance.")
+    ap.add_argument("--db", default="VetFinanceDB1.db")
+    ap.add_argument("--out", default="VetFinanceDB1.snapshot")
+    args = ap.parse_args(argv)
+    conn = sqlite3.connect(args.db, timeout=10.0)
+    try:
+        stats = refresh(conn, args.out)
+        with conn:
+            clear_dirty(conn, stats.pop("done"))
+    finally:
+        conn.close()
+    print(json.dumps(stats, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()